@@ -1,16 +1,24 @@
 import logging
-from typing import Dict, List, Any, TypedDict
-from langgraph.graph import StateGraph, START, END
-from langchain_gigachat import GigaChat
-from langchain_core.messages import HumanMessage
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Any, Optional, TypedDict
 import json
 import asyncio
+import contextvars
+import os
+import time
+import uuid
 import config
 from utils.logger import get_logger
 from utils.vector_db import VectorDatabase
 from utils.web_parser import WebParser
 from utils.text_processor import TextProcessor
+from utils.llm_cache import LLMCache
+from utils.source_loader import iter_source_urls, normalize_url
+from utils.ingestion import SourceIngestor
+from utils.retrieval import fixed_context, select_context
+from utils.run_store import RunStore
+from utils.gigachat_client import estimate_tokens, get_gigachat_manager
+from utils import llm_trace, metrics
 import re
 
 # Настройка логирования
@@ -19,66 +27,134 @@ agent_logger = get_logger("agent")
 class AgentState(TypedDict):
     """Состояние агента для LangGraph"""
     user_query: str
+    run_id: str
     questions: List[str]
-    sources: List[str]
+    # Списки источников хранятся в RunStore по run_id, чтобы не копироваться в каждую контрольную точку
+    total_sources: int
     processed_sources: int
     documents: int
     question_answers: List[Dict[str, str]]
     final_report: str
     current_step: str
     error: str
+    llm_cache_hits: int
+    llm_cache_misses: int
+    timings: Dict[str, float]
+    # Прогресс индексации для возобновления запуска: число источников, которых не было в БД
+    # (None — ещё не определено), и позиция в этом списке
+    pending_count: Optional[int]
+    sources_cursor: int
+    error_details: List[Dict[str, str]]
+
+# Получатель частей итогового отчета при потоковой генерации (задаётся на время process_query)
+_report_stream: contextvars.ContextVar = contextvars.ContextVar("report_stream", default=None)
+
+# Циклы по источникам и вопросам выполняются отдельными шагами графа, поэтому лимит шагов LangGraph увеличен
+_RECURSION_LIMIT = 100_000
 
 class InformationSummarizerAgent:
     """Агент-суммаризатор информации с использованием LangGraph и GigaChat"""
 
-    def __init__(self):
-        # Инициализация GigaChat для LLM операций с username/password авторизацией
-        self.llm = GigaChat(
-            user=config.GIGACHAT_USERNAME,
-            password=config.GIGACHAT_PASSWORD,
-            base_url=config.GIGACHAT_BASE_URL,
-            auth_url=config.GIGACHAT_AUTH_URL,
-            scope=config.GIGACHAT_SCOPE,
-            verify_ssl_certs=config.GIGACHAT_VERIFY_SSL,
-            profanity_check=config.GIGACHAT_PROFANITY_CHECK,
-	    temperature=0.1
-        )
+    def __init__(self, llm=None, vector_db: VectorDatabase = None, web_parser: WebParser = None,
+                 text_processor: TextProcessor = None):
+        # GigaChat для LLM операций: общий на процесс клиент (токен, пул соединений, бюджет запросов)
+        # (компоненты можно передать явно, например заглушки для бенчмарков)
+        self.gigachat = get_gigachat_manager()
+        self.llm = llm or self.gigachat.chat_model()
 
         # Инициализация вспомогательных модулей
-        self.vector_db = VectorDatabase()
-        self.web_parser = WebParser()
-        self.text_processor = TextProcessor()
+        self.vector_db = vector_db or VectorDatabase()
+        self.web_parser = web_parser or WebParser()
+        self.text_processor = text_processor or TextProcessor()
+        self.llm_cache = LLMCache() if config.LLM_CACHE_ENABLED else None
+        self.ingestor = SourceIngestor(self.vector_db, self.web_parser, self.text_processor)
+        self.checkpointer = self._create_checkpointer()
+        self.run_store = RunStore(config.CHECKPOINT_PATH if self.checkpointer is not None else None)
 
         # Граф без sources_path по умолчанию (для CLI)
         self.graph = self._create_graph()
 
         agent_logger.info("Агент-суммаризатор инициализирован с GigaChat")
 
-    def _create_graph(self, sources_path: str = None) -> StateGraph:
-        """Создает граф состояний для агента"""
+    def _create_graph(self, sources_path: str = None, ingest: bool = True) -> 'StateGraph':
+        """Создает граф состояний для агента.
+
+        ingest=False — граф без загрузки и обработки источников (пакетный режим: источники
+        уже проиндексированы общим проходом, список источников передаётся в начальном состоянии)"""
+        from langgraph.graph import StateGraph, START, END
+
         workflow = StateGraph(AgentState)
 
-        # Добавляем узлы
-        workflow.add_node("generate_questions", self._generate_questions)
+        # Добавляем узлы (с замером времени выполнения каждого шага)
+        workflow.add_node("generate_questions", self._timed("generate_questions", self._generate_questions))
+        workflow.add_node("answer_questions", self._timed("answer_questions", self._answer_questions))
+        workflow.add_node("generate_report", self._timed("generate_report", self._generate_report))
+        workflow.add_edge(START, "generate_questions")
+        # Ответы строятся по CHECKPOINT_ANSWERS_PER_STEP вопросов за шаг, чтобы готовые ответы сохранялись в контрольной точке
+        workflow.add_conditional_edges("answer_questions", self._next_after_answers,
+                                       ["answer_questions", "generate_report"])
+        workflow.add_edge("generate_report", END)
+
+        if not ingest:
+            workflow.add_edge("generate_questions", "answer_questions")
+            return workflow.compile()  # type: ignore
+
         if sources_path is not None:
-            workflow.add_node("load_sources", lambda state: self._load_sources(state, sources_path))
+            workflow.add_node("load_sources", self._timed("load_sources", lambda state: self._load_sources(state, sources_path)))
         else:
-            workflow.add_node("load_sources", self._load_sources)
-        workflow.add_node("process_sources", self._process_sources)
-        workflow.add_node("answer_questions", self._answer_questions)
-        workflow.add_node("generate_report", self._generate_report)
+            workflow.add_node("load_sources", self._timed("load_sources", self._load_sources))
+        workflow.add_node("process_sources", self._timed("process_sources", self._process_sources))
 
         # Добавляем рёбра
-        workflow.add_edge(START, "generate_questions")
         workflow.add_edge("generate_questions", "load_sources")
         workflow.add_edge("load_sources", "process_sources")
-        workflow.add_edge("process_sources", "answer_questions")
-        workflow.add_edge("answer_questions", "generate_report")
-        workflow.add_edge("generate_report", END)
+        # Источники индексируются по CHECKPOINT_SOURCES_PER_STEP за шаг (прогресс сохраняется в контрольной точке)
+        workflow.add_conditional_edges("process_sources", self._next_after_sources,
+                                       ["process_sources", "answer_questions"])
 
-        compiled_graph = workflow.compile()
+        compiled_graph = workflow.compile(checkpointer=self.checkpointer)
         return compiled_graph  # type: ignore
 
+    @staticmethod
+    def _create_checkpointer():
+        """Локальное хранилище контрольных точек LangGraph (SQLite) для возобновления прерванных запусков"""
+        if not config.CHECKPOINT_ENABLED:
+            return None
+        import sqlite3
+        from langgraph.checkpoint.sqlite import SqliteSaver
+
+        directory = os.path.dirname(config.CHECKPOINT_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SqliteSaver(sqlite3.connect(config.CHECKPOINT_PATH, check_same_thread=False))
+
+    @staticmethod
+    def _next_after_sources(state: AgentState) -> str:
+        if state.get("sources_cursor", 0) < (state.get("pending_count") or 0):
+            return "process_sources"
+        return "answer_questions"
+
+    @staticmethod
+    def _next_after_answers(state: AgentState) -> str:
+        if len(state.get("question_answers") or []) < len(state.get("questions") or []):
+            return "answer_questions"
+        return "generate_report"
+
+    def _timed(self, name: str, node):
+        """Оборачивает узел графа: время выполнения (сек) сохраняется в state["timings"]"""
+        def wrapper(state: AgentState) -> AgentState:
+            start = time.perf_counter()
+            state = node(state)
+            timings = dict(state.get("timings") or {})
+            elapsed = time.perf_counter() - start
+            metrics.NODE_DURATION.observe(elapsed, node=name)
+            # Узел может выполняться несколькими шагами (циклы по источникам и вопросам) — время суммируется
+            timings[name] = round(timings.get(name, 0) + elapsed, 3)
+            state["timings"] = timings
+            agent_logger.info(f"Шаг '{name}' выполнен за {timings[name]:.2f} с")
+            return state
+        return wrapper
+
     def _generate_questions(self, state: AgentState) -> AgentState:
         """Генерирует вопросы на основе пользовательского запроса"""
         try:
@@ -105,14 +181,11 @@ class InformationSummarizerAgent:
             }}
             """
 
-            message = HumanMessage(content=prompt)
-            agent_logger.info(f"[LLM REQUEST] PROMPT: {prompt.strip()}")
-            response = self.llm.invoke([message])
-            agent_logger.info(f"[LLM RESPONSE] RESPONSE: {response.content.strip()}")
+            response_content = self._invoke_llm(prompt, state, 'generate_questions', cache=True)
 
             # Парсим JSON ответ
             try:
-                clean_content = self.clean_json_str(response.content)
+                clean_content = self.clean_json_str(response_content)
                 result = json.loads(clean_content)
                 questions = result.get("questions", [])
 
@@ -138,6 +211,54 @@ class InformationSummarizerAgent:
 
         return state
 
+    def _invoke_llm(self, prompt: str, state: AgentState, node: str, cache: bool = False,
+                    on_chunk: Callable[[str], None] = None) -> str:
+        """Вызывает LLM с логированием; детерминированные вызовы берутся из кэша при совпадении промпта.
+        Если передан on_chunk, ответ запрашивается потоково и передаётся ему по частям"""
+        cache_key = None
+        if cache and self.llm_cache is not None:
+            params = {'temperature': getattr(self.llm, 'temperature', None)}
+            cache_key = LLMCache.make_key(str(getattr(self.llm, 'model', None)), params, prompt)
+            cached = self.llm_cache.get(cache_key)
+            if cached is not None:
+                metrics.LLM_CACHE_REQUESTS.inc(result='hit')
+                state["llm_cache_hits"] = state.get("llm_cache_hits", 0) + 1
+                agent_logger.info("Ответ LLM взят из кэша")
+                if on_chunk is not None:
+                    on_chunk(cached)
+                return cached
+            metrics.LLM_CACHE_REQUESTS.inc(result='miss')
+            state["llm_cache_misses"] = state.get("llm_cache_misses", 0) + 1
+
+        from langchain_core.messages import HumanMessage
+
+        message = HumanMessage(content=prompt)
+        trace_id = llm_trace.trace_request(node, prompt)
+        metrics.LLM_PROMPT_CHARS.observe(len(prompt), node=node)
+        streaming = on_chunk is not None and hasattr(self.llm, 'stream')
+        parts = []
+
+        def request() -> str:
+            if streaming:
+                for chunk in self.llm.stream([message]):
+                    parts.append(chunk.content)
+                    on_chunk(chunk.content)
+                return "".join(parts)
+            return self.llm.invoke([message]).content
+
+        with metrics.LLM_DURATION.time(node=node):
+            # Повтор при 429/5xx возможен только до первой части потокового ответа
+            content = self.gigachat.call(request, 'llm', estimate_tokens(prompt), estimate_tokens,
+                                         retryable=lambda: not parts)
+        if on_chunk is not None and not streaming:
+            on_chunk(content)
+        metrics.LLM_RESPONSE_CHARS.observe(len(content), node=node)
+        llm_trace.trace_response(trace_id, node, content)
+
+        if cache_key is not None:
+            self.llm_cache.put(cache_key, content)
+        return content
+
     def clean_json_str(self, s: str) -> str:
         """Удаляет markdown-блоки (```), лишние кавычки и пробелы для корректного парсинга JSON."""
         s = s.strip()
@@ -151,10 +272,10 @@ class InformationSummarizerAgent:
         return s
 
     def normalize_url(self, url: str) -> str:
-        return url.strip().rstrip('/').lower()
+        return normalize_url(url)
 
     def _load_sources(self, state: AgentState, sources_path: str = None) -> AgentState:
-        """Загружает список источников из Excel файла"""
+        """Загружает список источников (xlsx, csv, txt, jsonl)"""
         try:
             state["current_step"] = "Загрузка источников"
             agent_logger.info(f"Шаг 2: {state['current_step']}")
@@ -167,100 +288,73 @@ class InformationSummarizerAgent:
                     raise ValueError("Путь к файлу источников не задан!")
             else:
                 excel_path = sources_path
-            df = pd.read_excel(excel_path)
-
-            # Предполагаем, что URL находятся в первой колонке
-            if 'url' in df.columns:
-                urls = df['url'].dropna().tolist()
-            elif 'URL' in df.columns:
-                urls = df['URL'].dropna().tolist()
-            else:
-                # Берем первую колонку
-                urls = df.iloc[:, 0].dropna().tolist()
-
-            # Нормализуем все URL
-            state["sources"] = [self.normalize_url(u) for u in urls]
+            # Колонка 'url'/'URL' или первая колонка; URL нормализуются, повторы отбрасываются при чтении
+            sources = list(iter_source_urls(excel_path))
+            self._put_sources(state, "sources", sources)
+            state["total_sources"] = len(sources)
             state["processed_sources"] = 0
 
-            agent_logger.info(f"Список источников (state['sources']): {state['sources']}")
-            agent_logger.info(f"Загружено {len(urls)} источников из {excel_path}")
+            agent_logger.debug(f"Список источников: {sources}")
+            agent_logger.info(f"Загружено {len(sources)} источников из {excel_path}")
 
         except Exception as e:
             agent_logger.error(f"Ошибка при загрузке источников: {e}")
             state["error"] = str(e)
-            state["sources"] = []
+            self._put_sources(state, "sources", [])
+            state["total_sources"] = 0
 
         return state
 
     def _process_sources(self, state: AgentState) -> AgentState:
-        """Обрабатывает каждый источник: парсинг, разбиение на блоки, создание эмбеддингов"""
+        """Обрабатывает очередную порцию источников: парсинг, разбиение на блоки, создание эмбеддингов"""
         try:
             state["current_step"] = "Обработка источников"
-            agent_logger.info(f"Шаг 3: {state['current_step']}")
-            total_documents = 0  # Счетчик общего количества документов
-
-            # Обрабатываем только те источники, которые есть в текущем списке state["sources"]
-            current_sources = list(state["sources"])
-            for i, url in enumerate(current_sources, 1):
-                try:
-                    agent_logger.info(f"Обработка источника {i}/{len(state['sources'])}: {url}")
-                    
-                    # Проверяем существование URL в БД
-                    if self.vector_db.url_exists(url):
-                        processing_date = self.vector_db.get_processing_date(url)
-                        agent_logger.info(f"Ссылка уже обработана: {url} (дата обработки: {processing_date})")
-                        continue
-                    
-                    # Парсим веб-страницу
-                    content = self.web_parser.parse_url(url)
-                    if not content:
-                        agent_logger.warning(f"Не удалось извлечь контент из {url}")
-                        continue
-                    
-                    # Разбиваем текст на блоки
-                    chunks = self.text_processor.chunk_text(content, url)
-                    if not chunks:
-                        agent_logger.warning(f"Не удалось разбить контент из {url} на блоки")
-                        continue
-                    
-                    # Немедленно добавляем чанки в векторную БД
-                    agent_logger.info(f"Добавление {len(chunks)} блоков из источника {url} в векторную БД")
-                    self.vector_db.add_documents(chunks)
-                    total_documents += len(chunks)
-                    state["processed_sources"] += 1
-                    agent_logger.info(f"Источник {url} обработан, добавлено {len(chunks)} блоков")
-                    
-                except Exception as e:
-                    agent_logger.error(f"Ошибка при обработке источника {url}: {e}")
-                    # Ошибка была в том, что после блока except не было обработки ошибки в state.
-                    # Исправлено: теперь при ошибке в обработке источника, ошибка логируется и добавляется в state["error_details"].
-                    if "error_details" not in state:
-                        state["error_details"] = []
-                    state["error_details"].append({"url": url, "error": str(e)})
-                    continue
-
-            state["documents"] = total_documents  # Сохраняем общее количество документов
-            agent_logger.info(f"Обработано {state['processed_sources']} источников, всего документов: {total_documents}")
+            if state.get("pending_count") is None:
+                agent_logger.info(f"Шаг 3: {state['current_step']}")
+                # Один раз за запуск определяем, каких источников нет в БД; чередуем хосты
+                pending = self.ingestor.pending_urls(self.run_store.sources(state["run_id"], "sources"))
+                pending = self.web_parser.scheduler.interleave(pending)
+                self._put_sources(state, "pending", pending)
+                state["pending_count"] = len(pending)
+                state["sources_cursor"] = 0
+
+            pending = self.run_store.sources(state["run_id"], "pending")
+            cursor = state["sources_cursor"]
+            portion = pending[cursor:cursor + config.CHECKPOINT_SOURCES_PER_STEP]
+            if portion:
+                ingest = self.ingestor.ingest(portion, skip_existing=False)
+                state["processed_sources"] += ingest["processed_sources"]
+                state["documents"] += ingest["documents"]
+                state["error_details"] = list(state.get("error_details") or []) + ingest["error_details"]
+            state["sources_cursor"] = cursor + len(portion)
+            agent_logger.info(f"Проиндексировано источников: {state['sources_cursor']}/{len(pending)}")
 
         except Exception as e:
             agent_logger.error(f"Ошибка при обработке источников: {e}")
             state["error"] = str(e)
-            state["documents"] = 0
-            state["error"] = str(e)
-            state["documents"] = 0
+            # Прекращаем цикл индексации, ответы строятся по уже имеющимся данным
+            state["sources_cursor"] = state.get("pending_count") or 0
 
         return state
 
+    def ingest_sources(self, sources: List[str]) -> Dict[str, Any]:
+        """Гарантирует, что источники проиндексированы; ожидание касается только отсутствующих в БД URL"""
+        return self.ingestor.ensure_indexed(sources)
+
 
     def _answer_questions(self, state: AgentState) -> AgentState:
-        """Отвечает на каждый вопрос используя релевантные блоки из векторной БД"""
+        """Отвечает на очередные вопросы (не более CHECKPOINT_ANSWERS_PER_STEP за шаг), используя
+        релевантные блоки из векторной БД; готовые ответы из состояния (в т.ч. восстановленного) не пересчитываются"""
         try:
             state["current_step"] = "Ответы на вопросы"
-            agent_logger.info(f"Шаг 4: {state['current_step']}")
-
-            question_answers = []
-
-            for i, question in enumerate(state["questions"], 1):
+            question_answers = list(state.get("question_answers") or [])
+            if not question_answers:
+                agent_logger.info(f"Шаг 4: {state['current_step']}")
+
+            done = len(question_answers)
+            portion = state["questions"][done:done + config.CHECKPOINT_ANSWERS_PER_STEP]
+            allowed_sources = {self.normalize_url(url) for url in self.run_store.sources(state["run_id"], "sources")}
+            for i, question in enumerate(portion, done + 1):
                 try:
                     agent_logger.info(f"Обработка вопроса {i}/{len(state['questions'])}: {question}")
 
@@ -268,12 +362,19 @@ class InformationSummarizerAgent:
                     relevant_docs = self.vector_db.search_similar(
                         query=question,
                         limit=config.DOCS_PER_ANSWER,
-                        threshold=config.SIMILARITY_THRESHOLD
+                        threshold=config.SIMILARITY_THRESHOLD,
+                        sources=allowed_sources
                     )
 
                     # Фильтрация: только параграфы из разрешённых источников (загруженных изначально)
-                    allowed_sources = set(state["sources"])
-                    relevant_docs = [doc for doc in relevant_docs if self.normalize_url(doc.get("source_url", "")) in allowed_sources]
+                    relevant_docs = [doc for doc in relevant_docs
+                                     if doc.source_url in allowed_sources or not allowed_sources.isdisjoint(doc.url_aliases)]
+
+                    # Отбор в контекст: сколько блоков брать, решает распределение оценок, а не фиксированный k
+                    selection = (select_context if config.RETRIEVAL_ADAPTIVE else fixed_context)(relevant_docs)
+                    relevant_docs = selection.hits
+                    metrics.RETRIEVAL_SELECTED.observe(len(relevant_docs))
+                    agent_logger.info(f"Контекст для вопроса {i}: {selection.reason}")
 
                     if not relevant_docs:
                         agent_logger.warning(f"Не найдено релевантных документов для вопроса: {question}")
@@ -283,13 +384,9 @@ class InformationSummarizerAgent:
                         })
                         continue
 
-                    # Удаляем дубликаты (не нужно пока) 
-                    unique_docs=relevant_docs
-                    # unique_docs = self.vector_db.remove_duplicates(relevant_docs)
-                    # agent_logger.info(f"Найдено {len(unique_docs)} уникальных релевантных документов")
-
-                    # Объединяем контент документов
-                    combined_content = "\n\n".join([doc["content"] for doc in unique_docs])
+                    # Объединяем контент документов, помечая источник каждого блока
+                    combined_content = "\n\n".join(f"{doc.content}\n<Source>{doc.source_url}</Source>"
+                                                   for doc in relevant_docs)
 
                     # Формируем промпт для ответа на вопрос
                     prompt = f"""
@@ -311,14 +408,11 @@ class InformationSummarizerAgent:
                     Ответ:
                     """
 
-                    message = HumanMessage(content=prompt)
-                    agent_logger.info(f"[LLM REQUEST] PROMPT: {prompt.strip()}")
-                    response = self.llm.invoke([message])
-                    agent_logger.info(f"[LLM RESPONSE] RESPONSE: {response.content.strip()}")
+                    answer = self._invoke_llm(prompt, state, 'answer_questions')
 
                     question_answers.append({
                         "question": question,
-                        "answer": response.content
+                        "answer": answer
                     })
 
                     agent_logger.info(f"Сгенерирован ответ на вопрос {i}")
@@ -331,26 +425,35 @@ class InformationSummarizerAgent:
                     })
 
             state["question_answers"] = question_answers
-            agent_logger.info(f"Сгенерированы ответы на {len(question_answers)} вопросов")
+            agent_logger.info(f"Сгенерированы ответы на {len(question_answers)} из {len(state['questions'])} вопросов")
 
         except Exception as e:
             agent_logger.error(f"Ошибка при генерации ответов: {e}")
             state["error"] = str(e)
-            state["question_answers"] = []
+            # Оставшиеся вопросы помечаются ошибкой, чтобы цикл ответов завершился
+            answered = list(state.get("question_answers") or [])
+            state["question_answers"] = answered + [
+                {"question": question, "answer": f"Ошибка при генерации ответа: {str(e)}"}
+                for question in state.get("questions", [])[len(answered):]
+            ]
 
         return state
 
     def _generate_report(self, state: AgentState) -> AgentState:
-        """Генерирует итоговый отчет"""
+        """Генерирует итоговый отчет.
+
+        Если вопросы и ответы не помещаются в REPORT_MAX_PROMPT_CHARS, ответы сначала параллельно сжимаются
+        в разделы (map), разделы при необходимости сжимаются повторно, затем выполняется итоговая сборка (reduce).
+        Размер каждого промпта ограничен независимо от числа вопросов; итоговый отчет выдаётся потоково."""
         try:
             state["current_step"] = "Генерация итогового отчета"
             agent_logger.info(f"Шаг 5: {state['current_step']}")
 
-            # Формируем текст с вопросами и ответами
-            qa_text = ""
-            for i, qa in enumerate(state["question_answers"], 1):
-                qa_text += f"\n\nВопрос {i}: {qa['question']}\n"
-                qa_text += f"Ответ {i}: {qa['answer']}"
+            # Формируем блоки с вопросами и ответами
+            blocks = [f"Вопрос {i}: {qa['question']}\nОтвет {i}: {qa['answer']}"
+                      for i, qa in enumerate(state["question_answers"], 1)]
+            sections = self._reduce_to_budget(blocks, state)
+            qa_text = "\n\n".join(sections)
 
             prompt = f"""
             Задача: Подготовь связный итоговый отчет на основе изначального запроса пользователя и полученных ответов на вопросы.
@@ -372,12 +475,8 @@ class InformationSummarizerAgent:
             Итоговый отчет:
             """
 
-            message = HumanMessage(content=prompt)
-            agent_logger.info(f"[LLM REQUEST] PROMPT: {prompt.strip()}")
-            response = self.llm.invoke([message])
-            agent_logger.info(f"[LLM RESPONSE] RESPONSE: {response.content.strip()}")
-
-            state["final_report"] = response.content
+            state["final_report"] = self._invoke_llm(prompt, state, 'generate_report', cache=config.LLM_CACHE_REPORT,
+                                                     on_chunk=_report_stream.get())
             state["current_step"] = "Завершено"
 
             agent_logger.info("Итоговый отчет сгенерирован успешно")
@@ -389,41 +488,151 @@ class InformationSummarizerAgent:
 
         return state
 
-    def process_query(self, user_query: str, sources_path: str) -> Dict[str, Any]:
-        """Основной метод обработки запроса пользователя"""
+    @staticmethod
+    def _pack(blocks: List[str], budget: int) -> List[List[str]]:
+        """Жадно группирует блоки так, чтобы суммарный размер группы не превышал budget;
+        блок больше бюджета усекается"""
+        groups, current, size = [], [], 0
+        for block in blocks:
+            if len(block) > budget:
+                block = block[:budget - 1] + "…"
+            if current and size + len(block) + 2 > budget:
+                groups.append(current)
+                current, size = [], 0
+            current.append(block)
+            size += len(block) + 2
+        if current:
+            groups.append(current)
+        return groups
+
+    def _reduce_to_budget(self, blocks: List[str], state: AgentState) -> List[str]:
+        """Сжимает блоки в разделы, пока их суммарный размер превышает REPORT_MAX_PROMPT_CHARS"""
+        budget = config.REPORT_MAX_PROMPT_CHARS
+        section_chars = config.REPORT_SECTION_CHARS
+        # Два раздела с разделителями должны помещаться в одну группу, иначе число блоков не уменьшается
+        if 2 * (section_chars + 2) > budget:
+            raise ValueError("REPORT_SECTION_CHARS (с разделителями) должен быть не больше половины REPORT_MAX_PROMPT_CHARS")
+
+        level = 0
+        while sum(len(block) + 2 for block in blocks) > budget:
+            level += 1
+            groups = self._pack(blocks, budget)
+            if len(groups) == len(blocks) and all(len(block) <= section_chars for block in blocks):
+                # Сжатие не уменьшит ни число, ни размер блоков — новые вызовы LLM ничего не дадут
+                raise RuntimeError(f"Не удалось уложить ответы в REPORT_MAX_PROMPT_CHARS ({budget}): "
+                                   f"{len(blocks)} разделов не группируются")
+            agent_logger.info(f"Сжатие ответов для отчета (уровень {level}): {len(blocks)} блоков -> {len(groups)} разделов")
+            with ThreadPoolExecutor(max_workers=config.REPORT_MAP_WORKERS, thread_name_prefix="report") as executor:
+                summaries = list(executor.map(lambda group: self._summarize_section(group, state), groups))
+            # Жёсткое ограничение размера раздела гарантирует сокращение объёма на каждом уровне
+            blocks = [summary if len(summary) <= section_chars else summary[:section_chars - 1] + "…"
+                      for summary in summaries]
+        return blocks
+
+    def _summarize_section(self, blocks: List[str], state: AgentState) -> str:
+        """Сжимает группу вопросов и ответов в раздел отчета с сохранением ссылок на источники"""
+        material = "\n\n".join(blocks)
+        prompt = f"""
+            Задача: Сожми вопросы и ответы ниже в раздел отчета для запроса пользователя.
+
+            Изначальный запрос пользователя: "{state['user_query']}"
+
+            Вопросы и ответы:
+            {material}
+
+            Требования к разделу:
+            1. Сохрани ключевые факты, цифры и выводы
+            2. Сохрани ссылки на источники в скобках рядом с фактами, которые из них взяты
+            3. Не добавляй информацию, которой нет в ответах
+            4. Объём — не более {config.REPORT_SECTION_CHARS} символов
+
+            Раздел:
+            """
+        return self._invoke_llm(prompt, state, 'report_map')
+
+    def _put_sources(self, state: AgentState, kind: str, urls: List[str]) -> None:
+        # Списки запусков без контрольных точек (пакетный режим) не записываются на диск
+        self.run_store.put_sources(state["run_id"], kind, urls, persist=self.checkpointer is not None)
+
+    def _initial_state(self, user_query: str, run_id: str, sources: List[str] = None) -> AgentState:
+        """Начальное состояние; sources — уже известный список источников (пакетный режим)"""
+        if sources is not None:
+            self.run_store.put_sources(run_id, "sources", sources, persist=False)
+        return AgentState(
+            user_query=user_query,
+            run_id=run_id,
+            questions=[],
+            total_sources=len(sources or []),
+            processed_sources=0,
+            documents=0,
+            question_answers=[],
+            final_report="",
+            current_step="Инициализация",
+            error="",
+            llm_cache_hits=0,
+            llm_cache_misses=0,
+            timings={},
+            pending_count=None,
+            sources_cursor=0,
+            error_details=[]
+        )
+
+    @staticmethod
+    def _result_from_state(final_state: AgentState) -> Dict[str, Any]:
+        return {
+            "user_query": final_state["user_query"],
+            "questions": final_state["questions"],
+            "processed_sources": final_state["processed_sources"],
+            "total_sources": final_state["total_sources"],
+            "total_documents": final_state["documents"],
+            "question_answers": final_state["question_answers"],
+            "final_report": final_state["final_report"],
+            "llm_cache": {
+                "hits": final_state.get("llm_cache_hits", 0),
+                "misses": final_state.get("llm_cache_misses", 0)
+            },
+            "timings": final_state.get("timings", {}),
+            "status": "success" if not final_state.get("error") else "error",
+            "error": final_state.get("error", "")
+        }
+
+    def process_query(self, user_query: str, sources_path: str, run_id: str = None,
+                      on_report_chunk: Callable[[str], None] = None) -> Dict[str, Any]:
+        """Основной метод обработки запроса пользователя.
+
+        run_id — идентификатор запуска: если для него есть контрольная точка, обработка продолжается
+        с последнего завершённого шага (источника, ответа); для завершённого запуска возвращается сохранённый результат.
+        Без user_query запуск только продолжается: при отсутствии контрольной точки возвращается ошибка.
+        on_report_chunk — получатель частей итогового отчета по мере генерации"""
+        run_id = run_id or uuid.uuid4().hex
+        stream_token = _report_stream.set(on_report_chunk)
         try:
-            agent_logger.info(f"Начало обработки запроса: {user_query}")
-
-            # Инициализируем состояние
-            initial_state = AgentState(
-                user_query=user_query,
-                questions=[],
-                sources=[],
-                processed_sources=0,
-                documents=0,
-                question_answers=[],
-                final_report="",
-                current_step="Инициализация",
-                error=""
-            )
+            agent_logger.info(f"Начало обработки запроса: {user_query} (запуск {run_id})")
 
             # Создаём новый граф для каждого запроса
             graph = self._create_graph(sources_path)
-
-            final_state = graph.invoke(initial_state)
+            run_config = {"configurable": {"thread_id": run_id}, "recursion_limit": _RECURSION_LIMIT}
+
+            if self.checkpointer is not None:
+                self._expire_checkpoints()
+                self.run_store.touch(run_id)
+            snapshot = graph.get_state(run_config) if self.checkpointer is not None else None
+            if snapshot is not None and snapshot.values and not snapshot.next:
+                agent_logger.info(f"Запуск {run_id} уже завершён, используется сохранённый результат")
+                final_state = snapshot.values
+            elif snapshot is not None and snapshot.values:
+                agent_logger.info(f"Возобновление запуска {run_id} с шага '{snapshot.next[0]}'")
+                final_state = graph.invoke(None, run_config)
+            elif not user_query:
+                # Продолжение запуска без контрольной точки (опечатка в идентификаторе, удалённый файл
+                # контрольных точек, CHECKPOINT_ENABLED=False) не должно начинать новый запуск без запроса
+                raise ValueError(f"Нет контрольной точки для запуска {run_id}")
+            else:
+                final_state = graph.invoke(self._initial_state(user_query, run_id), run_config)
 
             # Формируем результат
-            result = {
-                "user_query": final_state["user_query"],
-                "questions": final_state["questions"],
-                "processed_sources": final_state["processed_sources"],
-                "total_sources": len(final_state["sources"]),
-                "total_documents": final_state["documents"],
-                "question_answers": final_state["question_answers"],
-                "final_report": final_state["final_report"],
-                "status": "success" if not final_state.get("error") else "error",
-                "error": final_state.get("error", "")
-            }
+            result = self._result_from_state(final_state)
+            result["run_id"] = run_id
 
             agent_logger.info("Обработка запроса завершена успешно")
             return result
@@ -432,10 +641,84 @@ class InformationSummarizerAgent:
             agent_logger.error(f"Критическая ошибка при обработке запроса: {e}")
             return {
                 "user_query": user_query,
+                "run_id": run_id,
                 "status": "error",
                 "error": str(e),
                 "final_report": "Произошла ошибка при обработке запроса"
             }
+        finally:
+            self.run_store.release(run_id)
+            _report_stream.reset(stream_token)
+
+    def _expire_checkpoints(self) -> None:
+        """Удаляет контрольные точки и списки источников запусков, к которым не обращались дольше CHECKPOINT_TTL"""
+        if not config.CHECKPOINT_TTL:
+            return
+        for run_id in self.run_store.expired(config.CHECKPOINT_TTL):
+            self.checkpointer.delete_thread(run_id)
+            self.run_store.delete(run_id)
+            agent_logger.info(f"Контрольные точки запуска {run_id} удалены по сроку хранения")
+
+    def process_batch(self, requests: List[Dict[str, Any]], sources_path: str = None,
+                      concurrency: int = None, on_result: Callable[[Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
+        """Пакетная обработка запросов: объединение списков источников индексируется один раз,
+        затем вопросы и ответы для всех запросов строятся параллельно (не более concurrency одновременно).
+
+        requests — словари с ключами 'query', необязательными 'id' и 'sources' (путь к файлу источников,
+        по умолчанию sources_path). on_result вызывается для каждого результата по мере готовности."""
+        concurrency = concurrency or config.BATCH_CONCURRENCY
+
+        # Каждый файл источников читается один раз, даже если на него ссылаются несколько запросов
+        sources_by_path: Dict[str, List[str]] = {}
+        for item in requests:
+            path = item.get("sources") or sources_path or config.SOURCES_EXCEL_PATH
+            if path not in sources_by_path:
+                sources_by_path[path] = list(iter_source_urls(path))
+        all_sources = list(dict.fromkeys(url for urls in sources_by_path.values() for url in urls))
+        agent_logger.info(f"Пакет из {len(requests)} запросов, уникальных источников: {len(all_sources)}")
+
+        start = time.perf_counter()
+        ingest = self.ingest_sources(all_sources)
+        ingest_time = round(time.perf_counter() - start, 3)
+        metrics.NODE_DURATION.observe(ingest_time, node="process_sources")
+
+        graph = self._create_graph(ingest=False)
+
+        def run(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+            query = item["query"]
+            sources = sources_by_path[item.get("sources") or sources_path or config.SOURCES_EXCEL_PATH]
+            run_id = uuid.uuid4().hex
+            try:
+                result = self._result_from_state(
+                    graph.invoke(self._initial_state(query, run_id, sources), {"recursion_limit": _RECURSION_LIMIT}))
+            except Exception as e:
+                agent_logger.error(f"Ошибка при обработке запроса '{query}': {e}")
+                result = {
+                    "user_query": query,
+                    "status": "error",
+                    "error": str(e),
+                    "final_report": "Произошла ошибка при обработке запроса"
+                }
+            finally:
+                self.run_store.release(run_id)
+            result["id"] = item.get("id", index)
+            result["batch_ingest"] = {
+                "processed_sources": ingest["processed_sources"],
+                "total_documents": ingest["documents"],
+                "near_duplicates": ingest["near_duplicates"],
+                "seconds": ingest_time
+            }
+            return result
+
+        results: List[Dict[str, Any]] = [None] * len(requests)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+            futures = {executor.submit(run, i, item): i for i, item in enumerate(requests)}
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if on_result is not None:
+                    on_result(result)
+        return results
 
 def get_agent() -> InformationSummarizerAgent:
     """Функция для получения экземпляра агента"""
@@ -1,18 +1,16 @@
 import os
 import logging
-from flask import Flask, request, jsonify, render_template, render_template_string, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, render_template_string, send_from_directory
 from flask_cors import CORS
 import threading
 import time
 import config
-from agent import get_agent
 from utils.logger import get_logger, WebLogHandler
+from utils import metrics
+from utils.source_loader import SUPPORTED_EXTENSIONS
 import uuid
 import json
 from datetime import datetime
-import markdown
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
 
 # Настройка логирования
 app_logger = get_logger("webapp")
@@ -63,14 +61,18 @@ def process_request():
     temp_excel_path = None
     try:
         user_query = request.form.get('user_query')
+        # Идентификатор прерванного запуска: обработка продолжится с последней контрольной точки
+        run_id = request.form.get('run_id') or None
         if not user_query:
             return jsonify({'success': False, 'error': 'Не указан запрос пользователя'}), 400
 
         # Обработка загружаемого файла
         sources_file = request.files.get('sources_file')
-        if sources_file and sources_file.filename.endswith(('.xlsx', '.xls')):
+        if sources_file and sources_file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
             os.makedirs('results', exist_ok=True)
-            temp_excel_path = f"results/sources_{uuid.uuid4().hex}.xlsx"
+            # Расширение сохраняем: по нему выбирается способ чтения списка источников
+            extension = os.path.splitext(sources_file.filename)[1].lower()
+            temp_excel_path = f"results/sources_{uuid.uuid4().hex}{extension}"
             sources_file.save(temp_excel_path)
             app_logger.info(f"Загружен файл источников: {sources_file.filename} -> {temp_excel_path}")
         elif not os.path.exists(config.SOURCES_EXCEL_PATH):
@@ -95,10 +97,15 @@ def process_request():
         app_logger.info(f"Начало обработки запроса: {user_query}")
 
         # Получение агента и обработка запроса
+        from agent import get_agent
         agent = get_agent()
         if not temp_excel_path:
             return jsonify({'success': False, 'error': 'Файл источников не был загружен!'}), 400
-        result = agent.process_query(user_query, sources_path=temp_excel_path)
+        metrics.JOBS_IN_PROGRESS.inc()
+        try:
+            result = agent.process_query(user_query, sources_path=temp_excel_path, run_id=run_id)
+        finally:
+            metrics.JOBS_IN_PROGRESS.dec()
 
         processing_completed = True
 
@@ -122,7 +129,8 @@ def process_request():
                 f.write(f"- Обработано источников: {result['processed_sources']}\n")
                 f.write(f"- Всего источников: {result['total_sources']}\n")
                 f.write(f"- Всего документов: {result['total_documents']}\n")
-                f.write(f"- Сгенерировано вопросов: {len(result['questions'])}\n\n")
+                f.write(f"- Сгенерировано вопросов: {len(result['questions'])}\n")
+                f.write(f"- Кэш LLM: попаданий {result['llm_cache']['hits']}, промахов {result['llm_cache']['misses']}\n\n")
                 f.write(f"## Итоговый отчёт\n\n")
                 f.write(result['final_report'])
                 f.write(f"\n\n## Вопросы и ответы\n\n")
@@ -137,6 +145,10 @@ def process_request():
             pdf_path = f"results/{pdf_filename}"
             try:
                 # Читаем markdown и конвертируем в HTML
+                import markdown
+                from weasyprint import HTML
+                from weasyprint.text.fonts import FontConfiguration
+
                 with open(md_path, 'r', encoding='utf-8') as f:
                     md_content = f.read()
                 html_content = markdown.markdown(md_content, extensions=['tables', 'fenced_code', 'codehilite'])
@@ -191,7 +203,8 @@ def process_request():
             return jsonify({'success': True, 'data': result, 'download_links': download_links})
         else:
             app_logger.error(f"Ошибка при обработке запроса: {result.get('error', 'Неизвестная ошибка')}")
-            return jsonify({'success': False, 'error': result.get('error', 'Неизвестная ошибка')}), 500
+            return jsonify({'success': False, 'error': result.get('error', 'Неизвестная ошибка'),
+                            'run_id': result.get('run_id')}), 500
 
     except Exception as e:
         app_logger.error(f"Ошибка обработки API запроса: {e}")
@@ -210,6 +223,70 @@ def process_request():
             except Exception as e:
                 app_logger.error(f"Ошибка при удалении временного файла источников: {e}")
 
+@app.route('/api/batch', methods=['POST'])
+def process_batch_request():
+    """API пакетной обработки: один файл источников индексируется один раз, запросы обрабатываются параллельно.
+
+    Запросы передаются файлом JSONL (requests_file) или полем queries (по запросу на строку);
+    результаты дописываются в JSONL-файл по мере готовности."""
+    from utils.batch import parse_batch_requests, JsonlResultWriter
+
+    temp_sources_path = None
+    try:
+        requests_file = request.files.get('requests_file')
+        if requests_file:
+            lines = requests_file.read().decode('utf-8-sig').splitlines()
+        else:
+            lines = [json.dumps(q, ensure_ascii=False) for q in request.form.get('queries', '').splitlines() if q.strip()]
+        batch = parse_batch_requests(lines)
+        if not batch:
+            return jsonify({'success': False, 'error': 'Не указаны запросы'}), 400
+        # Пути к файлам на сервере из запроса не принимаются: все запросы используют загруженный файл
+        for item in batch:
+            item.pop('sources', None)
+
+        sources_file = request.files.get('sources_file')
+        if not sources_file or not sources_file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            return jsonify({'success': False, 'error': 'Файл источников не был загружен!'}), 400
+        os.makedirs('results', exist_ok=True)
+        extension = os.path.splitext(sources_file.filename)[1].lower()
+        temp_sources_path = f"results/sources_{uuid.uuid4().hex}{extension}"
+        sources_file.save(temp_sources_path)
+
+        concurrency = request.form.get('concurrency', type=int)
+        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
+        result_filename = f"web_batch_{ts}.jsonl"
+        app_logger.info(f"Пакетная обработка: {len(batch)} запросов, источники {sources_file.filename}")
+
+        from agent import get_agent
+        agent = get_agent()
+        metrics.JOBS_IN_PROGRESS.inc()
+        try:
+            with JsonlResultWriter(f"results/{result_filename}") as writer:
+                results = agent.process_batch(batch, sources_path=temp_sources_path,
+                                              concurrency=concurrency, on_result=writer.write)
+        finally:
+            metrics.JOBS_IN_PROGRESS.dec()
+
+        app_logger.info(f"Пакетная обработка завершена, результаты в results/{result_filename}")
+        return jsonify({
+            'success': all(r['status'] == 'success' for r in results),
+            'data': results,
+            'download_links': {'results': f'/results/{result_filename}'}
+        })
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        app_logger.error(f"Ошибка пакетной обработки: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        if temp_sources_path and os.path.exists(temp_sources_path):
+            try:
+                os.remove(temp_sources_path)
+            except Exception as e:
+                app_logger.error(f"Ошибка при удалении временного файла источников: {e}")
+
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
     """API для получения логов"""
@@ -241,6 +318,11 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/results/<path:filename>')
 def download_result(filename):
     return send_from_directory('results', filename, as_attachment=True)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Проверка времени импорта модулей агента (python -X importtime)
+
+Каждый модуль импортируется в отдельном процессе без учётных данных GigaChat.
+Скрипт завершается с кодом 1, если время импорта превышает бюджет
+или модуль при импорте загружает тяжёлые зависимости, которые должны подгружаться лениво.
+
+Пример:
+  python benchmarks/import_time.py
+  python benchmarks/import_time.py --budget-ms 300 --top 15
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Бюджет на импорт, мс (суммарное время по -X importtime)
+DEFAULT_BUDGETS = {
+    "config": 100,
+    "main": 100,
+    "utils": 100,
+    "agent": 2500,
+    "app": 1000,
+}
+
+# Зависимости, которые не должны загружаться при импорте модулей
+LAZY_MODULES = ("pandas", "langgraph", "langchain_gigachat", "weasyprint", "markdown")
+
+
+def measure(module: str) -> dict:
+    """Импортирует модуль в чистом процессе и возвращает время и список загруженных тяжёлых зависимостей"""
+    env = dict(os.environ)
+    env.pop("GIGACHAT_USERNAME", None)
+    env.pop("GIGACHAT_PASSWORD", None)
+    code = (f"import json, sys; import {module}; "
+            f"print(json.dumps(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules)))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, cwd=ROOT, env=env)
+    if proc.returncode != 0:
+        raise SystemExit(f"❌ Не удалось импортировать {module}:\n{proc.stderr[-2000:]}")
+
+    # Строки вида 'import time:   self [us] | cumulative | name'; отступ имени — глубина вложенности
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append((name.rstrip(), int(cumulative_us)))
+
+    # Время импорта модуля — кумулятивное время его записи верхнего уровня;
+    # вложенные импорты выводятся перед ней, прямые — с отступом в два пробела
+    end = max(i for i, (name, _) in enumerate(entries) if name == f" {module}")
+    start = end
+    while start > 0 and entries[start - 1][0].startswith("  "):
+        start -= 1
+    total_us = entries[end][1]
+    nested = [(name.strip(), cum) for name, cum in entries[start:end]
+              if name.startswith("   ") and not name.startswith("    ")]
+    return {
+        "module": module,
+        "total_ms": round(total_us / 1000, 1),
+        "heavy": json.loads(proc.stdout.strip().splitlines()[-1]),
+        "top": sorted(nested, key=lambda item: item[1], reverse=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта модулей агента")
+    parser.add_argument("--modules", default=",".join(DEFAULT_BUDGETS), help="Модули через запятую")
+    parser.add_argument("--budget-ms", type=float, help="Единый бюджет для всех модулей, мс")
+    parser.add_argument("--top", type=int, default=5, help="Сколько самых тяжёлых прямых импортов модуля показать")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules.split(","):
+        result = measure(module)
+        budget = args.budget_ms or DEFAULT_BUDGETS.get(module, 1000)
+        ok = result["total_ms"] <= budget and not result["heavy"]
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {module:<10}{result['total_ms']:>9.1f} мс  (бюджет {budget:.0f} мс)")
+        if result["heavy"]:
+            print(f"   при импорте загружены: {', '.join(result['heavy'])}")
+        for name, cumulative_us in result["top"][:args.top]:
+            print(f"   {name:<40}{cumulative_us / 1000:>9.1f} мс")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
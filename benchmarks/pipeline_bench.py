@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк полного графа агента (LangGraph) на локальных заглушках
+
+- LLM и эмбеддинги заменены заглушками с настраиваемой задержкой
+- Qdrant: локальный режим в памяти (QdrantClient(":memory:")) или указанный сервер
+- Источники отдаёт локальный HTTP-сервер из сохранённых HTML-файлов (или синтетических страниц)
+
+Каждый размер прогоняется в отдельном процессе, чтобы пиковый RSS измерялся независимо.
+
+Пример:
+  python benchmarks/pipeline_bench.py --sizes 10,100,1000 --llm-latency 0.5 --embed-latency 0.05
+  python benchmarks/pipeline_bench.py --fixtures saved_pages/ --qdrant-url http://localhost:6333
+  python benchmarks/pipeline_bench.py --sizes 100 --selection fixed,adaptive   # Влияние отбора блоков на промпт ответа
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+NODES = ["generate_questions", "load_sources", "process_sources", "answer_questions", "generate_report"]
+
+_WORDS = (
+    "форум экономика инвестиции соглашение компания регион развитие технологии банк рынок "
+    "правительство проект инфраструктура энергетика промышленность экспорт поддержка бизнес "
+    "рост прогноз участники делегация сессия выступление министр председатель стратегия"
+).split()
+
+
+def _synthetic_page(index: int, paragraphs: int = 8) -> bytes:
+    """Синтетическая HTML-страница с русским текстом (детерминированная по номеру)"""
+    rng = random.Random(index)
+    body = []
+    for _ in range(paragraphs):
+        sentences = [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 16))).capitalize() + "."
+                     for _ in range(rng.randint(3, 6))]
+        body.append(f"<p>{' '.join(sentences)}</p>")
+    html = (f"<html><head><meta charset='utf-8'><title>Статья {index}</title></head><body>"
+            f"<nav>Меню</nav><article><h1>Статья {index}</h1>{''.join(body)}</article>"
+            f"<footer>Подвал</footer></body></html>")
+    return html.encode("utf-8")
+
+
+def _fixture_files(fixtures_dir: str) -> list:
+    files = sorted(Path(fixtures_dir).glob("*.htm*"))
+    if not files:
+        raise SystemExit(f"В каталоге {fixtures_dir} нет HTML-файлов")
+    return files
+
+
+def _start_server(fixtures_dir: str):
+    """Запускает локальный HTTP-сервер, отдающий /page/<n>.html: сохранённые страницы по кругу
+    или уникальную синтетическую страницу для каждого номера"""
+    pages = [p.read_bytes() for p in _fixture_files(fixtures_dir)] if fixtures_dir else None
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if not self.path.startswith("/page/"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            index = int(self.path.split("/")[-1].split(".")[0])
+            body = pages[index % len(pages)] if pages else _synthetic_page(index)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_single(args) -> dict:
+    """Один прогон графа на args.single источниках (выполняется в дочернем процессе)"""
+    tmp = tempfile.mkdtemp(prefix="pipeline_bench_")
+    # Сохранённые страницы повторяются по кругу, если источников больше, чем файлов: повторы были бы
+    # привязаны как почти дубликаты без векторизации и завысили бы скорость, поэтому поиск копий отключается
+    repeated = bool(args.fixtures) and args.single > len(_fixture_files(args.fixtures))
+    # Конфигурация читается при импорте, поэтому окружение задаём до импорта модулей агента
+    os.environ.setdefault("GIGACHAT_USERNAME", "bench")
+    os.environ.setdefault("GIGACHAT_PASSWORD", "bench")
+    os.environ.update({
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE_PATH": os.path.join(tmp, "agent_logs.txt"),
+        "PAGE_CACHE_PATH": os.path.join(tmp, "page_cache.sqlite"),
+        "NEAR_DUP_INDEX_PATH": os.path.join(tmp, "near_dup.sqlite"),
+        "CHECKPOINT_PATH": os.path.join(tmp, "checkpoints.sqlite"),
+        "LLM_CACHE_ENABLED": "False",
+        "EMBEDDING_CACHE_ENABLED": "False",
+        "FETCH_RESPECT_ROBOTS": "False",
+        "RETRIEVAL_ADAPTIVE": str(args.selection == "adaptive"),
+        "NEAR_DUP_ENABLED": str(not repeated),
+    })
+
+    import openpyxl
+    from langchain_core.messages import AIMessage
+    from qdrant_client import QdrantClient
+    from agent import InformationSummarizerAgent
+    from utils.embeddings import HashingEmbeddingProvider
+    from utils.fetch_scheduler import HostScheduler
+    from utils.vector_db import VectorDatabase
+    from utils.web_parser import WebParser
+
+    class FakeLLM:
+        """Заглушка GigaChat: фиксированная задержка, учёт размера промптов"""
+        model = "fake-llm"
+        temperature = 0.1
+
+        def __init__(self, latency: float, questions: int):
+            self.latency = latency
+            self.questions = questions
+            self.calls = 0
+            self.prompt_chars = 0
+            self.max_prompt_chars = 0
+            self.answer_prompts = 0
+            self.answer_prompt_chars = 0
+
+        def invoke(self, messages):
+            prompt = messages[-1].content
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+            self.max_prompt_chars = max(self.max_prompt_chars, len(prompt))
+            if "Подготовь детальный ответ на вопрос" in prompt:
+                self.answer_prompts += 1
+                self.answer_prompt_chars += len(prompt)
+            time.sleep(self.latency)
+            if '"questions"' in prompt:
+                questions = [f"Вопрос {i}: {random.choice(_WORDS)} {random.choice(_WORDS)}" for i in range(self.questions)]
+                return AIMessage(content=json.dumps({"questions": questions}, ensure_ascii=False))
+            return AIMessage(content="Ответ, составленный по источникам. " * 30)
+
+    class FakeEmbeddings(HashingEmbeddingProvider):
+        """Заглушка эмбеддингов: хэширующий векторизатор с задержкой на батч"""
+        name = "fake"
+
+        def __init__(self, latency: float):
+            super().__init__(dim=256)
+            self.latency = latency
+            self.batches = 0
+
+        def _embed_batch(self, texts):
+            self.batches += 1
+            time.sleep(self.latency)
+            return super()._embed_batch(texts)
+
+        def embed_query(self, text):
+            return self._embed_batch([text])[0]
+
+    server = _start_server(args.fixtures)
+    base = f"http://127.0.0.1:{server.server_port}"
+    sources_path = os.path.join(tmp, "sources.xlsx")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["url"])
+    for i in range(args.single):
+        sheet.append([f"{base}/page/{i}.html"])
+    workbook.save(sources_path)
+
+    llm = FakeLLM(args.llm_latency, args.questions)
+    embeddings = FakeEmbeddings(args.embed_latency)
+    client = QdrantClient(url=args.qdrant_url) if args.qdrant_url else QdrantClient(":memory:")
+    vector_db = VectorDatabase(client=client, embeddings=embeddings)
+    vector_db.collection_name = f"pipeline_bench_{os.getpid()}"
+    web_parser = WebParser(scheduler=HostScheduler(rate=1000.0, burst=1000, respect_robots=False))
+    agent = InformationSummarizerAgent(llm=llm, vector_db=vector_db, web_parser=web_parser)
+    agent.llm_cache = None
+
+    start = time.perf_counter()
+    result = agent.process_query("Какие соглашения и инвестиционные проекты обсуждались на форуме?", sources_path)
+    total = time.perf_counter() - start
+
+    if args.qdrant_url:
+        client.delete_collection(vector_db.collection_name)
+    server.shutdown()
+
+    timings = result.get("timings", {})
+    ingest_time = timings.get("process_sources") or float("nan")
+    return {
+        "sources": args.single,
+        "selection": args.selection,
+        "processed_sources": result.get("processed_sources", 0),
+        "chunks": result.get("total_documents", 0),
+        "status": result.get("status"),
+        "total_time": round(total, 3),
+        "timings": timings,
+        "sources_per_sec": round(result.get("processed_sources", 0) / ingest_time, 2),
+        "chunks_per_sec": round(result.get("total_documents", 0) / ingest_time, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "llm_calls": llm.calls,
+        "prompt_chars_total": llm.prompt_chars,
+        "prompt_chars_max": llm.max_prompt_chars,
+        "answer_prompt_chars_avg": round(llm.answer_prompt_chars / llm.answer_prompts) if llm.answer_prompts else 0,
+        "embedding_batches": embeddings.batches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк графа агента")
+    parser.add_argument("--sizes", default="10,100,1000", help="Количества источников через запятую")
+    parser.add_argument("--questions", type=int, default=5, help="Сколько вопросов возвращает заглушка LLM")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Задержка вызова LLM, сек")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Задержка батча эмбеддингов, сек")
+    parser.add_argument("--fixtures", help="Каталог с сохранёнными HTML-страницами (по умолчанию синтетические)")
+    parser.add_argument("--qdrant-url", help="URL Qdrant (по умолчанию локальный режим в памяти)")
+    parser.add_argument("--selection", default="adaptive",
+                        help="Отбор блоков в контекст ответа: adaptive, fixed или оба через запятую")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_single(args), ensure_ascii=False))
+        return
+
+    rows = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        for selection in args.selection.split(","):
+            cmd = [sys.executable, __file__, "--single", str(size), "--questions", str(args.questions),
+                   "--llm-latency", str(args.llm_latency), "--embed-latency", str(args.embed_latency),
+                   "--selection", selection]
+            if args.fixtures:
+                cmd += ["--fixtures", args.fixtures]
+            if args.qdrant_url:
+                cmd += ["--qdrant-url", args.qdrant_url]
+            print(f"⏳ {size} источников ({selection})...")
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+            rows.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"\n{'источников':>10}{'отбор':>10}{'всего, с':>10}" + "".join(f"{n[:14]:>16}" for n in NODES)
+          + f"{'ист/с':>9}{'блоков/с':>10}{'RSS, МБ':>9}{'макс. промпт':>14}{'промпт ответа':>15}")
+    for row in rows:
+        print(f"{row['sources']:>10}{row['selection']:>10}{row['total_time']:>10.2f}"
+              + "".join(f"{row['timings'].get(n, 0):>16.2f}" for n in NODES)
+              + f"{row['sources_per_sec']:>9.1f}{row['chunks_per_sec']:>10.1f}{row['peak_rss_mb']:>9.1f}"
+              + f"{row['prompt_chars_max']:>14}{row['answer_prompt_chars_avg']:>15}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности Qdrant через VectorDatabase: HTTP против gRPC
+
+Запись (add_documents) и поиск (search_similar) выполняются тем же кодом, что при индексации и ответах
+на вопросы, из пула потоков поверх одного общего клиента — как при параллельной загрузке источников
+и пакетной обработке запросов. Эмбеддинги — локальный хэширующий векторизатор, чтобы измерялся Qdrant.
+
+Пример:
+  docker-compose up -d qdrant
+  python benchmarks/qdrant_transport.py --sources 1000 --queries 500 --threads 1,8
+  python benchmarks/qdrant_transport.py --url :memory:   # Проверка скрипта без сервера (только HTTP-строка)
+"""
+
+import argparse
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_WORDS = (
+    "форум экономика инвестиции соглашение компания регион развитие технологии банк рынок "
+    "правительство проект инфраструктура энергетика промышленность экспорт поддержка бизнес "
+    "рост прогноз участники делегация сессия выступление министр председатель стратегия"
+).split()
+
+
+def _sources(count: int, chunks_per_source: int, seed: int):
+    rnd = random.Random(seed)
+    return [
+        [{'content': ' '.join(rnd.choice(_WORDS) for _ in range(120)), 'source_url': f"https://site{i % 50}.ru/page/{i}"}
+         for _ in range(chunks_per_source)]
+        for i in range(count)
+    ]
+
+
+def _queries(count: int, seed: int):
+    rnd = random.Random(seed)
+    return [' '.join(rnd.choice(_WORDS) for _ in range(8)) for _ in range(count)]
+
+
+def bench(vector_db, sources, queries, threads: int, limit: int):
+    """Возвращает (блоков/с при записи, запросов/с при поиске)"""
+    vector_db.collection_name = f"bench_transport_{uuid.uuid4().hex[:8]}"
+    vector_db._collection_ready = False
+    chunks = sum(len(source) for source in sources)
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # Коллекция создаётся до замера, одним потоком
+            vector_db.add_documents(sources[0])
+            start = time.perf_counter()
+            list(pool.map(vector_db.add_documents, sources[1:]))
+            upsert_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            list(pool.map(lambda query: vector_db.search_similar(query, limit=limit, threshold=0.0), queries))
+            search_time = time.perf_counter() - start
+    finally:
+        vector_db.clear_collection()
+    return (chunks - len(sources[0])) / upsert_time, len(queries) / search_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк Qdrant через VectorDatabase: HTTP против gRPC')
+    parser.add_argument('--url', default='http://localhost:6333', help='URL Qdrant (HTTP) или :memory:')
+    parser.add_argument('--grpc-port', type=int, default=6334, help='gRPC-порт Qdrant')
+    parser.add_argument('--sources', type=int, default=500, help='Количество источников')
+    parser.add_argument('--chunks-per-source', type=int, default=8, help='Блоков на источник')
+    parser.add_argument('--dim', type=int, default=1024, help='Размерность векторов')
+    parser.add_argument('--queries', type=int, default=300, help='Количество поисковых запросов')
+    parser.add_argument('--limit', type=int, default=20, help='Число результатов на запрос')
+    parser.add_argument('--threads', default='1,8', help='Число потоков через запятую')
+    args = parser.parse_args()
+
+    import logging
+
+    from qdrant_client import QdrantClient
+
+    from utils.embeddings import HashingEmbeddingProvider
+    from utils.vector_db import VectorDatabase
+
+    logging.disable(logging.INFO)
+    sources = _sources(args.sources, args.chunks_per_source, seed=1)
+    queries = _queries(args.queries, seed=2)
+    thread_counts = [int(value) for value in args.threads.split(',') if value.strip()]
+    transports = (('HTTP', False),) if args.url == ':memory:' else (('HTTP', False), ('gRPC', True))
+
+    rows = []
+    for name, prefer_grpc in transports:
+        client = (QdrantClient(':memory:') if args.url == ':memory:'
+                  else QdrantClient(url=args.url, prefer_grpc=prefer_grpc, grpc_port=args.grpc_port))
+        vector_db = VectorDatabase(client=client, embeddings=HashingEmbeddingProvider(dim=args.dim))
+        for threads in thread_counts:
+            print(f"⏳ {name}, потоков: {threads}...")
+            rows.append((f"{name} x{threads}", *bench(vector_db, sources, queries, threads, args.limit)))
+        client.close()
+
+    print(f"\n📊 {args.sources} источников по {args.chunks_per_source} блоков, размерность {args.dim}, "
+          f"{args.queries} запросов (limit={args.limit})")
+    print(f"{'Транспорт':<20}{'запись, блоков/с':>18}{'поиск, запросов/с':>22}")
+    for name, upsert_rate, search_rate in rows:
+        print(f"{name:<20}{upsert_rate:>18.0f}{search_rate:>22.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Оценка полноты (recall@k) и задержки поиска для разных параметров коллекции Qdrant
+
+Скрипт копирует выборку точек рабочей коллекции во временные коллекции с разными
+настройками квантования и HNSW, выполняет сохранённый набор запросов и сравнивает
+результаты с точным поиском (exact=True).
+
+Пример:
+  python benchmarks/recall_eval.py --queries benchmarks/queries.json --sample 20000 \\
+      --quantization none,scalar,binary --ef 64,128,256 --oversampling 1,2,4
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qdrant_client.models import PointStruct, SearchParams, OptimizersConfigDiff, CollectionStatus  # noqa: E402
+
+import config  # noqa: E402
+from utils.vector_db import VectorDatabase  # noqa: E402
+
+
+def load_queries(path: str, vector_db: VectorDatabase, save_vectors: bool):
+    """Загружает набор запросов; отсутствующие векторы вычисляет и при необходимости сохраняет в файл"""
+    with open(path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    items = [item if isinstance(item, dict) else {'query': item} for item in items]
+    missing = [item for item in items if 'vector' not in item]
+    if missing:
+        vectors = vector_db.embeddings.embed_documents([item['query'] for item in missing])
+        for item, vector in zip(missing, vectors):
+            item['vector'] = vector
+        if save_vectors:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False)
+            print(f"💾 Векторы запросов сохранены в {path}")
+    return items
+
+
+def sample_points(vector_db: VectorDatabase, sample: int):
+    """Читает выборку точек рабочей коллекции вместе с векторами"""
+    points, offset = [], None
+    while len(points) < sample:
+        batch, offset = vector_db.client.scroll(
+            collection_name=vector_db.collection_name,
+            limit=min(256, sample - len(points)),
+            offset=offset,
+            with_vectors=True,
+            with_payload=False
+        )
+        points.extend(PointStruct(id=p.id, vector=p.vector, payload={}) for p in batch)
+        if offset is None:
+            break
+    return points
+
+
+def build_collection(vector_db: VectorDatabase, name: str, points, dim: int):
+    """Создаёт временную коллекцию с текущими параметрами vector_db и ждёт построения индекса"""
+    vector_db.client.create_collection(
+        collection_name=name,
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=1),
+        **vector_db._collection_params(dim)
+    )
+    for i in range(0, len(points), 256):
+        vector_db.client.upsert(collection_name=name, points=points[i:i + 256], wait=True)
+    while vector_db.client.get_collection(name).status != CollectionStatus.GREEN:
+        time.sleep(0.5)
+
+
+def run_queries(vector_db: VectorDatabase, name: str, queries, limit: int, search_params):
+    results, latencies = [], []
+    for item in queries:
+        start = time.perf_counter()
+        response = vector_db.client.query_points(
+            collection_name=name, query=item['vector'], limit=limit, search_params=search_params
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([p.id for p in response.points])
+    return results, latencies
+
+
+def recall(truth, found) -> float:
+    values = [len(set(t) & set(f)) / len(t) for t, f in zip(truth, found) if t]
+    return statistics.mean(values) if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Подбор параметров коллекции Qdrant по полноте и задержке')
+    parser.add_argument('--queries', default='benchmarks/queries.json', help='JSON-файл с набором запросов')
+    parser.add_argument('--sample', type=int, default=20000, help='Сколько точек рабочей коллекции копировать')
+    parser.add_argument('--limit', type=int, default=config.DOCS_PER_ANSWER, help='k для recall@k')
+    parser.add_argument('--quantization', default='none,scalar,binary', help='Варианты квантования через запятую')
+    parser.add_argument('--ef', default='64,128,256', help='Варианты hnsw_ef при поиске через запятую')
+    parser.add_argument('--oversampling', default='1,2,4', help='Варианты oversampling для квантования')
+    parser.add_argument('--save-vectors', action='store_true', help='Сохранить вычисленные векторы запросов в файл')
+    args = parser.parse_args()
+
+    vector_db = VectorDatabase()
+    queries = load_queries(args.queries, vector_db, args.save_vectors)
+    points = sample_points(vector_db, args.sample)
+    if not points:
+        print("❌ Рабочая коллекция пуста")
+        sys.exit(1)
+    dim = len(points[0].vector)
+    print(f"🔍 {len(points)} точек, {len(queries)} запросов, recall@{args.limit}")
+
+    rows = []
+    truth = None
+    for quantization in args.quantization.split(','):
+        vector_db.quantization = quantization.strip()
+        name = f"recall_eval_{vector_db.quantization}_{uuid.uuid4().hex[:6]}"
+        build_collection(vector_db, name, points, dim)
+        try:
+            if truth is None:
+                truth, _ = run_queries(vector_db, name, queries, args.limit, SearchParams(exact=True))
+            oversamplings = [None] if vector_db.quantization == 'none' else [float(o) for o in args.oversampling.split(',')]
+            for ef in (int(e) for e in args.ef.split(',')):
+                for oversampling in oversamplings:
+                    vector_db.search_ef = ef
+                    if oversampling is not None:
+                        vector_db.oversampling = oversampling
+                    found, latencies = run_queries(vector_db, name, queries, args.limit, vector_db._search_params())
+                    rows.append((vector_db.quantization, ef, oversampling, recall(truth, found),
+                                 statistics.median(latencies), sorted(latencies)[int(len(latencies) * 0.95) - 1]))
+        finally:
+            vector_db.client.delete_collection(name)
+
+    print(f"\n{'квантование':<12}{'ef':>6}{'oversampling':>14}{'recall':>9}{'p50, мс':>10}{'p95, мс':>10}")
+    for quantization, ef, oversampling, value, p50, p95 in rows:
+        print(f"{quantization:<12}{ef:>6}{oversampling if oversampling is not None else '-':>14}{value:>9.3f}{p50:>10.2f}{p95:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,25 @@ load_dotenv()
 # Размеры и ограничения для обработки текста
 MAX_CHUNK_SIZE = int(os.getenv('MAX_CHUNK_SIZE', '1000'))  # Максимальный размер блока текста
 CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '100'))     # Перекрытие между блоками
-SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.85'))  # Порог схожести для удаления дубликатов
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.85'))  # Минимальная схожесть блока с вопросом при поиске
 
 # Параметры векторной БД Qdrant
 QDRANT_URL = os.getenv('QDRANT_URL', 'http://localhost:6333')
 QDRANT_COLLECTION_NAME = os.getenv('QDRANT_COLLECTION_NAME', 'info_agent_embeddings')
+QDRANT_PREFER_GRPC = os.getenv('QDRANT_PREFER_GRPC', 'False').lower() == 'true'  # Использовать gRPC вместо HTTP
+QDRANT_GRPC_PORT = int(os.getenv('QDRANT_GRPC_PORT', '6334'))
+QDRANT_TIMEOUT = int(os.getenv('QDRANT_TIMEOUT', '30'))  # Таймаут запросов к Qdrant, сек
+
+# Хранение векторов и индекс Qdrant
+QDRANT_QUANTIZATION = os.getenv('QDRANT_QUANTIZATION', 'none').lower()  # none / scalar / binary
+QDRANT_QUANTIZATION_ALWAYS_RAM = os.getenv('QDRANT_QUANTIZATION_ALWAYS_RAM', 'True').lower() == 'true'
+QDRANT_RESCORE = os.getenv('QDRANT_RESCORE', 'True').lower() == 'true'  # Пересчет оценок по исходным векторам
+QDRANT_OVERSAMPLING = float(os.getenv('QDRANT_OVERSAMPLING', '2.0'))   # Запас кандидатов для пересчета
+QDRANT_ON_DISK_VECTORS = os.getenv('QDRANT_ON_DISK_VECTORS', 'False').lower() == 'true'
+QDRANT_ON_DISK_PAYLOAD = os.getenv('QDRANT_ON_DISK_PAYLOAD', 'False').lower() == 'true'
+QDRANT_HNSW_M = int(os.getenv('QDRANT_HNSW_M', '16'))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv('QDRANT_HNSW_EF_CONSTRUCT', '100'))
+QDRANT_SEARCH_EF = int(os.getenv('QDRANT_SEARCH_EF', '0'))  # 0 — значение по умолчанию Qdrant
 
 # Параметры подключения к GigaChat
 GIGACHAT_USERNAME = os.getenv('GIGACHAT_USERNAME')
@@ -24,20 +38,140 @@ GIGACHAT_SCOPE = os.getenv('GIGACHAT_SCOPE', 'GIGACHAT_API_PERS')
 GIGACHAT_VERIFY_SSL = os.getenv('GIGACHAT_VERIFY_SSL', 'False').lower() == 'true'
 GIGACHAT_PROFANITY_CHECK = os.getenv('GIGACHAT_PROFANITY_CHECK', 'True').lower() == 'true'
 
+# Общий для процесса бюджет запросов к GigaChat (LLM и эмбеддинги) и предохранитель
+GIGACHAT_RPM = int(os.getenv('GIGACHAT_RPM', '60'))                      # Запросов в минуту (0 — без ограничения)
+GIGACHAT_TPM = int(os.getenv('GIGACHAT_TPM', '0'))                       # Токенов в минуту (0 — без ограничения)
+GIGACHAT_MAX_CONNECTIONS = int(os.getenv('GIGACHAT_MAX_CONNECTIONS', '0'))  # Размер пула соединений (0 — по умолчанию SDK)
+GIGACHAT_MAX_RETRIES = int(os.getenv('GIGACHAT_MAX_RETRIES', '3'))        # Повторов при 429/5xx
+GIGACHAT_RETRY_BACKOFF = float(os.getenv('GIGACHAT_RETRY_BACKOFF', '1.0'))  # Начальная задержка повтора, сек (удваивается)
+GIGACHAT_BREAKER_THRESHOLD = int(os.getenv('GIGACHAT_BREAKER_THRESHOLD', '5'))     # Ошибок подряд до размыкания
+GIGACHAT_BREAKER_COOLDOWN = float(os.getenv('GIGACHAT_BREAKER_COOLDOWN', '60'))    # Пауза после размыкания, сек
+
+# Гибридный поиск: плотные векторы + разреженные BM25 (слияние RRF)
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'True').lower() == 'true'
+SPARSE_VECTOR_NAME = os.getenv('SPARSE_VECTOR_NAME', 'bm25')
+HYBRID_PREFETCH_LIMIT = int(os.getenv('HYBRID_PREFETCH_LIMIT', '30'))  # Кандидатов из каждой ветки поиска (не меньше limit запроса)
+SPARSE_BM25_K1 = float(os.getenv('SPARSE_BM25_K1', '1.2'))
+SPARSE_BM25_B = float(os.getenv('SPARSE_BM25_B', '0.75'))
+SPARSE_AVG_DOC_LEN = float(os.getenv('SPARSE_AVG_DOC_LEN', '150'))  # Средняя длина блока в словах
+SPARSE_STEM_LENGTH = int(os.getenv('SPARSE_STEM_LENGTH', '0'))      # Усечение слов до префикса (0 — без усечения)
+
+# Двухуровневый поиск: векторы источников (центроиды блоков) во вспомогательной коллекции <коллекция>__sources
+SOURCE_INDEX_ENABLED = os.getenv('SOURCE_INDEX_ENABLED', 'True').lower() == 'true'
+SOURCE_SEARCH_TOP = int(os.getenv('SOURCE_SEARCH_TOP', '20'))  # Источников на первом уровне (0 — искать по всем блокам)
+
+# Провайдер эмбеддингов
+EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'gigachat').lower()  # gigachat / local / hashing
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'Embeddings')              # Модель эмбеддингов GigaChat
+EMBEDDING_MODEL_PATH = os.getenv('EMBEDDING_MODEL_PATH', '')              # Локальный каталог модели для local
+EMBEDDING_LOCAL_BACKEND = os.getenv('EMBEDDING_LOCAL_BACKEND', 'onnx')    # torch / onnx
+EMBEDDING_HASH_DIM = int(os.getenv('EMBEDDING_HASH_DIM', '512'))          # Размерность хэширующего векторизатора
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', '4'))
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'results/embedding_cache.sqlite')
+EMBEDDING_CACHE_MAX_MB = int(os.getenv('EMBEDDING_CACHE_MAX_MB', '256'))  # Максимальный размер кэша эмбеддингов
+
+# Кэш ответов LLM для детерминированных вызовов (генерация вопросов, итоговый отчет)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+LLM_CACHE_REPORT = os.getenv('LLM_CACHE_REPORT', 'False').lower() == 'true'  # Кэшировать итоговый отчет
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'results/llm_cache.sqlite')
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))  # Время жизни записи, сек
+LLM_CACHE_MAX_MB = int(os.getenv('LLM_CACHE_MAX_MB', '64'))
+
 # Путь к Excel файлу с источниками
 SOURCES_EXCEL_PATH = os.getenv('SOURCES_EXCEL_PATH', 'sources.xlsx')
 
+# Канонизация URL источников (ключ в индексе и кэше страниц)
+URL_CANON_FORCE_HTTPS = os.getenv('URL_CANON_FORCE_HTTPS', 'True').lower() == 'true'   # http и https — один источник
+URL_CANON_STRIP_WWW = os.getenv('URL_CANON_STRIP_WWW', 'True').lower() == 'true'       # www.example.com = example.com
+URL_CANON_USE_REL_CANONICAL = os.getenv('URL_CANON_USE_REL_CANONICAL', 'True').lower() == 'true'  # Учитывать <link rel="canonical">
+# Удаляемые параметры запроса (шаблоны fnmatch через запятую)
+URL_CANON_STRIP_PARAMS = os.getenv('URL_CANON_STRIP_PARAMS', 'utm_*,fbclid,gclid,yclid,ymclid,_openstat,mc_cid,mc_eid')
+# Находить источники, записанные до канонизации URL (весь адрес в нижнем регистре), и переводить их на канонический вид
+URL_CANON_LEGACY_MATCH = os.getenv('URL_CANON_LEGACY_MATCH', 'True').lower() == 'true'
+
+# Поиск почти повторяющихся страниц (SimHash): копии не векторизуются, а привязываются к оригиналу
+NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', 'True').lower() == 'true'
+NEAR_DUP_INDEX_PATH = os.getenv('NEAR_DUP_INDEX_PATH', 'results/near_dup.sqlite')
+NEAR_DUP_MAX_DISTANCE = int(os.getenv('NEAR_DUP_MAX_DISTANCE', '3'))  # Допустимое расстояние Хэмминга между отпечатками (из 64 бит)
+NEAR_DUP_SHINGLE_SIZE = int(os.getenv('NEAR_DUP_SHINGLE_SIZE', '4'))  # Слов в шингле
+NEAR_DUP_MIN_TOKENS = int(os.getenv('NEAR_DUP_MIN_TOKENS', '50'))     # Более короткие страницы не сравниваются
+
+# Локальный кэш загруженных страниц (для повторной обработки без сети)
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'True').lower() == 'true'
+PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH', 'results/page_cache.sqlite')
+PAGE_CACHE_MAX_MB = int(os.getenv('PAGE_CACHE_MAX_MB', '512'))  # Максимальный размер кэша (сжатые данные)
+
+# Вежливая загрузка страниц: ограничения по хостам
+FETCH_HOST_RATE = float(os.getenv('FETCH_HOST_RATE', '1.0'))       # Запросов в секунду к одному хосту
+FETCH_HOST_BURST = int(os.getenv('FETCH_HOST_BURST', '2'))          # Допустимый всплеск запросов к хосту
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '8'))                # Параллельных загрузок (к разным хостам)
+FETCH_RESPECT_ROBOTS = os.getenv('FETCH_RESPECT_ROBOTS', 'True').lower() == 'true'
+ROBOTS_CACHE_TTL = int(os.getenv('ROBOTS_CACHE_TTL', '86400'))      # Время жизни кэша robots.txt, сек
+FETCH_MAX_RETRY_AFTER = float(os.getenv('FETCH_MAX_RETRY_AFTER', '120'))  # Максимальное ожидание по Retry-After, сек
+
+# Ограничения на размер и тип загружаемых страниц
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(5 * 1024 * 1024)))   # Максимальный размер ответа, байт
+FETCH_ALLOWED_CONTENT_TYPES = os.getenv('FETCH_ALLOWED_CONTENT_TYPES', 'text/html,application/xhtml+xml,text/plain')
+CHARSET_DETECT_BYTES = int(os.getenv('CHARSET_DETECT_BYTES', '65536'))     # Объём данных для автоопределения кодировки
+
 # Параметры логирования
 LOG_FILE_PATH = os.getenv('LOG_FILE_PATH', 'results/agent_logs.txt')
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
+# Трассировка промптов и ответов LLM (логгер llm_trace)
+LLM_TRACE_LEVEL = os.getenv('LLM_TRACE_LEVEL', 'INFO')                  # WARNING — отключить трассировку
+LLM_TRACE_MAX_CHARS = int(os.getenv('LLM_TRACE_MAX_CHARS', '500'))       # Сколько символов промпта/ответа писать в лог
+LLM_TRACE_SAMPLE_RATE = float(os.getenv('LLM_TRACE_SAMPLE_RATE', '1.0'))  # Доля трассируемых вызовов
+LLM_TRACE_DIR = os.getenv('LLM_TRACE_DIR', '')                           # Каталог для полных текстов (gzip), пусто — не сохранять
+
 # Параметры веб-интерфейса
 WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
 WEB_PORT = int(os.getenv('WEB_PORT', '5000'))
 WEB_DEBUG = os.getenv('WEB_DEBUG', 'False').lower() == 'true'
 
-# Валидация обязательных параметров
-if not GIGACHAT_USERNAME or not GIGACHAT_PASSWORD:
-    raise ValueError("GIGACHAT_USERNAME и GIGACHAT_PASSWORD должны быть установлены в переменных окружения")
+# Валидация обязательных параметров (выполняется только там, где нужен GigaChat,
+# чтобы административные команды работали без учётных данных)
+def require_gigachat_credentials() -> None:
+    if not GIGACHAT_USERNAME or not GIGACHAT_PASSWORD:
+        raise ValueError("GIGACHAT_USERNAME и GIGACHAT_PASSWORD должны быть установлены в переменных окружения")
+
+DOCS_PER_ANSWER = int(os.getenv('DOCS_PER_ANSWER', 100))  # Кандидатов из векторной БД на вопрос (до отбора)
+
+# Адаптивный отбор блоков в контекст ответа: лимит на источник и обрезка по разрыву в оценках
+RETRIEVAL_ADAPTIVE = os.getenv('RETRIEVAL_ADAPTIVE', 'True').lower() == 'true'  # False — все DOCS_PER_ANSWER кандидатов
+RETRIEVAL_MIN_K = int(os.getenv('RETRIEVAL_MIN_K', '3'))
+RETRIEVAL_MAX_K = int(os.getenv('RETRIEVAL_MAX_K', '20'))
+RETRIEVAL_GAP_RATIO = float(os.getenv('RETRIEVAL_GAP_RATIO', '0.25'))  # Разрыв соседних косинусных оценок (доля их разброса) для обрезки
+RETRIEVAL_PER_SOURCE = int(os.getenv('RETRIEVAL_PER_SOURCE', '4'))     # Блоков одного источника (0 — без лимита)
+
+# Срок хранения проиндексированных блоков (0 — без ограничения)
+RETENTION_DAYS = float(os.getenv('RETENTION_DAYS', '0'))                     # Общий срок, дней
+RETENTION_RULES = os.getenv('RETENTION_RULES', '')                           # По хостам: host=дни через запятую
+RETENTION_SWEEP_INTERVAL = float(os.getenv('RETENTION_SWEEP_INTERVAL', '3600'))  # Период очистки в сервисе индексации, сек
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))        # Точек за одно удаление
+
+# Итоговый отчет: при большом числе вопросов ответы сжимаются в разделы (map-reduce)
+REPORT_MAX_PROMPT_CHARS = int(os.getenv('REPORT_MAX_PROMPT_CHARS', '30000'))  # Максимум материала в одном промпте, символов
+REPORT_SECTION_CHARS = int(os.getenv('REPORT_SECTION_CHARS', '4000'))         # Максимальный размер сжатого раздела
+REPORT_MAP_WORKERS = int(os.getenv('REPORT_MAP_WORKERS', '4'))                # Параллельных запросов сжатия
+
+# Контрольные точки LangGraph (SQLite) для возобновления прерванных запусков
+CHECKPOINT_ENABLED = os.getenv('CHECKPOINT_ENABLED', 'True').lower() == 'true'
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', 'results/checkpoints.sqlite')
+CHECKPOINT_SOURCES_PER_STEP = int(os.getenv('CHECKPOINT_SOURCES_PER_STEP', '10'))  # Источников между контрольными точками
+CHECKPOINT_ANSWERS_PER_STEP = int(os.getenv('CHECKPOINT_ANSWERS_PER_STEP', '1'))   # Ответов между контрольными точками
+CHECKPOINT_TTL = int(os.getenv('CHECKPOINT_TTL', str(7 * 24 * 3600)))  # Срок хранения контрольных точек запуска после последнего обращения, сек (0 — бессрочно)
+
+# Пакетный режим: сколько запросов обрабатывается одновременно после общей индексации источников
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
 
-DOCS_PER_ANSWER = int(os.getenv('DOCS_PER_ANSWER', 100))
+# Сервис фоновой индексации (ingest.py)
+INGEST_SERVICE_URL = os.getenv('INGEST_SERVICE_URL', '')               # Адрес сервиса для агента; пусто — индексировать в процессе агента
+INGEST_WAIT_TIMEOUT = float(os.getenv('INGEST_WAIT_TIMEOUT', '120'))   # Сколько агент ждёт сервис, сек
+INGEST_HOST = os.getenv('INGEST_HOST', '0.0.0.0')
+INGEST_PORT = int(os.getenv('INGEST_PORT', '5001'))
+INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '30'))          # Период опроса файлов источников, сек
+INGEST_REFRESH_INTERVAL = float(os.getenv('INGEST_REFRESH_INTERVAL', '3600'))  # Период проверки устаревших источников, сек
+INGEST_MAX_AGE_HOURS = float(os.getenv('INGEST_MAX_AGE_HOURS', '24'))          # Возраст, после которого источник загружается заново (0 — не обновлять)
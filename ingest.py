@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Сервис фоновой индексации источников
+
+Отслеживает файлы списков источников (xlsx, csv, txt, jsonl или каталоги с ними),
+принимает URL через HTTP API и поддерживает коллекцию Qdrant в актуальном состоянии,
+чтобы запросы пользователей не ждали загрузки и векторизации страниц.
+"""
+
+import argparse
+import sys
+import threading
+
+import config
+from utils.logger import get_logger
+
+ingest_logger = get_logger("ingest")
+
+
+def create_ingest_app(service):
+    """HTTP API сервиса индексации"""
+    from flask import Flask, Response, request, jsonify
+    from utils import metrics
+
+    app = Flask(__name__)
+
+    @app.route('/api/ingest', methods=['POST'])
+    def submit_urls():
+        """Поставить URL в очередь индексации: {"urls": [...]}"""
+        payload = request.get_json(silent=True) or {}
+        urls = payload.get('urls')
+        if not isinstance(urls, list):
+            return jsonify({'success': False, 'error': "Ожидается JSON с полем 'urls' (список)"}), 400
+        queued = service.submit(str(url) for url in urls)
+        return jsonify({'success': True, 'queued': queued})
+
+    @app.route('/api/ingest/status', methods=['GET'])
+    def ingest_status():
+        return jsonify(service.status())
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Фоновая индексация источников в Qdrant',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Примеры использования:
+  python ingest.py --sources sources.xlsx                 # Сервис: опрос файла и HTTP API
+  python ingest.py --sources lists/ --port 0              # Каталог со списками, без HTTP API
+  python ingest.py --sources sources.xlsx --once          # Однократная индексация
+  python ingest.py --sources sources.xlsx --refresh       # Переиндексировать устаревшие источники
+  python ingest.py --sources sources.xlsx --once --sweep  # Также удалить блоки с истёкшим сроком хранения
+        """
+    )
+    parser.add_argument('--sources', '-s', nargs='+', default=[config.SOURCES_EXCEL_PATH],
+                        help='Файлы или каталоги со списками источников')
+    parser.add_argument('--once', action='store_true', help='Проиндексировать отсутствующие источники и выйти')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Вместе с --once: также переиндексировать источники старше INGEST_MAX_AGE_HOURS')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Вместе с --once: также удалить блоки с истёкшим сроком хранения (RETENTION_DAYS, RETENTION_RULES)')
+    parser.add_argument('--poll-interval', type=float, help='Период опроса файлов источников, сек')
+    parser.add_argument('--refresh-interval', type=float, help='Период проверки устаревших источников, сек')
+    parser.add_argument('--max-age-hours', type=float, help='Возраст источника, после которого он загружается заново')
+    parser.add_argument('--host', default=config.INGEST_HOST, help='Адрес HTTP API')
+    parser.add_argument('--port', type=int, default=config.INGEST_PORT, help='Порт HTTP API (0 — без API)')
+    args = parser.parse_args()
+
+    from utils.ingestion import SourceIngestor, IngestionService
+
+    # Сервис сам является исполнителем индексации, поэтому INGEST_SERVICE_URL здесь не используется
+    service = IngestionService(
+        SourceIngestor(service_url=''),
+        source_paths=args.sources,
+        poll_interval=args.poll_interval,
+        refresh_interval=args.refresh_interval,
+        max_age_hours=args.max_age_hours
+    )
+
+    if args.once:
+        print(f"📥 Индексация источников из: {', '.join(args.sources)}")
+        service.run_once()
+        if args.refresh:
+            service.refresh_stale()
+        if args.sweep:
+            service.sweep_expired(force=True)
+        status = service.status()
+        print(f"✅ Обработано источников: {status['processed_sources']}, добавлено блоков: {status['documents']}, "
+              f"почти дубликатов: {status['near_duplicates']} ({status['saved_chunks']} блоков без векторизации), "
+              f"обновлено: {status['refreshed_sources']}, удалено устаревших блоков: {status['expired_chunks']}, "
+              f"ошибок: {status['errors']}")
+        sys.exit(1 if status['errors'] else 0)
+
+    stop = threading.Event()
+    if args.port:
+        from werkzeug.serving import make_server
+        server = make_server(args.host, args.port, create_ingest_app(service), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"🌐 API индексации: http://{args.host}:{args.port}/api/ingest")
+
+    print(f"📥 Сервис индексации запущен, источники: {', '.join(args.sources)}")
+    try:
+        service.run_forever(stop)
+    except KeyboardInterrupt:
+        print("\n⏹️  Остановлено пользователем")
+        stop.set()
+
+
+if __name__ == '__main__':
+    main()
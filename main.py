@@ -8,6 +8,7 @@ from datetime import datetime  # Исправлено: импортируем da
 import sys
 import json
 import os
+import time
 from pathlib import Path
 
 def main():
@@ -22,6 +23,13 @@ def main():
   python main.py "Анализ рынка" --output result.json     # Сохранение в файл
   python main.py --health                                # Проверка состояния
   python main.py --clear-db                                # Очистка БД
+  python main.py --reprocess-from-cache                  # Переобработка страниц из кэша
+  python main.py --rebuild-source-index                  # Построение векторов источников
+  python main.py --recanonicalize sources.xlsx           # Перевод старых записей на канонические URL
+  python main.py --export-snapshot snapshot.jsonl.gz     # Выгрузка коллекции и кэшей в файл
+  python main.py --import-snapshot snapshot.jsonl.gz     # Загрузка снимка на новом узле
+  python main.py --batch queries.jsonl -o results.jsonl  # Пакетная обработка запросов
+  python main.py --resume 3f2a...                        # Продолжить прерванный запуск
         """
     )
 
@@ -45,7 +53,7 @@ def main():
     parser.add_argument(
         '--sources', '-s',
         default='sources.xlsx',
-        help='Путь к Excel файлу с источниками (по умолчанию: sources.xlsx)'
+        help='Путь к файлу с источниками: xlsx, csv, txt или jsonl (по умолчанию: sources.xlsx)'
     )
 
     parser.add_argument(
@@ -70,6 +78,77 @@ def main():
     	'--clear-before-date',
     	help='Удалить документы, обработанные до указанной даты (формат: YYYY-MM-DD)'
     )
+
+    parser.add_argument(
+        '--sweep-expired',
+        action='store_true',
+        help='Удалить блоки с истёкшим сроком хранения (RETENTION_DAYS, RETENTION_RULES)'
+    )
+
+    parser.add_argument(
+        '--reprocess-from-cache',
+        action='store_true',
+        help='Заново разбить и проиндексировать сохранённые страницы без обращения к сети'
+    )
+
+    parser.add_argument(
+        '--rebuild-source-index',
+        action='store_true',
+        help='Построить векторы источников для двухуровневого поиска по уже проиндексированным блокам'
+    )
+
+    parser.add_argument(
+        '--recanonicalize',
+        metavar='SOURCES_FILE',
+        help='Перевести источники, проиндексированные до канонизации URL, на канонический вид по списку исходных URL'
+    )
+
+    parser.add_argument(
+        '--export-snapshot',
+        metavar='PATH',
+        help='Выгрузить коллекцию (векторы и payload) и отпечатки страниц в сжатый файл JSONL'
+    )
+
+    parser.add_argument(
+        '--import-snapshot',
+        metavar='PATH',
+        help='Загрузить снимок, сделанный --export-snapshot (для быстрого запуска нового узла без повторной индексации)'
+    )
+
+    parser.add_argument(
+        '--snapshot-pages',
+        action='store_true',
+        help='Включить в снимок (или загрузить из него) кэш загруженных страниц'
+    )
+
+    parser.add_argument(
+        '--snapshot-embeddings',
+        action='store_true',
+        help='Включить в снимок (или загрузить из него) кэш эмбеддингов'
+    )
+
+    parser.add_argument(
+        '--resume',
+        metavar='RUN_ID',
+        help='Продолжить прерванный запуск с последней контрольной точки (идентификатор выводится при старте)'
+    )
+
+    parser.add_argument(
+        '--batch',
+        help='Файл JSONL с запросами для пакетной обработки (по объекту {"query": ..., "sources": ...} на строку)'
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='Сколько запросов пакета обрабатывать одновременно (по умолчанию BATCH_CONCURRENCY)'
+    )
+
+    parser.add_argument(
+        '--update-collection-config',
+        action='store_true',
+        help='Применить параметры хранения, HNSW и квантования из конфигурации к существующей коллекции'
+    )
     args = parser.parse_args()
 
     # Настройка логирования
@@ -87,16 +166,47 @@ def main():
     if args.clear_before_date:
       from utils.vector_db import VectorDatabase
       vector_db = VectorDatabase()
-      vector_db.delete_by_date(args.clear_before_date)
-      print(f"🗑️ Удалены документы, обработанные до {args.clear_before_date}")
+      deleted = vector_db.delete_by_date(args.clear_before_date)
+      print(f"🗑️ Удалено {deleted} документов, обработанных до {args.clear_before_date}")
+      sys.exit(0)
+    if args.sweep_expired:
+      from utils.vector_db import VectorDatabase
+      from utils.retention import RetentionSweeper
+      deleted = RetentionSweeper(VectorDatabase()).sweep()
+      print(f"🗑️ Удалено блоков с истёкшим сроком хранения: {deleted}")
+      sys.exit(0)
+    if args.update_collection_config:
+      from utils.vector_db import VectorDatabase
+      try:
+        VectorDatabase().update_collection_settings()
+      except Exception as e:
+        print(f"❌ Не удалось обновить параметры коллекции: {e}")
+        sys.exit(1)
+      print("⚙️  Параметры коллекции обновлены")
+      sys.exit(0)
+    if args.reprocess_from_cache:
+      run_reprocess_from_cache()
+      sys.exit(0)
+    if args.export_snapshot or args.import_snapshot:
+      run_snapshot(args.export_snapshot, args.import_snapshot, args.snapshot_pages, args.snapshot_embeddings)
+      sys.exit(0)
+    if args.rebuild_source_index:
+      from utils.vector_db import VectorDatabase
+      built = VectorDatabase().rebuild_source_index()
+      print(f"🧭 Построены векторы {built} источников")
+      sys.exit(0)
+    if args.recanonicalize:
+      run_recanonicalize(args.recanonicalize)
       sys.exit(0)
     try:
         if args.health:
             run_health_check()
         elif args.web:
             run_web_interface()
-        elif args.query:
-            run_query_processing(args.query, args.sources, args.output)
+        elif args.batch:
+            run_batch_processing(args.batch, args.sources, args.output, args.concurrency)
+        elif args.query or args.resume:
+            run_query_processing(args.query, args.sources, args.output, run_id=args.resume)
         else:
             parser.print_help()
 
@@ -120,17 +230,15 @@ def run_health_check():
 
         # Проверка GigaChat
         print("\n🤖 Проверка подключения к GigaChat...")
-        from langchain_gigachat import GigaChat
-        llm = GigaChat(
-            user=config.GIGACHAT_USERNAME,
-            password=config.GIGACHAT_PASSWORD,
-            verify_ssl_certs=config.GIGACHAT_VERIFY_SSL,
-            scope=config.GIGACHAT_SCOPE,
-            profanity_check=config.GIGACHAT_PROFANITY_CHECK
-        )
-
-        test_response = llm.invoke("Привет")
-        print(f"✅ GigaChat доступен (ответ: {test_response.content[:50]}...)")
+        if not config.GIGACHAT_USERNAME or not config.GIGACHAT_PASSWORD:
+            print("⚠️  GIGACHAT_USERNAME и GIGACHAT_PASSWORD не заданы, проверка пропущена")
+        else:
+            from utils.gigachat_client import get_gigachat_manager
+            manager = get_gigachat_manager()
+            llm = manager.chat_model()
+
+            test_response = manager.call(lambda: llm.invoke("Привет"), 'llm')
+            print(f"✅ GigaChat доступен (ответ: {test_response.content[:50]}...)")
 
         # Проверка Qdrant
         print("\n🗃️  Проверка подключения к Qdrant...")
@@ -145,9 +253,9 @@ def run_health_check():
         # Проверка файла источников
         print("\n📄 Проверка файла источников...")
         if os.path.exists(config.SOURCES_EXCEL_PATH):
-            import pandas as pd
-            df = pd.read_excel(config.SOURCES_EXCEL_PATH)
-            print(f"✅ Файл источников найден ({len(df)} записей)")
+            from utils.source_loader import iter_source_urls
+            count = sum(1 for _ in iter_source_urls(config.SOURCES_EXCEL_PATH))
+            print(f"✅ Файл источников найден ({count} уникальных URL)")
         else:
             print(f"⚠️  Файл источников не найден: {config.SOURCES_EXCEL_PATH}")
 
@@ -157,6 +265,81 @@ def run_health_check():
         print(f"❌ Ошибка при проверке: {e}")
         sys.exit(1)
 
+def run_reprocess_from_cache():
+    """Повторная обработка страниц из локального кэша: извлечение, разбиение и эмбеддинги без сети"""
+    from utils.page_cache import PageCache
+    from utils.web_parser import WebParser
+    from utils.text_processor import TextProcessor
+    from utils.vector_db import VectorDatabase
+    from utils.ingestion import SourceIngestor
+
+    page_cache = PageCache()
+    web_parser = WebParser(page_cache=page_cache, offline=True)
+    ingestor = SourceIngestor(VectorDatabase(), web_parser, TextProcessor(), service_url='')
+
+    urls = list(page_cache.urls())
+    print(f"♻️  Повторная обработка {len(urls)} страниц из кэша {page_cache.path}")
+    total_chunks = 0
+    for i, url in enumerate(urls, 1):
+        try:
+            page = web_parser.fetch_cached(url)
+            if page is None:
+                print(f"⚠️  [{i}/{len(urls)}] Не удалось извлечь контент: {url}")
+                continue
+            added = ingestor.ingest_page(page, replace=True)
+            total_chunks += added
+            print(f"✅ [{i}/{len(urls)}] {page.url}: {added} блоков")
+        except Exception as e:
+            print(f"❌ [{i}/{len(urls)}] Ошибка при обработке {url}: {e}")
+    print(f"♻️  Готово, всего блоков: {total_chunks}")
+
+def run_recanonicalize(sources_file: str, batch_size: int = 1000):
+    """Перевод источников, записанных до канонизации URL, на канонический вид"""
+    from utils.source_loader import iter_source_urls
+    from utils.vector_db import VectorDatabase
+
+    vector_db = VectorDatabase()
+    print(f"🔗 Канонизация URL источников из {sources_file}...")
+    migrated = 0
+    batch = []
+    for url in iter_source_urls(sources_file):
+        batch.append(url)
+        if len(batch) >= batch_size:
+            migrated += len(vector_db.migrate_legacy_urls(batch))
+            batch = []
+    if batch:
+        migrated += len(vector_db.migrate_legacy_urls(batch))
+    print(f"✅ Переведено на канонические URL источников: {migrated}")
+
+def run_snapshot(export_path: str = None, import_path: str = None, with_pages: bool = False,
+                 with_embeddings: bool = False):
+    """Выгрузка или загрузка снимка коллекции вместе с локальными кэшами"""
+    import config
+    from utils.embeddings import EmbeddingCache
+    from utils.near_dup import NearDuplicateIndex
+    from utils.page_cache import PageCache
+    from utils.snapshot import export_snapshot, import_snapshot
+    from utils.vector_db import VectorDatabase
+
+    stores = {
+        'embedding_cache': EmbeddingCache() if with_embeddings and config.EMBEDDING_CACHE_ENABLED else None,
+        'near_duplicates': NearDuplicateIndex() if config.NEAR_DUP_ENABLED else None,
+        'page_cache': PageCache() if with_pages else None,
+    }
+    start = time.perf_counter()
+    if export_path:
+        print(f"📦 Выгрузка снимка в {export_path}...")
+        counts = export_snapshot(export_path, VectorDatabase(), **stores)
+        size = os.path.getsize(export_path) / (1024 * 1024)
+        print(f"✅ Снимок сохранён ({size:.1f} МБ за {time.perf_counter() - start:.1f} с)")
+    else:
+        print(f"📦 Загрузка снимка из {import_path}...")
+        counts = import_snapshot(import_path, VectorDatabase(), **stores)
+        print(f"✅ Снимок загружен за {time.perf_counter() - start:.1f} с")
+    print(f"   Блоков: {counts['points']}, векторов источников: {counts['source_points']}, "
+          f"эмбеддингов в кэше: {counts['embeddings']}, отпечатков страниц: {counts['fingerprints']}, "
+          f"страниц: {counts['pages']}")
+
 def run_web_interface():
     """Запуск веб-интерфейса"""
     print("🌐 Запуск веб-интерфейса...")
@@ -168,19 +351,27 @@ def run_web_interface():
         print(f"❌ Ошибка импорта веб-приложения: {e}")
         sys.exit(1)
 
-def run_query_processing(query: str, sources_file: str, output_file: str):
+def run_query_processing(query: str, sources_file: str, output_file: str, run_id: str = None):
     """Обработка запроса пользователя"""
-    print(f"🚀 Обработка запроса: {query}")
+    import uuid
+    resume = run_id is not None
+    run_id = run_id or uuid.uuid4().hex
+    print(f"🚀 Обработка запроса: {query or '(из контрольной точки)'}")
     print(f"📁 Источники: {sources_file}")
+    print(f"🔖 Идентификатор запуска: {run_id} (для продолжения после сбоя: --resume {run_id})")
 
     try:
-        # Проверяем существование файла источников
-        if not os.path.exists(sources_file):
+        import config
+        if resume and not config.CHECKPOINT_ENABLED:
+            print("❌ Продолжение запуска невозможно: контрольные точки отключены (CHECKPOINT_ENABLED=False)")
+            sys.exit(1)
+
+        # Проверяем существование файла источников (при продолжении список источников берётся из контрольной точки)
+        if not (resume and not query) and not os.path.exists(sources_file):
             print(f"❌ Файл источников не найден: {sources_file}")
             sys.exit(1)
 
         # Устанавливаем путь к источникам ТОЛЬКО для CLI
-        import config
         config.SOURCES_EXCEL_PATH = sources_file
 
         # Получаем агента и обрабатываем запрос
@@ -188,7 +379,20 @@ def run_query_processing(query: str, sources_file: str, output_file: str):
         agent = get_agent()
 
         print("⏳ Обработка запроса...")
-        result = agent.process_query(query, sources_path=sources_file)
+        streamed = []
+
+        def print_report_chunk(text: str):
+            # Итоговый отчет выводится по мере генерации
+            if not streamed:
+                print(f"\n📝 Итоговый отчет:")
+                print("=" * 80)
+            streamed.append(text)
+            print(text, end='', flush=True)
+
+        result = agent.process_query(query, sources_path=sources_file, run_id=run_id,
+                                     on_report_chunk=print_report_chunk)
+        if streamed:
+            print("\n" + "=" * 80)
 
         if result['status'] == 'success':
             print("\n✅ Обработка завершена успешно!")
@@ -196,15 +400,17 @@ def run_query_processing(query: str, sources_file: str, output_file: str):
             print(f"   - Обработано источников: {result['processed_sources']}")
             print(f"   - Всего документов: {result['total_documents']}")
             print(f"   - Сгенерировано вопросов: {len(result['questions'])}")
+            print(f"   - Кэш LLM: попаданий {result['llm_cache']['hits']}, промахов {result['llm_cache']['misses']}")
 
-            print(f"\n📝 Итоговый отчет:")
-            print("=" * 80)
-            print(result['final_report'])
-            print("=" * 80)
+            if not streamed:
+                print(f"\n📝 Итоговый отчет:")
+                print("=" * 80)
+                print(result['final_report'])
+                print("=" * 80)
 
             # Сохраняем результат всегда
-            if args.output:
-                output_path = args.output
+            if output_file:
+                output_path = output_file
             else:
                 os.makedirs('results', exist_ok=True)
                 output_path = f"results/result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -220,6 +426,51 @@ def run_query_processing(query: str, sources_file: str, output_file: str):
         print(f"❌ Ошибка при обработке запроса: {e}")
         sys.exit(1)
 
+def run_batch_processing(batch_file: str, sources_file: str, output_file: str, concurrency: int = None):
+    """Пакетная обработка: общая индексация источников и параллельные ответы на запросы"""
+    from utils.batch import read_batch_requests, JsonlResultWriter
+
+    requests = read_batch_requests(batch_file)
+    print(f"📦 Пакетная обработка: {len(requests)} запросов из {batch_file}")
+
+    missing = {item.get('sources') or sources_file for item in requests}
+    missing = [path for path in missing if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Файлы источников не найдены: {', '.join(missing)}")
+        sys.exit(1)
+
+    if not output_file:
+        os.makedirs('results', exist_ok=True)
+        output_file = f"results/batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+
+    from agent import get_agent
+    agent = get_agent()
+
+    done = 0
+    failed = 0
+    with JsonlResultWriter(output_file) as writer:
+        def on_result(result: dict):
+            nonlocal done, failed
+            done += 1
+            failed += result['status'] != 'success'
+            writer.write(result)
+            mark = '✅' if result['status'] == 'success' else '❌'
+            print(f"{mark} [{done}/{len(requests)}] {result['id']}: {result['user_query']}")
+
+        print("⏳ Обработка пакета...")
+        results = agent.process_batch(requests, sources_path=sources_file,
+                                      concurrency=concurrency, on_result=on_result)
+
+    if results:
+        ingest = results[0]['batch_ingest']
+        print(f"\n📊 Индексация: обработано источников {ingest['processed_sources']}, "
+              f"добавлено блоков {ingest['total_documents']}, почти дубликатов {ingest['near_duplicates']} "
+              f"за {ingest['seconds']:.1f} с")
+    print(f"💾 Результаты сохранены в {output_file}")
+    if failed:
+        print(f"⚠️  С ошибкой завершено запросов: {failed}")
+        sys.exit(1)
+
 def save_result_to_file(result: dict, output_file: str):
     """Сохранение результата в файл"""
     try:
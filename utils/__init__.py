@@ -1,16 +1,26 @@
 """
 Утилиты для агента-суммаризатора информации
+
+Подмодули загружаются лениво при первом обращении к атрибуту пакета,
+чтобы импорт utils не тянул за собой Qdrant, эмбеддинги и парсер.
 """
 
-from .logger import get_logger, WebLogHandler
-from .vector_db import VectorDatabase  
-from .text_processor import TextProcessor
-from .web_parser import WebParser
+import importlib
+
+_EXPORTS = {
+    'get_logger': '.logger',
+    'WebLogHandler': '.logger',
+    'VectorDatabase': '.vector_db',
+    'TextProcessor': '.text_processor',
+    'WebParser': '.web_parser',
+}
+
+__all__ = list(_EXPORTS)
+
 
-__all__ = [
-    'get_logger',
-    'WebLogHandler', 
-    'VectorDatabase',
-    'TextProcessor',
-    'WebParser'
-]
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
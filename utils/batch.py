@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+
+def parse_batch_requests(lines, base_dir: str = None) -> List[Dict[str, Any]]:
+    """Разбирает строки JSONL пакетного режима.
+
+    Каждая строка — объект с полем 'query' (или 'user_query'), необязательными 'id' и 'sources'
+    (путь к файлу источников; относительный путь отсчитывается от base_dir), либо просто строка запроса."""
+    requests = []
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Строка {line_no}: некорректный JSON ({e})") from e
+        if isinstance(record, str):
+            record = {'query': record}
+        if not isinstance(record, dict):
+            raise ValueError(f"Строка {line_no}: ожидается объект JSON или строка запроса")
+        query = record.get('query') or record.get('user_query')
+        if not query:
+            raise ValueError(f"Строка {line_no}: не указан запрос (поле 'query')")
+        if not isinstance(query, str):
+            raise ValueError(f"Строка {line_no}: запрос должен быть строкой")
+        item = {'id': record.get('id', line_no), 'query': query}
+        sources = record.get('sources')
+        if sources and not isinstance(sources, str):
+            raise ValueError(f"Строка {line_no}: поле 'sources' должно быть путём к файлу")
+        if sources:
+            item['sources'] = os.path.join(base_dir, sources) if base_dir and not os.path.isabs(sources) else sources
+        requests.append(item)
+    return requests
+
+
+def read_batch_requests(path: str) -> List[Dict[str, Any]]:
+    """Читает файл запросов пакетного режима (JSONL)"""
+    with open(path, encoding='utf-8-sig') as f:
+        return parse_batch_requests(f, base_dir=os.path.dirname(os.path.abspath(path)))
+
+
+class JsonlResultWriter:
+    """Дописывает результаты в JSONL-файл по мере готовности (по одной строке на запрос)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+import config
+from utils import metrics
+from utils.gigachat_client import estimate_tokens, get_gigachat_manager
+
+logger = logging.getLogger(__name__)
+
+# Вытеснение из кэша эмбеддингов освобождает место с запасом, чтобы заполненный кэш не вытеснял при каждой записи
+_EVICT_TO = 0.9
+
+
+class EmbeddingProvider:
+    """Базовый интерфейс провайдера эмбеддингов"""
+
+    name = 'base'
+
+    def __init__(self, model: str = ''):
+        self.model = model
+
+    @property
+    def tag(self) -> str:
+        """Идентификатор провайдера и модели, которым помечается коллекция"""
+        return f"{self.name}:{self.model}"
+
+    @property
+    def dimension(self) -> Optional[int]:
+        """Размерность векторов, если известна без обращения к модели"""
+        return None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class BatchedEmbeddingProvider(EmbeddingProvider):
+    """Провайдер, обрабатывающий тексты батчами в пуле потоков"""
+
+    def __init__(self, model: str = '', batch_size: int = None, workers: int = None):
+        super().__init__(model)
+        self.batch_size = batch_size or config.EMBEDDING_BATCH_SIZE
+        self.workers = workers or config.EMBEDDING_WORKERS
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"embed-{self.name}")
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def _measured_batch(self, texts: List[str]) -> List[List[float]]:
+        metrics.EMBEDDING_BATCH_SIZE.observe(len(texts), provider=self.name)
+        with metrics.EMBEDDING_DURATION.time(provider=self.name):
+            return self._embed_batch(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._measured_batch(batches[0])
+        vectors = []
+        for batch_vectors in self._executor.map(self._measured_batch, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+
+class GigaChatEmbeddingProvider(BatchedEmbeddingProvider):
+    """Эмбеддинги GigaChat (удалённый вызов API)"""
+
+    name = 'gigachat'
+
+    def __init__(self, model: str = None, **kwargs):
+        config.require_gigachat_credentials()
+        super().__init__(model or config.EMBEDDING_MODEL or 'Embeddings', **kwargs)
+        # Общий клиент GigaChat: один токен и пул соединений, общий с LLM бюджет запросов
+        self._manager = get_gigachat_manager()
+        self._client = self._manager.embeddings(self.model)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return self._manager.call(lambda: self._client.embed_documents(texts), 'embeddings', tokens)
+
+    def embed_query(self, text: str) -> List[float]:
+        metrics.EMBEDDING_BATCH_SIZE.observe(1, provider=self.name)
+        with metrics.EMBEDDING_DURATION.time(provider=self.name):
+            return self._manager.call(lambda: self._client.embed_query(text), 'embeddings', estimate_tokens(text))
+
+
+class SentenceTransformerEmbeddingProvider(BatchedEmbeddingProvider):
+    """Локальные эмбеддинги на CPU: модель sentence-transformers (PyTorch или ONNX) из локального каталога"""
+
+    name = 'local'
+
+    def __init__(self, model_path: str = None, backend: str = None, **kwargs):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("Для EMBEDDING_PROVIDER=local установите пакет sentence-transformers") from e
+
+        model_path = model_path or config.EMBEDDING_MODEL_PATH
+        if not model_path:
+            raise ValueError("EMBEDDING_MODEL_PATH должен указывать на локальный каталог модели")
+        backend = backend or config.EMBEDDING_LOCAL_BACKEND
+        super().__init__(f"{os.path.basename(os.path.normpath(model_path))}/{backend}", **kwargs)
+        self._model = SentenceTransformer(model_path, device='cpu', backend=backend, local_files_only=True)
+        # Один экземпляр модели не рассчитан на параллельный вызов encode из нескольких потоков
+        self._lock = threading.Lock()
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._model.get_sentence_embedding_dimension()
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            vectors = self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+        return vectors.tolist()
+
+
+class HashingEmbeddingProvider(BatchedEmbeddingProvider):
+    """Хэширующий векторизатор слов и биграмм: без модели и сети, для тестов и изолированных стендов"""
+
+    name = 'hashing'
+    _token_re = re.compile(r'\w+', re.UNICODE)
+
+    def __init__(self, dim: int = None, **kwargs):
+        self.dim = dim or config.EMBEDDING_HASH_DIM
+        super().__init__(f"words-bigrams-{self.dim}", **kwargs)
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.dim
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        tokens = self._token_re.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'little') % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm == 0:
+            vector[0] = 1.0
+            return vector
+        return [v / norm for v in vector]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+class EmbeddingCache:
+    """Локальный кэш эмбеддингов (SQLite, float32) с ключом по провайдеру, модели и тексту
+    и ограничением по размеру (вытесняются давно не использованные записи)"""
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        self.path = path or config.EMBEDDING_CACHE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, tag TEXT, vector BLOB, created_at REAL, accessed_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")}
+        if 'accessed_at' not in columns:
+            # Кэш, созданный до появления лимита размера
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN accessed_at REAL")
+            self._conn.execute("UPDATE embeddings SET accessed_at = created_at")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_accessed ON embeddings (accessed_at)")
+        self._conn.commit()
+        # Размер кэша ведётся в памяти, чтобы запись не пересчитывала его по всей таблице
+        self._total = self._sum_sizes()
+
+    @staticmethod
+    def key(tag: str, text: str) -> str:
+        return hashlib.sha1(f"{tag}\n{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+            if found:
+                hits = list(found)
+                now = time.time()
+                for i in range(0, len(hits), 500):
+                    part = hits[i:i + 500]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET accessed_at = ? WHERE key IN ({','.join('?' * len(part))})", [now, *part]
+                    )
+                self._conn.commit()
+        return found
+
+    def put_many(self, tag: str, items: dict) -> None:
+        now = time.time()
+        self._write([(key, tag, array('f', vector).tobytes(), now) for key, vector in items.items()], now)
+
+    def export_rows(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """Перечисляет записи кэша (key, tag, vector float32, created_at) пачками, не загружая весь кэш в память"""
+        last_key = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, tag, vector, created_at FROM embeddings WHERE key > ? ORDER BY key LIMIT ?",
+                    (last_key, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_key = rows[-1][0]
+
+    def import_rows(self, rows: List[tuple]) -> None:
+        """Записывает строки, полученные из export_rows (существующие ключи перезаписываются)"""
+        self._write(rows, time.time())
+
+    def total_size(self) -> int:
+        """Суммарный размер векторов в байтах"""
+        with self._lock:
+            return self._sum_sizes()
+
+    def _write(self, rows: List[tuple], accessed_at: float) -> None:
+        with self._lock:
+            keys = [row[0] for row in rows]
+            replaced = 0
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, tag, vector, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                [(*row, accessed_at) for row in rows]
+            )
+            self._total += sum(len(row[2]) for row in rows) - replaced
+            self._evict()
+            self._conn.commit()
+
+    def _sum_sizes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def _evict(self) -> None:
+        """Удаляет давно не использованные записи, пока кэш не уложится в 90% лимита (вызывается под блокировкой)"""
+        if not self.max_bytes or self._total <= self.max_bytes:
+            return
+        # Файл кэша могут дополнять другие процессы, поэтому перед вытеснением размер уточняется
+        self._total = self._sum_sizes()
+        target = int(self.max_bytes * _EVICT_TO)
+        removed = 0
+        while self._total > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY accessed_at LIMIT 500"
+            ).fetchall()
+            if not rows:
+                break
+            batch = []
+            for key, size in rows:
+                if self._total <= target:
+                    break
+                batch.append((key,))
+                self._total -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", batch)
+            removed += len(batch)
+        logger.debug(f"Из кэша эмбеддингов вытеснено {removed} записей (размер: {self._total} байт)")
+
+
+class CachingEmbeddingProvider(EmbeddingProvider):
+    """Обёртка над провайдером: повторные тексты не отправляются на векторизацию"""
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache = None):
+        super().__init__(provider.model)
+        self.provider = provider
+        self.name = provider.name
+        self.cache = cache or EmbeddingCache()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.provider.dimension
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(self.tag, text) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            vectors = self.provider.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.tag, computed)
+            cached.update(computed)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Запрос векторизуется методом провайдера (префикс запроса GigaChat, метрики, бюджет) и кэшируется
+        # под отдельным ключом: вектор запроса может отличаться от вектора документа с тем же текстом
+        key = EmbeddingCache.key(f"query:{self.tag}", text)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+        vector = self.provider.embed_query(text)
+        self.cache.put_many(self.tag, {key: vector})
+        self.misses += 1
+        return vector
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Создаёт провайдер эмбеддингов согласно EMBEDDING_PROVIDER (gigachat / local / hashing)"""
+    providers = {
+        'gigachat': GigaChatEmbeddingProvider,
+        'local': SentenceTransformerEmbeddingProvider,
+        'hashing': HashingEmbeddingProvider,
+    }
+    provider_cls = providers.get(config.EMBEDDING_PROVIDER)
+    if provider_cls is None:
+        raise ValueError(f"Неизвестный провайдер эмбеддингов: {config.EMBEDDING_PROVIDER}")
+    provider = provider_cls()
+    logger.info(f"Провайдер эмбеддингов: {provider.tag}")
+    if config.EMBEDDING_CACHE_ENABLED:
+        provider = CachingEmbeddingProvider(provider)
+    return provider
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Как и поисковые роботы, читаем только начало очень большого robots.txt
+_ROBOTS_MAX_BYTES = 512 * 1024
+
+
+class _HostState:
+    """Состояние token bucket для одного хоста"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+
+class HostScheduler:
+    """Планировщик загрузок с учётом хоста: token bucket на домен, Retry-After и crawl-delay из robots.txt"""
+
+    def __init__(self, session: requests.Session = None, rate: float = None, burst: int = None,
+                 respect_robots: bool = None):
+        self.session = session or requests.Session()
+        self.rate = rate if rate is not None else config.FETCH_HOST_RATE
+        self.burst = burst if burst is not None else config.FETCH_HOST_BURST
+        self.respect_robots = respect_robots if respect_robots is not None else config.FETCH_RESPECT_ROBOTS
+        if self.rate <= 0:
+            raise ValueError(f"FETCH_HOST_RATE должен быть больше 0 (задано {self.rate})")
+        if self.burst < 1:
+            raise ValueError(f"FETCH_HOST_BURST должен быть не меньше 1 (задано {self.burst})")
+        self.robots_ttl = config.ROBOTS_CACHE_TTL
+        self.max_retry_after = config.FETCH_MAX_RETRY_AFTER
+
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, _HostState] = {}
+        self._robots: Dict[str, tuple] = {}
+        self._robots_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def acquire(self, url: str) -> None:
+        """Блокирует поток, пока для хоста URL не освободится токен"""
+        host = self.host_of(url)
+        state = self._host_state(host)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                state.tokens = min(state.burst, state.tokens + (now - state.updated_at) * state.rate)
+                state.updated_at = now
+                if now >= state.blocked_until and state.tokens >= 1:
+                    state.tokens -= 1
+                    return
+                wait = max(state.blocked_until - now, (1 - state.tokens) / state.rate)
+            logger.debug(f"Ожидание {wait:.2f} с перед запросом к {host}")
+            time.sleep(wait)
+
+    def concurrency(self, url: str) -> int:
+        """Сколько запросов к хосту URL допускается одновременно (всплеск token bucket;
+        после crawl-delay из robots.txt — один)"""
+        state = self._host_state(self.host_of(url))
+        with self._lock:
+            return state.burst
+
+    def defer(self, url: str, delay: float) -> None:
+        """Откладывает следующие запросы к хосту на delay секунд (Retry-After, ошибки)"""
+        host = self.host_of(url)
+        state = self._host_state(host)
+        delay = min(delay, self.max_retry_after)
+        with self._lock:
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+        logger.info(f"Запросы к {host} отложены на {delay:.1f} с")
+
+    def retry_after(self, response: requests.Response) -> Optional[float]:
+        """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def can_fetch(self, url: str) -> bool:
+        """Проверяет разрешение robots.txt для URL"""
+        if not self.respect_robots:
+            return True
+        parser = self._robots_for(url)
+        if parser is None:
+            return True
+        return parser.can_fetch(self.session.headers.get('User-Agent', '*'), url)
+
+    def interleave(self, urls: List[str]) -> List[str]:
+        """Переставляет URL так, чтобы подряд шли разные хосты (round-robin по хостам)"""
+        by_host: "OrderedDict[str, List[str]]" = OrderedDict()
+        for url in urls:
+            by_host.setdefault(self.host_of(url), []).append(url)
+        queues = [list(reversed(host_urls)) for host_urls in by_host.values()]
+        result = []
+        while queues:
+            for queue in queues:
+                result.append(queue.pop())
+            queues = [queue for queue in queues if queue]
+        return result
+
+    def _host_state(self, host: str) -> _HostState:
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = _HostState(self.rate, self.burst)
+                self._hosts[host] = state
+            return state
+
+    def _robots_for(self, url: str) -> Optional[RobotFileParser]:
+        """Возвращает закэшированный разбор robots.txt и применяет crawl-delay к хосту"""
+        parts = urlsplit(url)
+        host = parts.netloc.lower()
+        with self._lock:
+            host_lock = self._robots_locks.setdefault(host, threading.Lock())
+
+        with host_lock:
+            cached = self._robots.get(host)
+            if cached is not None and time.monotonic() - cached[0] < self.robots_ttl:
+                return cached[1]
+
+            parser = None
+            robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+            try:
+                from utils.web_parser import read_limited
+
+                self.acquire(robots_url)
+                with self.session.get(robots_url, timeout=10, stream=True) as response:
+                    if response.status_code < 400:
+                        body = read_limited(response, _ROBOTS_MAX_BYTES, robots_url, truncate=True)
+                        parser = RobotFileParser(robots_url)
+                        parser.parse(body.decode('utf-8', errors='replace').splitlines())  # RFC 9309: UTF-8
+            except requests.exceptions.RequestException as e:
+                logger.debug(f"Не удалось загрузить {robots_url}: {e}")
+
+            if parser is not None:
+                delay = parser.crawl_delay(self.session.headers.get('User-Agent', '*'))
+                # Crawl-delay: 0 означает отсутствие задержки, а не бесконечную частоту запросов
+                if delay is not None and float(delay) > 0:
+                    state = self._host_state(host)
+                    with self._lock:
+                        state.rate = min(state.rate, 1.0 / float(delay))
+                        state.burst = 1
+                        state.tokens = min(state.tokens, 1.0)
+                    logger.info(f"robots.txt {host}: crawl-delay {delay} с")
+
+            self._robots[host] = (time.monotonic(), parser)
+            return parser
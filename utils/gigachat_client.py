@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Грубая оценка числа токенов по длине текста (для бюджета токенов в минуту)
+_CHARS_PER_TOKEN = 3
+
+# Коды ответа, при которых запрос повторяется и учитывается предохранителем
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class GigaChatUnavailableError(RuntimeError):
+    """Предохранитель разомкнут: GigaChat недавно отвечал ошибками, запросы временно не отправляются"""
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // _CHARS_PER_TOKEN)
+
+
+class _MinuteBudget:
+    """Token bucket с ёмкостью limit единиц в минуту; limit <= 0 — без ограничения"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.available = float(limit)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.limit, self.available + (now - self.updated_at) * self.limit / 60.0)
+        self.updated_at = now
+
+    def acquire(self, amount: int) -> float:
+        """Блокирует поток, пока бюджет не позволит потратить amount; возвращает время ожидания, сек"""
+        if self.limit <= 0:
+            return 0.0
+        # Запрос больше минутного бюджета пропускается при полном бюджете, иначе он не выполнился бы никогда
+        amount = min(amount, self.limit)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.available >= amount:
+                    self.available -= amount
+                    return waited
+                wait = (amount - self.available) * 60.0 / self.limit
+            time.sleep(wait)
+            waited += wait
+
+    def charge(self, amount: int) -> None:
+        """Списывает уже потраченное (например, токены ответа); бюджет может уйти в минус"""
+        if self.limit <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.available -= amount
+
+
+class GigaChatClientManager:
+    """Общий на процесс доступ к GigaChat.
+
+    LLM и эмбеддинги используют один клиент SDK (один OAuth-токен и пул HTTP-соединений),
+    все вызовы проходят через общий бюджет запросов и токенов в минуту, ошибки 429/5xx
+    повторяются с экспоненциальной задержкой, а серия таких ошибок размыкает предохранитель."""
+
+    def __init__(self, rpm: int = None, tpm: int = None, max_retries: int = None, backoff: float = None,
+                 breaker_threshold: int = None, breaker_cooldown: float = None):
+        self.requests_budget = _MinuteBudget(config.GIGACHAT_RPM if rpm is None else rpm)
+        self.tokens_budget = _MinuteBudget(config.GIGACHAT_TPM if tpm is None else tpm)
+        self.max_retries = config.GIGACHAT_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = config.GIGACHAT_RETRY_BACKOFF if backoff is None else backoff
+        self.breaker_threshold = config.GIGACHAT_BREAKER_THRESHOLD if breaker_threshold is None else breaker_threshold
+        self.breaker_cooldown = config.GIGACHAT_BREAKER_COOLDOWN if breaker_cooldown is None else breaker_cooldown
+
+        self._lock = threading.Lock()
+        self._sdk_client = None
+        self._chat_model = None
+        self._embeddings = {}
+        self._failures = 0
+        self._open_until = 0.0
+        self._blocked_until = 0.0
+
+    # --- Клиенты ---
+
+    def _client(self):
+        """Клиент SDK gigachat, общий для LLM и эмбеддингов"""
+        with self._lock:
+            if self._sdk_client is None:
+                import gigachat
+
+                config.require_gigachat_credentials()
+                self._sdk_client = gigachat.GigaChat(
+                    user=config.GIGACHAT_USERNAME,
+                    password=config.GIGACHAT_PASSWORD,
+                    base_url=config.GIGACHAT_BASE_URL,
+                    auth_url=config.GIGACHAT_AUTH_URL,
+                    scope=config.GIGACHAT_SCOPE,
+                    verify_ssl_certs=config.GIGACHAT_VERIFY_SSL,
+                    profanity_check=config.GIGACHAT_PROFANITY_CHECK,
+                    max_connections=config.GIGACHAT_MAX_CONNECTIONS or None,
+                )
+                logger.info("Создан общий клиент GigaChat")
+            return self._sdk_client
+
+    @staticmethod
+    def _attach(model, client):
+        # Обёртки langchain_gigachat создают клиент SDK в cached_property _client;
+        # подставляем общий, чтобы не получать отдельный токен и пул соединений на каждую обёртку
+        model.__dict__['_client'] = client
+        return model
+
+    def chat_model(self):
+        """LLM GigaChat (LangChain) на общем клиенте"""
+        if self._chat_model is None:
+            from langchain_gigachat import GigaChat
+
+            client = self._client()
+            self._chat_model = self._attach(GigaChat(
+                user=config.GIGACHAT_USERNAME,
+                password=config.GIGACHAT_PASSWORD,
+                base_url=config.GIGACHAT_BASE_URL,
+                auth_url=config.GIGACHAT_AUTH_URL,
+                scope=config.GIGACHAT_SCOPE,
+                verify_ssl_certs=config.GIGACHAT_VERIFY_SSL,
+                profanity_check=config.GIGACHAT_PROFANITY_CHECK,
+                temperature=0.1
+            ), client)
+        return self._chat_model
+
+    def embeddings(self, model: str):
+        """Эмбеддинги GigaChat (LangChain) на общем клиенте"""
+        if model not in self._embeddings:
+            from langchain_gigachat import GigaChatEmbeddings
+
+            client = self._client()
+            self._embeddings[model] = self._attach(GigaChatEmbeddings(
+                user=config.GIGACHAT_USERNAME,
+                password=config.GIGACHAT_PASSWORD,
+                base_url=config.GIGACHAT_BASE_URL,
+                auth_url=config.GIGACHAT_AUTH_URL,
+                scope=config.GIGACHAT_SCOPE,
+                verify_ssl_certs=config.GIGACHAT_VERIFY_SSL,
+                model=model
+            ), client)
+        return self._embeddings[model]
+
+    # --- Бюджет и предохранитель ---
+
+    @staticmethod
+    def _status_of(error: Exception) -> Optional[int]:
+        status = getattr(error, 'status_code', None)
+        if status is None:
+            response = getattr(error, 'response', None)
+            status = getattr(response, 'status_code', None)
+        return status if isinstance(status, int) else None
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        try:
+            value = getattr(error, 'retry_after', None)
+            return float(value) if value else None
+        except (TypeError, ValueError):
+            return None
+
+    def _check_breaker(self, kind: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                raise GigaChatUnavailableError(
+                    f"GigaChat временно недоступен (повтор через {self._open_until - now:.0f} с)")
+            blocked = self._blocked_until - now
+        # После 429 все потоки выдерживают паузу, а не только получивший ошибку
+        if blocked > 0:
+            metrics.GIGACHAT_THROTTLE_SECONDS.inc(blocked, kind=kind)
+            time.sleep(blocked)
+
+    def _record_success(self) -> None:
+        with self._lock:
+            if self._failures:
+                self._failures = 0
+                metrics.GIGACHAT_BREAKER_OPEN.set(0)
+
+    def _record_failure(self, kind: str, status: int, delay: float) -> None:
+        metrics.GIGACHAT_ERRORS.inc(kind=kind, status=str(status))
+        with self._lock:
+            self._failures += 1
+            now = time.monotonic()
+            if status == 429:
+                self._blocked_until = max(self._blocked_until, now + delay)
+            if self._failures >= self.breaker_threshold:
+                self._open_until = now + self.breaker_cooldown
+                metrics.GIGACHAT_BREAKER_OPEN.set(1)
+                logger.error(f"GigaChat: {self._failures} ошибок подряд, запросы приостановлены "
+                             f"на {self.breaker_cooldown:.0f} с")
+
+    def call(self, fn: Callable[[], T], kind: str, prompt_tokens: int = 0,
+             response_tokens: Callable[[T], int] = None, retryable: Callable[[], bool] = None) -> T:
+        """Выполняет запрос к GigaChat в рамках общего бюджета.
+
+        kind — тип запроса для метрик (llm, embeddings), prompt_tokens — оценка токенов запроса,
+        response_tokens — функция оценки токенов ответа (списываются после выполнения),
+        retryable — можно ли повторить запрос после ошибки (например, если потоковый ответ ещё не начался)."""
+        attempt = 0
+        while True:
+            self._check_breaker(kind)
+            waited = self.requests_budget.acquire(1) + self.tokens_budget.acquire(prompt_tokens)
+            if waited:
+                metrics.GIGACHAT_THROTTLE_SECONDS.inc(waited, kind=kind)
+            try:
+                result = fn()
+            except Exception as e:
+                status = self._status_of(e)
+                if status not in _RETRYABLE_STATUSES:
+                    raise
+                delay = self._retry_after(e) or self.backoff * (2 ** attempt)
+                self._record_failure(kind, status, delay)
+                if attempt >= self.max_retries or (retryable is not None and not retryable()):
+                    raise
+                attempt += 1
+                logger.warning(f"GigaChat ответил {status}, повтор {attempt}/{self.max_retries} через {delay:.1f} с")
+                time.sleep(delay)
+                continue
+            self._record_success()
+            if response_tokens is not None:
+                self.tokens_budget.charge(response_tokens(result))
+            return result
+
+
+_manager: Optional[GigaChatClientManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_gigachat_manager() -> GigaChatClientManager:
+    """Менеджер доступа к GigaChat, общий для процесса"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = GigaChatClientManager()
+        return _manager
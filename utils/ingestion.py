@@ -0,0 +1,357 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+import config
+from utils import metrics
+from utils.near_dup import NearDuplicateIndex, simhash
+from utils.retention import RetentionSweeper
+from utils.source_loader import SUPPORTED_EXTENSIONS, iter_source_urls
+from utils.url_canon import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+
+class SourceIngestor:
+    """Индексация источников: парсинг, разбиение на блоки, эмбеддинги и запись в векторную БД"""
+
+    def __init__(self, vector_db=None, web_parser=None, text_processor=None, service_url: str = None,
+                 near_duplicates: NearDuplicateIndex = None):
+        from utils.vector_db import VectorDatabase
+        from utils.web_parser import WebParser
+        from utils.text_processor import TextProcessor
+
+        self.vector_db = vector_db or VectorDatabase()
+        self.web_parser = web_parser or WebParser()
+        self.text_processor = text_processor or TextProcessor()
+        # Адрес сервиса индексации (ingest.py); если задан, недостающие URL сначала передаются ему
+        self.service_url = (config.INGEST_SERVICE_URL if service_url is None else service_url).rstrip('/')
+        # Индекс SimHash-отпечатков: почти повторяющиеся страницы привязываются к уже проиндексированным
+        if near_duplicates is None and config.NEAR_DUP_ENABLED:
+            near_duplicates = NearDuplicateIndex()
+        self.near_duplicates = near_duplicates
+        self.stats = {"near_duplicates": 0, "saved_chunks": 0}
+
+    def ingest_url(self, url: str, replace: bool = False) -> int:
+        """Загружает и индексирует один источник; возвращает число добавленных блоков.
+        replace — заменить ранее проиндексированные блоки источника"""
+        return self._ingest_fetched(url, self.web_parser.fetch(url), replace=replace)
+
+    def _ingest_fetched(self, url: str, page, replace: bool = False) -> int:
+        if page is None:
+            logger.warning(f"Не удалось извлечь контент из {url}")
+            return 0
+        return self.ingest_page(page, replace=replace)
+
+    def fetch_pages(self, urls: List[str], workers: int = None) -> Iterator[Tuple[str, Any, Optional[Exception]]]:
+        """Загружает страницы пулом из workers потоков и выдаёт (url, страница, ошибка) по мере готовности.
+
+        URL раскладываются по очередям хостов, которые обслуживаются по кругу; к одному хосту одновременно
+        идёт не больше scheduler.concurrency запросов, поэтому потоки не простаивают в ожидании токена
+        одного медленного хоста, пока другие хосты свободны. Темп запросов к хосту задаёт сам планировщик."""
+        scheduler = self.web_parser.scheduler
+        workers = max(1, workers or config.FETCH_WORKERS)
+        queues: "OrderedDict[str, deque]" = OrderedDict()
+        for url in urls:
+            queues.setdefault(scheduler.host_of(url), deque()).append(url)
+        in_flight: Dict[str, int] = {host: 0 for host in queues}
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch') as pool:
+            def submit_ready():
+                for host in list(queues):
+                    if len(futures) >= workers:
+                        break
+                    queue = queues[host]
+                    submitted = False
+                    while queue and len(futures) < workers and in_flight[host] < scheduler.concurrency(queue[0]):
+                        url = queue.popleft()
+                        futures[pool.submit(self.web_parser.fetch, url)] = (host, url)
+                        in_flight[host] += 1
+                        submitted = True
+                    if not queue:
+                        del queues[host]
+                    elif submitted:
+                        # Обслуженный хост уходит в конец круга
+                        queues.move_to_end(host)
+
+            submit_ready()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                results = []
+                for future in done:
+                    host, url = futures.pop(future)
+                    in_flight[host] -= 1
+                    error = future.exception()
+                    results.append((url, None if error else future.result(), error))
+                # Новые загрузки ставятся до обработки готовых страниц, чтобы пул не простаивал
+                submit_ready()
+                yield from results
+
+    def ingest_page(self, page, replace: bool = False) -> int:
+        """Индексирует загруженную страницу под её каноническим URL.
+
+        Если страница уже проиндексирована под этим URL (например, источник перенаправляет на известную
+        статью), она не векторизуется повторно — к существующей записи добавляются только псевдонимы.
+        То же для почти полной копии другой проиндексированной страницы (перепечатка, зеркало):
+        её URL становится псевдонимом оригинала."""
+        if not replace and page.aliases and not self.vector_db.missing_urls([page.url]):
+            logger.info(f"Страница {page.url} уже проиндексирована, добавлены только псевдонимы")
+            self.vector_db.add_url_aliases(page.url, page.aliases)
+            return 0
+
+        chunks = self.text_processor.chunk_text(page.content, page.url)
+        if not chunks:
+            logger.warning(f"Не удалось разбить контент из {page.url} на блоки")
+            return 0
+
+        fingerprint = simhash(page.content) if self.near_duplicates is not None else None
+        if fingerprint is not None and self._link_near_duplicate(page, fingerprint, len(chunks)):
+            return 0
+
+        aliases = list(page.aliases)
+        if replace:
+            # Псевдонимы, накопленные источником (перенаправления, копии), переживают обновление
+            aliases = sorted(set(aliases) | set(self.vector_db.get_url_aliases(page.url)))
+            self.vector_db.delete_by_url(page.url)
+        logger.info(f"Добавление {len(chunks)} блоков из источника {page.url} в векторную БД")
+        self.vector_db.add_documents(chunks, url_aliases=aliases)
+        if fingerprint is not None:
+            self.near_duplicates.add(page.url, fingerprint)
+        return len(chunks)
+
+    def _link_near_duplicate(self, page, fingerprint: int, chunk_count: int) -> bool:
+        """Привязывает страницу к почти совпадающей проиндексированной; False, если такой нет"""
+        match = self.near_duplicates.find(fingerprint, exclude=page.url)
+        if match is None:
+            return False
+        if self.vector_db.missing_urls([match.url]):
+            # Оригинал удалён из базы (очистка, срок хранения) — отпечаток больше не действителен
+            self.near_duplicates.remove(match.url)
+            return False
+        logger.info(f"Страница {page.url} почти совпадает с {match.url} (расстояние {match.distance}), "
+                    f"{chunk_count} блоков не векторизуются")
+        self.vector_db.add_url_aliases(match.url, [page.url, *page.aliases])
+        self.stats["near_duplicates"] += 1
+        self.stats["saved_chunks"] += chunk_count
+        metrics.NEAR_DUPLICATES.inc()
+        metrics.EMBEDDINGS_SAVED.inc(chunk_count, reason="near_duplicate")
+        return True
+
+    def ingest(self, urls: List[str], skip_existing: bool = True, replace: bool = False) -> Dict[str, Any]:
+        """Индексирует список источников. skip_existing — пропустить уже проиндексированные,
+        replace — перед индексацией удалить старые блоки источника (обновление)"""
+        if skip_existing:
+            urls = self.vector_db.missing_urls(urls)
+
+        total_documents = 0
+        processed_sources = 0
+        error_details = []
+        near_duplicates, saved_chunks = self.stats["near_duplicates"], self.stats["saved_chunks"]
+
+        # Страницы загружаются параллельно (по разным хостам), а индексируются по очереди в этом потоке:
+        # проверка почти дубликатов и запись в базу не зависят от порядка завершения загрузок
+        current_sources = list(urls)
+        for i, (url, page, error) in enumerate(self.fetch_pages(current_sources), 1):
+            metrics.SOURCES_QUEUE_DEPTH.set(len(current_sources) - i + 1)
+            try:
+                if error is not None:
+                    raise error
+                logger.info(f"Обработка источника {i}/{len(current_sources)}: {url}")
+                added = self._ingest_fetched(url, page, replace=replace)
+                if added:
+                    total_documents += added
+                    processed_sources += 1
+                    logger.info(f"Источник {url} обработан, добавлено {added} блоков")
+            except Exception as e:
+                # Ошибка по отдельному источнику не прерывает обработку остальных
+                logger.error(f"Ошибка при обработке источника {url}: {e}")
+                error_details.append({"url": url, "error": str(e)})
+
+        metrics.SOURCES_QUEUE_DEPTH.set(0)
+        near_duplicates = self.stats["near_duplicates"] - near_duplicates
+        saved_chunks = self.stats["saved_chunks"] - saved_chunks
+        logger.info(f"Обработано {processed_sources} источников, всего документов: {total_documents}"
+                    + (f", почти дубликатов: {near_duplicates} ({saved_chunks} блоков без векторизации)"
+                       if near_duplicates else ""))
+        return {
+            "processed_sources": processed_sources,
+            "documents": total_documents,
+            "near_duplicates": near_duplicates,
+            "saved_chunks": saved_chunks,
+            "error_details": error_details
+        }
+
+    def pending_urls(self, urls: List[str]) -> List[str]:
+        """URL, которые ещё нужно проиндексировать в текущем процессе.
+
+        Если задан INGEST_SERVICE_URL, недостающие URL передаются сервису индексации и ожидаются
+        не дольше INGEST_WAIT_TIMEOUT; возвращаются те, что сервис не успел обработать."""
+        missing = self.vector_db.missing_urls(urls)
+        logger.info(f"Проиндексировано источников: {len(urls) - len(missing)} из {len(urls)}")
+        if missing and self.service_url:
+            missing = self._wait_for_service(missing)
+        return missing
+
+    def ensure_indexed(self, urls: List[str]) -> Dict[str, Any]:
+        """Проверка перед ответом на запрос: ожидание касается только ещё не проиндексированных URL"""
+        missing = self.pending_urls(urls)
+        if not missing:
+            return {"processed_sources": 0, "documents": 0, "near_duplicates": 0, "saved_chunks": 0, "error_details": []}
+        return self.ingest(missing, skip_existing=False)
+
+    def _wait_for_service(self, missing: List[str]) -> List[str]:
+        try:
+            response = requests.post(f"{self.service_url}/api/ingest", json={"urls": missing}, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Сервис индексации недоступен ({e}), источники будут обработаны локально")
+            return missing
+
+        logger.info(f"Ожидание индексации {len(missing)} источников сервисом {self.service_url}")
+        deadline = time.monotonic() + config.INGEST_WAIT_TIMEOUT
+        while missing and time.monotonic() < deadline:
+            time.sleep(min(2.0, max(deadline - time.monotonic(), 0)))
+            missing = self.vector_db.missing_urls(missing)
+        if missing:
+            logger.warning(f"Сервис индексации не успел обработать {len(missing)} источников, обрабатываем локально")
+        return missing
+
+
+class IngestionService:
+    """Фоновая индексация: отслеживает файлы списков источников, принимает URL через API
+    и периодически обновляет устаревшие источники"""
+
+    def __init__(self, ingestor: SourceIngestor, source_paths: Iterable[str] = (),
+                 poll_interval: float = None, refresh_interval: float = None, max_age_hours: float = None,
+                 sweeper: RetentionSweeper = None):
+        self.ingestor = ingestor
+        self.source_paths = list(source_paths)
+        self.poll_interval = poll_interval if poll_interval is not None else config.INGEST_POLL_INTERVAL
+        self.refresh_interval = refresh_interval if refresh_interval is not None else config.INGEST_REFRESH_INTERVAL
+        self.max_age_hours = max_age_hours if max_age_hours is not None else config.INGEST_MAX_AGE_HOURS
+        self.sweeper = sweeper or RetentionSweeper(ingestor.vector_db)
+
+        self._queue = deque()
+        self._queued = set()
+        self._known: Dict[str, str] = {}  # Канонический URL -> URL для загрузки
+        self._mtimes: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_refresh = time.monotonic()
+        self.stats = {"processed_sources": 0, "documents": 0, "refreshed_sources": 0,
+                      "near_duplicates": 0, "saved_chunks": 0, "expired_chunks": 0, "errors": 0}
+
+    def submit(self, urls: Iterable[str]) -> int:
+        """Ставит URL в очередь на индексацию; возвращает число новых URL в очереди"""
+        added = 0
+        with self._lock:
+            for url in urls:
+                url = url.strip()
+                if not url:
+                    continue
+                key = canonicalize_url(url)
+                self._known.setdefault(key, url)
+                if key not in self._queued:
+                    self._queue.append(url)
+                    self._queued.add(key)
+                    added += 1
+        if added:
+            self._wakeup.set()
+        return added
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "known_sources": len(self._known),
+                "watched_files": sorted(self._mtimes),
+                **self.stats
+            }
+
+    def _source_files(self) -> List[str]:
+        files = []
+        for path in self.source_paths:
+            if os.path.isdir(path):
+                files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.lower().endswith(SUPPORTED_EXTENSIONS))
+            elif os.path.exists(path):
+                files.append(path)
+        return files
+
+    def scan_sources(self) -> int:
+        """Перечитывает изменившиеся файлы источников и ставит их URL в очередь"""
+        queued = 0
+        for path in self._source_files():
+            mtime = os.path.getmtime(path)
+            if self._mtimes.get(path) == mtime:
+                continue
+            self._mtimes[path] = mtime
+            try:
+                queued += self.submit(iter_source_urls(path))
+                logger.info(f"Прочитан список источников {path}")
+            except Exception as e:
+                logger.error(f"Ошибка при чтении списка источников {path}: {e}")
+        return queued
+
+    def drain(self, batch_size: int = 50) -> None:
+        """Индексирует накопленную очередь (уже проиндексированные URL пропускаются)"""
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(batch_size, len(self._queue)))]
+            if not batch:
+                return
+            result = self.ingestor.ingest(batch)
+            with self._lock:
+                self._queued.difference_update(canonicalize_url(url) for url in batch)
+                self.stats["processed_sources"] += result["processed_sources"]
+                self.stats["documents"] += result["documents"]
+                self.stats["near_duplicates"] += result["near_duplicates"]
+                self.stats["saved_chunks"] += result["saved_chunks"]
+                self.stats["errors"] += len(result["error_details"])
+
+    def refresh_stale(self) -> int:
+        """Переиндексирует известные источники, обработанные раньше INGEST_MAX_AGE_HOURS назад"""
+        if not self.max_age_hours:
+            return 0
+        threshold = time.time() - self.max_age_hours * 3600
+        processed_before = self.ingestor.vector_db.sources_processed_before(threshold)
+        with self._lock:
+            stale = [url for key, url in self._known.items() if key in processed_before]
+        if stale:
+            logger.info(f"Обновление {len(stale)} устаревших источников")
+            result = self.ingestor.ingest(stale, skip_existing=False, replace=True)
+            with self._lock:
+                self.stats["refreshed_sources"] += result["processed_sources"]
+                self.stats["errors"] += len(result["error_details"])
+        return len(stale)
+
+    def sweep_expired(self, force: bool = False) -> int:
+        """Удаляет блоки с истёкшим сроком хранения (не чаще RETENTION_SWEEP_INTERVAL, если не force)"""
+        deleted = self.sweeper.sweep() if force else self.sweeper.run_pending()
+        with self._lock:
+            self.stats["expired_chunks"] += deleted
+        return deleted
+
+    def run_once(self) -> None:
+        self.scan_sources()
+        self.drain()
+
+    def run_forever(self, stop: threading.Event) -> None:
+        """Основной цикл: опрос файлов, обработка очереди, обновление и очистка по расписанию"""
+        logger.info(f"Сервис индексации запущен (опрос файлов каждые {self.poll_interval} с, "
+                     f"обновление каждые {self.refresh_interval} с)")
+        while not stop.is_set():
+            self.run_once()
+            if self.refresh_interval and time.monotonic() - self._last_refresh >= self.refresh_interval:
+                self._last_refresh = time.monotonic()
+                self.refresh_stale()
+            self.sweep_expired()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
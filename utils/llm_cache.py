@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# При превышении лимита кэш очищается до 90% от него, чтобы не вытеснять записи при каждой вставке
+_EVICT_TO = 0.9
+
+
+class LLMCache:
+    """Локальный кэш ответов LLM (SQLite) с TTL и ограничением по размеру"""
+
+    def __init__(self, path: str = None, ttl: int = None, max_bytes: int = None):
+        self.path = path or config.LLM_CACHE_PATH
+        self.ttl = ttl if ttl is not None else config.LLM_CACHE_TTL
+        self.max_bytes = max_bytes if max_bytes is not None else config.LLM_CACHE_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT,
+                created_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses (created_at)")
+        self._conn.commit()
+        # Суммарный размер ответов поддерживается инкрементально, без SUM по таблице при каждой записи
+        self._total = self._sum_sizes()
+
+    @staticmethod
+    def make_key(model: str, params: Dict[str, Any], prompt: str) -> str:
+        """Ключ кэша: модель, параметры генерации и хэш промпта"""
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return hashlib.sha256(
+            json.dumps({'model': model, 'params': params, 'prompt': prompt_hash}, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает сохранённый ответ или None, если его нет или срок хранения истёк"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._total -= row[2]
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._total += size - self._stored_size(key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)",
+                (key, response, now, now, size)
+            )
+            self._conn.commit()
+            self._evict(now)
+
+    def _sum_sizes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _stored_size(self, key: str) -> int:
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _evict(self, now: float) -> None:
+        """Удаляет просроченные записи, затем давно не использованные, пока кэш не уложится в 90% лимита
+        (вызывается под блокировкой)"""
+        if self.ttl:
+            expired = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses WHERE created_at < ?", (now - self.ttl,)
+            ).fetchone()[0]
+            if expired:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                self._conn.commit()
+                self._total -= expired
+        if self._total <= self.max_bytes:
+            return
+        # Файл кэша могут дополнять другие процессы, поэтому перед вытеснением размер уточняется
+        self._total = self._sum_sizes()
+        target = int(self.max_bytes * _EVICT_TO)
+        removed = 0
+        while self._total > target:
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total <= target:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total -= size
+                removed += 1
+        self._conn.commit()
+        logger.debug(f"Из кэша LLM вытеснено {removed} записей (размер: {self._total} байт)")
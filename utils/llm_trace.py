@@ -0,0 +1,58 @@
+import gzip
+import logging
+import os
+import random
+import uuid
+from typing import Optional
+
+import config
+
+# Отдельный канал для промптов и ответов LLM: его можно отключить или перенаправить,
+# не затрагивая остальные логи
+logger = logging.getLogger("llm_trace")
+
+
+def _preview(text: str, limit: int) -> str:
+    """Начало текста не длиннее limit символов (копируется только префикс, а не весь текст)"""
+    if len(text) <= limit:
+        return text.strip()
+    return f"{text[:limit].strip()}… [+{len(text) - limit} симв.]"
+
+
+def _write_side_file(trace_id: str, kind: str, text: str) -> Optional[str]:
+    """Сохраняет полный текст в сжатый файл <LLM_TRACE_DIR>/<trace_id>.<kind>.txt.gz"""
+    if not config.LLM_TRACE_DIR:
+        return None
+    path = os.path.join(config.LLM_TRACE_DIR, f"{trace_id}.{kind}.txt.gz")
+    try:
+        os.makedirs(config.LLM_TRACE_DIR, exist_ok=True)
+        with gzip.open(path, 'wt', encoding='utf-8', compresslevel=5) as f:
+            f.write(text)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить трассировку LLM в {path}: {e}")
+        return None
+    return path
+
+
+def trace_request(node: str, prompt: str) -> Optional[str]:
+    """Записывает запрос к LLM; возвращает идентификатор трассировки или None, если вызов не попал в выборку.
+
+    В лог попадает только начало промпта (LLM_TRACE_MAX_CHARS), полный текст — в файл при заданном LLM_TRACE_DIR."""
+    if not logger.isEnabledFor(logging.INFO) or random.random() >= config.LLM_TRACE_SAMPLE_RATE:
+        return None
+    trace_id = uuid.uuid4().hex[:12]
+    path = _write_side_file(trace_id, "request", prompt)
+    logger.info("[LLM REQUEST] id=%s node=%s chars=%d%s: %s",
+                trace_id, node, len(prompt), f" file={path}" if path else "",
+                _preview(prompt, config.LLM_TRACE_MAX_CHARS))
+    return trace_id
+
+
+def trace_response(trace_id: Optional[str], node: str, content: str) -> None:
+    """Записывает ответ LLM для запроса, попавшего в выборку"""
+    if trace_id is None or not logger.isEnabledFor(logging.INFO):
+        return
+    path = _write_side_file(trace_id, "response", content)
+    logger.info("[LLM RESPONSE] id=%s node=%s chars=%d%s: %s",
+                trace_id, node, len(content), f" file={path}" if path else "",
+                _preview(content, config.LLM_TRACE_MAX_CHARS))
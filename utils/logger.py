@@ -6,6 +6,8 @@ import config
 class WebLogHandler(logging.Handler):
     """Обработчик логов для веб-интерфейса (сокращённый формат)"""
 
+    EXCLUDED_LOGGERS = frozenset({'llm_trace', 'flask', 'werkzeug', 'requests', 'urllib3'})
+
     def __init__(self, logs_list: List[str]):
         super().__init__()
         self.logs_list = logs_list
@@ -13,15 +15,12 @@ class WebLogHandler(logging.Handler):
 
     def emit(self, record):
         """Добавляет сокращённую запись лога в список для веб-интерфейса"""
+        # Фильтруем по имени логгера до форматирования сообщения:
+        # трассировка LLM и логи Flask и HTTP-библиотек в веб-интерфейс не попадают
+        if record.name.split('.', 1)[0] in self.EXCLUDED_LOGGERS:
+            return
         try:
-            msg = record.getMessage()
-            # Пропускаем LLM-запросы и ответы
-            if '[LLM REQUEST]' in msg or '[LLM RESPONSE]' in msg:
-                return
-            # Пропускаем логи от Flask и HTTP-библиотек
-            if record.name in ['flask', 'werkzeug', 'requests', 'urllib3'] or record.name.startswith('flask') or record.name.startswith('werkzeug'):
-                return
-            self.logs_list.append(msg)
+            self.logs_list.append(record.getMessage())
             # Ограничиваем количество логов для экономии памяти
             if len(self.logs_list) > 1000:
                 self.logs_list.pop(0)
@@ -82,7 +81,8 @@ def setup_logging():
     # Устанавливаем уровень для внешних библиотек
     logging.getLogger('urllib3').setLevel(logging.WARNING)
     logging.getLogger('requests').setLevel(logging.WARNING)
-    logging.getLogger('qdrant_client').setLevel(logging.DEBUG)
+    logging.getLogger('qdrant_client').setLevel(logging.WARNING)
+    logging.getLogger('llm_trace').setLevel(getattr(logging, config.LLM_TRACE_LEVEL))
 
     return root_logger
 
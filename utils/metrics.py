@@ -0,0 +1,187 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Минимальная реализация метрик в текстовом формате Prometheus (без внешних зависимостей)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+_CHARS_BUCKETS = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Текущее значение (например, глубина очереди)"""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(*args, **kwargs)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = _LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Контекстный менеджер: наблюдает длительность блока в секундах"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Текстовое представление всех метрик в формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Загрузка страниц
+FETCH_DURATION = Histogram('agent_fetch_duration_seconds', 'Время загрузки страницы', ['host'])
+FETCH_REQUESTS = Counter('agent_fetch_requests_total', 'HTTP-запросы к источникам по результату', ['host', 'status'])
+FETCH_BYTES = Counter('agent_fetch_bytes_total', 'Загружено байт с источников', ['host'])
+FETCH_SKIPPED = Counter('agent_fetch_skipped_total', 'Страницы, отклонённые при загрузке', ['reason'])
+
+# Обработка текста и эмбеддинги
+CHUNKS_PRODUCED = Counter('agent_chunks_produced_total', 'Создано текстовых блоков')
+EMBEDDING_BATCH_SIZE = Histogram('agent_embedding_batch_size', 'Размер батча эмбеддингов', ['provider'], _SIZE_BUCKETS)
+EMBEDDING_DURATION = Histogram('agent_embedding_batch_duration_seconds', 'Время вычисления батча эмбеддингов', ['provider'])
+NEAR_DUPLICATES = Counter('agent_near_duplicates_total', 'Почти повторяющихся страниц, привязанных к уже проиндексированным')
+EMBEDDINGS_SAVED = Counter('agent_embeddings_saved_total', 'Блоков, не отправленных на векторизацию', ['reason'])
+
+# Qdrant
+QDRANT_DURATION = Histogram('agent_qdrant_request_duration_seconds', 'Время запросов к Qdrant', ['operation'])
+
+# LLM
+LLM_DURATION = Histogram('agent_llm_request_duration_seconds', 'Время запроса к LLM', ['node'])
+LLM_PROMPT_CHARS = Histogram('agent_llm_prompt_chars', 'Размер промпта, символов', ['node'], _CHARS_BUCKETS)
+LLM_RESPONSE_CHARS = Histogram('agent_llm_response_chars', 'Размер ответа LLM, символов', ['node'], _CHARS_BUCKETS)
+LLM_CACHE_REQUESTS = Counter('agent_llm_cache_requests_total', 'Обращения к кэшу LLM', ['result'])
+
+# GigaChat (общий бюджет запросов и предохранитель)
+GIGACHAT_THROTTLE_SECONDS = Counter('agent_gigachat_throttle_seconds_total', 'Ожидание бюджета GigaChat, сек', ['kind'])
+GIGACHAT_ERRORS = Counter('agent_gigachat_errors_total', 'Ошибки GigaChat 429/5xx', ['kind', 'status'])
+GIGACHAT_BREAKER_OPEN = Gauge('agent_gigachat_breaker_open', 'Предохранитель GigaChat разомкнут (1) или нет (0)')
+
+# Агент
+NODE_DURATION = Histogram('agent_node_duration_seconds', 'Время выполнения шага графа', ['node'])
+RETRIEVAL_SELECTED = Histogram('agent_retrieval_selected_chunks', 'Блоков в контексте ответа на вопрос', buckets=_SIZE_BUCKETS)
+RETENTION_DELETED = Counter('agent_retention_deleted_total', 'Блоков удалено по сроку хранения')
+SOURCES_QUEUE_DEPTH = Gauge('agent_sources_queue_depth', 'Источников в очереди на обработку')
+JOBS_IN_PROGRESS = Gauge('agent_jobs_in_progress', 'Запросов в обработке')
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_FINGERPRINT_BITS = 64
+
+
+def simhash(text: str, shingle_size: int = None, min_tokens: int = None) -> Optional[int]:
+    """64-битный SimHash текста по шинглам из shingle_size слов.
+
+    Близкие тексты дают отпечатки с малым расстоянием Хэмминга. Для текстов короче min_tokens слов
+    возвращается None: у них отпечаток слишком неустойчив, чтобы судить о повторе."""
+    import numpy as np
+
+    shingle_size = shingle_size or config.NEAR_DUP_SHINGLE_SIZE
+    min_tokens = config.NEAR_DUP_MIN_TOKENS if min_tokens is None else min_tokens
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens or len(tokens) < min_tokens:
+        return None
+
+    shingles = {' '.join(tokens[i:i + shingle_size]) for i in range(max(1, len(tokens) - shingle_size + 1))}
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    # Бит отпечатка равен 1, если он установлен у большинства шинглов
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _to_signed(value: int) -> int:
+    # SQLite хранит INTEGER как знаковое 64-битное число
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class NearDuplicate(NamedTuple):
+    """Ранее проиндексированная страница, почти совпадающая с новой"""
+    url: str
+    distance: int
+
+
+class NearDuplicateIndex:
+    """Персистентный индекс SimHash-отпечатков проиндексированных страниц (SQLite).
+
+    Отпечаток делится на max_distance + 1 полос: у отпечатков на расстоянии не больше max_distance
+    хотя бы одна полоса совпадает (принцип Дирихле), поэтому кандидаты ищутся по индексу полос,
+    а не перебором всех страниц."""
+
+    def __init__(self, path: str = None, max_distance: int = None):
+        self.path = path or config.NEAR_DUP_INDEX_PATH
+        self.max_distance = config.NEAR_DUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.bands = self.max_distance + 1
+        self.band_bits = _FINGERPRINT_BITS // self.bands
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (url TEXT PRIMARY KEY, fingerprint INTEGER);
+            CREATE TABLE IF NOT EXISTS bands (band_key INTEGER, url TEXT);
+            CREATE INDEX IF NOT EXISTS idx_bands_key ON bands (band_key);
+            CREATE INDEX IF NOT EXISTS idx_bands_url ON bands (url);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self._rebuild_bands_if_needed()
+
+    def _band_keys(self, fingerprint: int):
+        """Ключи полос: номер полосы в старших 32 битах, значение полосы — в младших"""
+        mask = (1 << self.band_bits) - 1
+        return [(band << 32) | ((fingerprint >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def _rebuild_bands_if_needed(self) -> None:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'bands'").fetchone()
+        if row is not None and int(row[0]) == self.bands:
+            return
+        # Число полос зависит от NEAR_DUP_MAX_DISTANCE; при его изменении индекс полос строится заново
+        rows = self._conn.execute("SELECT url, fingerprint FROM fingerprints").fetchall()
+        self._conn.execute("DELETE FROM bands")
+        self._conn.executemany(
+            "INSERT INTO bands (band_key, url) VALUES (?, ?)",
+            ((key, url) for url, fingerprint in rows for key in self._band_keys(fingerprint & ((1 << 64) - 1)))
+        )
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bands', ?)", (str(self.bands),))
+        self._conn.commit()
+        if rows:
+            logger.info(f"Индекс полос SimHash перестроен для {len(rows)} страниц ({self.bands} полос)")
+
+    def find(self, fingerprint: int, exclude: str = None) -> Optional[NearDuplicate]:
+        """Ближайшая проиндексированная страница на расстоянии не больше max_distance (кроме exclude)"""
+        keys = self._band_keys(fingerprint)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT f.url, f.fingerprint FROM bands b JOIN fingerprints f ON f.url = b.url "
+                f"WHERE b.band_key IN ({','.join('?' * len(keys))})",
+                keys
+            ).fetchall()
+        best = None
+        for url, candidate in rows:
+            if url == exclude:
+                continue
+            distance = hamming_distance(fingerprint, candidate & ((1 << 64) - 1))
+            if distance <= self.max_distance and (best is None or distance < best.distance):
+                best = NearDuplicate(url, distance)
+        return best
+
+    def add(self, url: str, fingerprint: int) -> None:
+        """Сохраняет (или обновляет) отпечаток страницы"""
+        self.add_many([(url, fingerprint)])
+
+    def add_many(self, items: List[Tuple[str, int]]) -> None:
+        """Сохраняет отпечатки нескольких страниц одной транзакцией"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM bands WHERE url = ?", ((url,) for url, _ in items))
+            self._conn.executemany("INSERT OR REPLACE INTO fingerprints (url, fingerprint) VALUES (?, ?)",
+                                   ((url, _to_signed(fingerprint)) for url, fingerprint in items))
+            self._conn.executemany("INSERT INTO bands (band_key, url) VALUES (?, ?)",
+                                   ((key, url) for url, fingerprint in items for key in self._band_keys(fingerprint)))
+            self._conn.commit()
+
+    def remove(self, url: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM bands WHERE url = ?", (url,))
+            self._conn.execute("DELETE FROM fingerprints WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Перечисляет пары (URL, отпечаток)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url, fingerprint FROM fingerprints").fetchall()
+        for url, fingerprint in rows:
+            yield url, fingerprint & ((1 << 64) - 1)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
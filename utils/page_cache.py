@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import config
+from utils.url_canon import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+# Вытеснение освобождает место с запасом, чтобы заполненный кэш не вытеснял (и не пересчитывал размер) при каждой записи
+_EVICT_TO = 0.9
+
+
+class CachedPage(NamedTuple):
+    """Страница из локального кэша"""
+    url: str
+    final_url: str
+    fetched_at: float
+    headers: Dict[str, str]
+    body: bytes
+
+
+class PageCache:
+    """Сжатое хранилище загруженных страниц на диске (SQLite + zlib) с ограничением по размеру"""
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        self.path = path or config.PAGE_CACHE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else config.PAGE_CACHE_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                final_url TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                headers TEXT,
+                body BLOB,
+                size INTEGER
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed_at)")
+        self._conn.commit()
+        # Текущий размер кэша ведётся в памяти, чтобы запись не пересчитывала SUM по всей таблице
+        self._total = self._sum_sizes()
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """Ключ кэша — канонический URL, как при загрузке источников"""
+        return canonicalize_url(url)
+
+    def put(self, url: str, body: bytes, headers: Dict[str, str], final_url: str = None) -> None:
+        """Сохраняет сырое тело ответа и заголовки"""
+        key = self.normalize_url(url)
+        compressed = zlib.compress(body, 6)
+        now = time.time()
+        with self._lock:
+            self._total += len(compressed) - self._stored_size(key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, final_url, fetched_at, accessed_at, headers, body, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, final_url or url, now, now, json.dumps(dict(headers), ensure_ascii=False),
+                 compressed, len(compressed))
+            )
+            self._conn.commit()
+            self._evict()
+        logger.debug(f"Страница {url} сохранена в кэш ({len(body)} -> {len(compressed)} байт)")
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Возвращает страницу из кэша или None"""
+        key = self.normalize_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, final_url, fetched_at, headers, body FROM pages WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), key))
+            self._conn.commit()
+        return CachedPage(
+            url=row[0],
+            final_url=row[1],
+            fetched_at=row[2],
+            headers=json.loads(row[3]),
+            body=zlib.decompress(row[4])
+        )
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM pages WHERE url = ?", (self.normalize_url(url),)
+            ).fetchone()
+        return row is not None
+
+    def urls(self) -> Iterator[str]:
+        """Перечисляет URL всех сохранённых страниц"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM pages ORDER BY fetched_at").fetchall()
+        for (url,) in rows:
+            yield url
+
+    def export_rows(self) -> Iterator[tuple]:
+        """Перечисляет записи кэша (url, final_url, fetched_at, headers, сжатое тело) по одной"""
+        for url in list(self.urls()):
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT url, final_url, fetched_at, headers, body FROM pages WHERE url = ?", (url,)
+                ).fetchone()
+            if row is not None:
+                yield row
+
+    def import_rows(self, rows: List[tuple]) -> None:
+        """Записывает строки, полученные из export_rows, сохраняя время загрузки страниц"""
+        now = time.time()
+        with self._lock:
+            self._total += sum(len(row[4]) - self._stored_size(row[0]) for row in rows)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (url, final_url, fetched_at, accessed_at, headers, body, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(url, final_url, fetched_at, now, headers, body, len(body))
+                 for url, final_url, fetched_at, headers, body in rows]
+            )
+            self._conn.commit()
+            self._evict()
+
+    def total_size(self) -> int:
+        """Суммарный размер сжатых страниц в байтах"""
+        with self._lock:
+            return self._sum_sizes()
+
+    def _sum_sizes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def _stored_size(self, key: str) -> int:
+        row = self._conn.execute("SELECT size FROM pages WHERE url = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _evict(self) -> None:
+        """Удаляет давно не использованные страницы, пока кэш не уложится в 90% лимита (вызывается под блокировкой)"""
+        if self._total <= self.max_bytes:
+            return
+        # Файл кэша могут дополнять другие процессы, поэтому перед вытеснением размер уточняется
+        self._total = self._sum_sizes()
+        target = int(self.max_bytes * _EVICT_TO)
+        removed = 0
+        while self._total > target:
+            rows = self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                if self._total <= target:
+                    break
+                self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self._total -= size
+                removed += 1
+        self._conn.commit()
+        logger.debug(f"Из кэша страниц вытеснено {removed} записей (размер: {self._total} байт)")
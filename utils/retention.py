@@ -0,0 +1,91 @@
+import logging
+import time
+from typing import Dict, List
+
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue, Range
+
+import config
+from utils import metrics
+from utils.url_canon import canonical_host
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retention_rules(value: str) -> Dict[str, float]:
+    """Разбирает правила вида 'news.example.com=7,example.org=30' (хост источника = срок хранения в днях)"""
+    rules = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, sep, days = item.partition('=')
+        if not sep or not host.strip():
+            raise ValueError(f"Некорректное правило хранения: '{item}' (ожидается хост=дни)")
+        try:
+            rules[canonical_host(host)] = float(days)
+        except ValueError as e:
+            raise ValueError(f"Некорректный срок хранения в правиле '{item}'") from e
+    return rules
+
+
+class RetentionPolicy:
+    """Срок хранения проиндексированных блоков: общий (RETENTION_DAYS) и по хостам источников (RETENTION_RULES).
+
+    Срок 0 означает хранение без ограничения. Политика применяется при очистке, поэтому изменение
+    сроков действует и на ранее проиндексированные источники."""
+
+    def __init__(self, default_days: float = None, rules: Dict[str, float] = None):
+        self.default_days = config.RETENTION_DAYS if default_days is None else default_days
+        self.rules = parse_retention_rules(config.RETENTION_RULES) if rules is None else rules
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.default_days) or any(self.rules.values())
+
+    def expired_filters(self, now: float = None) -> List[Filter]:
+        """Фильтры Qdrant, выбирающие блоки с истёкшим сроком хранения"""
+        now = time.time() if now is None else now
+        filters = []
+        for host, days in self.rules.items():
+            if days:
+                filters.append(Filter(must=[
+                    FieldCondition(key="source_host", match=MatchValue(value=host)),
+                    FieldCondition(key="processing_ts", range=Range(lt=now - days * 86400)),
+                ]))
+        if self.default_days:
+            filters.append(Filter(
+                must=[FieldCondition(key="processing_ts", range=Range(lt=now - self.default_days * 86400))],
+                # Для хостов с собственным правилом общий срок не применяется
+                must_not=[FieldCondition(key="source_host", match=MatchAny(any=list(self.rules)))] if self.rules else None
+            ))
+        return filters
+
+
+class RetentionSweeper:
+    """Периодическое удаление блоков с истёкшим сроком хранения"""
+
+    def __init__(self, vector_db, policy: RetentionPolicy = None, interval: float = None):
+        self.vector_db = vector_db
+        self.policy = policy or RetentionPolicy()
+        self.interval = config.RETENTION_SWEEP_INTERVAL if interval is None else interval
+        self._last_sweep = None
+
+    def sweep(self) -> int:
+        """Удаляет устаревшие блоки пачками; возвращает число удалённых"""
+        if not self.policy.enabled:
+            return 0
+        deleted = self.vector_db.delete_expired(self.policy.expired_filters())
+        metrics.RETENTION_DELETED.inc(deleted)
+        logger.info(f"Очистка по сроку хранения: удалено {deleted} блоков")
+        return deleted
+
+    def run_pending(self) -> int:
+        """Выполняет очистку, если с прошлой прошло не меньше interval секунд"""
+        if not self.interval or (self._last_sweep is not None and time.monotonic() - self._last_sweep < self.interval):
+            return 0
+        self._last_sweep = time.monotonic()
+        try:
+            return self.sweep()
+        except Exception as e:
+            logger.error(f"Ошибка при очистке по сроку хранения: {e}")
+            return 0
@@ -0,0 +1,80 @@
+from typing import List, NamedTuple, Sequence
+
+import config
+
+# Разрыв должен выделяться на фоне среднего шага оценок, иначе при малом числе равномерно убывающих
+# кандидатов любой шаг оказывается заметной долей разброса
+_GAP_OVER_MEAN = 2.0
+
+
+class ContextSelection(NamedTuple):
+    """Блоки, отобранные в контекст ответа, и пояснение выбора k (для логов)"""
+    hits: list
+    reason: str
+
+
+def select_context(hits: Sequence, min_k: int = None, max_k: int = None, gap_ratio: float = None,
+                   per_source: int = None) -> ContextSelection:
+    """Адаптивный отбор блоков из кандидатов в порядке выдачи поиска.
+
+    1. Не больше per_source блоков одного источника (остальные кандидаты сдвигаются вверх).
+    2. Кандидаты обрезаются по самому большому разрыву между соседними косинусными оценками (dense_score,
+       по убыванию) в пределах [min_k, max_k], если разрыв составляет не меньше gap_ratio от разброса оценок
+       и заметно больше среднего шага между ними: остаются блоки выше разрыва, в порядке выдачи. Узкий
+       вопрос получает несколько сильных блоков, широкий — до max_k. Оценки RRF гибридного поиска строятся
+       по рангам, поэтому для обрезки не используются.
+    3. Без заметного разрыва или без косинусных оценок берутся первые max_k блоков."""
+    min_k = config.RETRIEVAL_MIN_K if min_k is None else min_k
+    max_k = config.RETRIEVAL_MAX_K if max_k is None else max_k
+    gap_ratio = config.RETRIEVAL_GAP_RATIO if gap_ratio is None else gap_ratio
+    per_source = config.RETRIEVAL_PER_SOURCE if per_source is None else per_source
+
+    notes = []
+    candidates: List = list(hits)
+    if per_source:
+        counts = {}
+        capped = []
+        for hit in candidates:
+            counts[hit.source_url] = counts.get(hit.source_url, 0) + 1
+            if counts[hit.source_url] <= per_source:
+                capped.append(hit)
+        if len(capped) < len(candidates):
+            notes.append(f"лимит {per_source} на источник отбросил {len(candidates) - len(capped)}")
+        candidates = capped
+
+    total = len(candidates)
+    if total <= min_k:
+        return ContextSelection(candidates, "; ".join([f"k={total}: все {total} кандидатов"] + notes))
+
+    if any(hit.dense_score is None for hit in candidates):
+        k = min(max_k, total)
+        return ContextSelection(candidates[:k], "; ".join(
+            [f"k={k} из {total}: нет косинусных оценок кандидатов, обрезка по разрыву не выполняется"] + notes))
+
+    scores = sorted((hit.dense_score for hit in candidates), reverse=True)
+    spread = scores[0] - scores[-1]
+    # Разрыв после позиции i (между i-й и i+1-й оценкой); k = i + 1 должен лежать в [min_k, max_k)
+    best_gap, best_k = 0.0, None
+    for i in range(max(min_k, 1) - 1, min(max_k, total) - 1):
+        gap = scores[i] - scores[i + 1]
+        if gap > best_gap:
+            best_gap, best_k = gap, i + 1
+
+    mean_gap = spread / (total - 1)
+    if best_k is not None and spread > 0 and best_gap >= max(gap_ratio * spread, _GAP_OVER_MEAN * mean_gap):
+        reason = (f"k={best_k} из {total}: разрыв оценок {scores[best_k - 1]:.3f} → {scores[best_k]:.3f} "
+                  f"({best_gap / spread:.0%} разброса)")
+        cutoff = scores[best_k - 1]
+        selected = [hit for hit in candidates if hit.dense_score >= cutoff][:best_k]
+        return ContextSelection(selected, "; ".join([reason] + notes))
+
+    k = min(max_k, total)
+    reason = f"k={k} из {total}: " + ("все кандидаты, заметного разрыва оценок нет" if k == total
+                                      else "предел RETRIEVAL_MAX_K, заметного разрыва оценок нет")
+    return ContextSelection(candidates[:k], "; ".join([reason] + notes))
+
+
+def fixed_context(hits: Sequence, k: int = None) -> ContextSelection:
+    """Прежний отбор: первые k кандидатов (DOCS_PER_ANSWER)"""
+    k = config.DOCS_PER_ANSWER if k is None else k
+    return ContextSelection(list(hits[:k]), f"k={min(k, len(hits))} из {len(hits)}: фиксированный DOCS_PER_ANSWER")
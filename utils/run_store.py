@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RunStore:
+    """Списки источников запусков агента (SQLite, рядом с контрольными точками LangGraph).
+
+    Контрольная точка сохраняет всё состояние графа после каждого шага, поэтому списки источников
+    хранятся здесь один раз на запуск, а в состоянии остаются только их размеры и позиция индексации.
+    Время последнего обращения к запуску позволяет удалять устаревшие контрольные точки."""
+
+    def __init__(self, path: str = None):
+        # Без пути (контрольные точки отключены) списки живут только в памяти процесса
+        self.path = path or ':memory:'
+        self._lock = threading.Lock()
+        self._lists: Dict[Tuple[str, str], List[str]] = {}
+
+        directory = os.path.dirname(self.path) if path else ''
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_sources (
+                run_id TEXT,
+                kind TEXT,
+                urls TEXT,
+                PRIMARY KEY (run_id, kind)
+            )
+            """
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, updated_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_updated ON runs (updated_at)")
+        self._conn.commit()
+
+    def put_sources(self, run_id: str, kind: str, urls: List[str], persist: bool = True) -> None:
+        """Сохраняет список URL запуска (kind: 'sources' — все источники, 'pending' — очередь индексации);
+        persist=False — только в памяти (запуски без контрольных точек)"""
+        urls = list(urls)
+        with self._lock:
+            self._lists[(run_id, kind)] = urls
+            if persist:
+                self._conn.execute("INSERT OR REPLACE INTO run_sources (run_id, kind, urls) VALUES (?, ?, ?)",
+                                   (run_id, kind, json.dumps(urls, ensure_ascii=False)))
+                self._conn.commit()
+
+    def sources(self, run_id: str, kind: str) -> List[str]:
+        """Список URL запуска; после перезапуска процесса читается из базы один раз"""
+        with self._lock:
+            urls = self._lists.get((run_id, kind))
+            if urls is None:
+                row = self._conn.execute("SELECT urls FROM run_sources WHERE run_id = ? AND kind = ?",
+                                         (run_id, kind)).fetchone()
+                urls = json.loads(row[0]) if row else []
+                self._lists[(run_id, kind)] = urls
+            return urls
+
+    def touch(self, run_id: str) -> None:
+        """Отмечает обращение к запуску (от него отсчитывается срок хранения контрольных точек)"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO runs (run_id, updated_at) VALUES (?, ?)", (run_id, time.time()))
+            self._conn.commit()
+
+    def expired(self, ttl: float) -> List[str]:
+        """Запуски, к которым не обращались дольше ttl секунд"""
+        with self._lock:
+            rows = self._conn.execute("SELECT run_id FROM runs WHERE updated_at < ?", (time.time() - ttl,)).fetchall()
+        return [row[0] for row in rows]
+
+    def release(self, run_id: str) -> None:
+        """Освобождает списки запуска в памяти; сохранённые в базе остаются для продолжения запуска"""
+        with self._lock:
+            for key in [key for key in self._lists if key[0] == run_id]:
+                del self._lists[key]
+
+    def delete(self, run_id: str) -> None:
+        """Удаляет списки и отметку запуска"""
+        self.release(run_id)
+        with self._lock:
+            self._conn.execute("DELETE FROM run_sources WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self._conn.commit()
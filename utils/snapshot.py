@@ -0,0 +1,238 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import time
+from array import array
+from typing import Any, Dict, Iterator, List, Optional
+
+from qdrant_client.models import PointStruct, SparseVector
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Сколько записей читается из Qdrant (и пишется в него) за один запрос
+_BATCH_SIZE = 256
+
+
+def _encode_vector(vector) -> Any:
+    """Плотный вектор — base64 от float32 (в несколько раз компактнее JSON-чисел), разреженный — индексы и веса"""
+    if isinstance(vector, dict):
+        return {name: _encode_vector(value) for name, value in vector.items()}
+    if isinstance(vector, SparseVector):
+        return {'indices': list(vector.indices), 'values': list(vector.values)}
+    return base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+
+
+def _decode_vector(value) -> Any:
+    if isinstance(value, str):
+        return array('f', base64.b64decode(value)).tolist()
+    if 'indices' in value:
+        return SparseVector(indices=value['indices'], values=value['values'])
+    return {name: _decode_vector(item) for name, item in value.items()}
+
+
+def _scroll_points(client, collection_name: str) -> Iterator[Any]:
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=_BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        yield from points
+        if offset is None:
+            return
+
+
+def _write(f, record: Dict[str, Any]) -> None:
+    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+    f.write('\n')
+
+
+def export_snapshot(path: str, vector_db, embedding_cache=None, near_duplicates=None,
+                    page_cache=None) -> Dict[str, int]:
+    """Выгружает коллекцию (векторы и payload), векторы источников, кэш эмбеддингов, отпечатки страниц
+    и, если передан, кэш страниц в сжатый JSONL-файл; возвращает число записей каждого вида.
+
+    Данные читаются и пишутся потоково пачками; файл записывается во временный и переименовывается
+    только после успешной выгрузки."""
+    if not vector_db._collection_exists():
+        raise ValueError(f"Коллекция '{vector_db.collection_name}' не найдена")
+    collection = vector_db.client.get_collection(vector_db.collection_name)
+    vector_params = collection.config.params.vectors
+    counts = {'points': 0, 'source_points': 0, 'embeddings': 0, 'fingerprints': 0, 'pages': 0}
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        _write(f, {
+            'type': 'header',
+            'version': SNAPSHOT_VERSION,
+            'collection': vector_db.collection_name,
+            'embedding_tag': vector_db.embeddings.tag,
+            'vector_size': vector_params.size,
+            'created_at': time.time(),
+        })
+        for point in _scroll_points(vector_db.client, vector_db.collection_name):
+            _write(f, {'type': 'point', 'id': point.id, 'vector': _encode_vector(point.vector), 'payload': point.payload})
+            counts['points'] += 1
+            if counts['points'] % 10000 == 0:
+                logger.info(f"Выгружено {counts['points']} точек")
+        if vector_db._collection_exists(vector_db.sources_collection_name):
+            for point in _scroll_points(vector_db.client, vector_db.sources_collection_name):
+                _write(f, {'type': 'source_point', 'id': point.id, 'vector': _encode_vector(point.vector),
+                           'payload': point.payload})
+                counts['source_points'] += 1
+        if embedding_cache is not None:
+            for key, tag, blob, created_at in embedding_cache.export_rows():
+                _write(f, {'type': 'embedding', 'key': key, 'tag': tag,
+                           'vector': base64.b64encode(blob).decode('ascii'), 'created_at': created_at})
+                counts['embeddings'] += 1
+        if near_duplicates is not None:
+            for url, fingerprint in near_duplicates.items():
+                _write(f, {'type': 'fingerprint', 'url': url, 'fingerprint': fingerprint})
+                counts['fingerprints'] += 1
+        if page_cache is not None:
+            for url, final_url, fetched_at, headers, body in page_cache.export_rows():
+                # Тело уже сжато zlib и переносится как есть
+                _write(f, {'type': 'page', 'url': url, 'final_url': final_url, 'fetched_at': fetched_at,
+                           'headers': headers, 'body': base64.b64encode(body).decode('ascii')})
+                counts['pages'] += 1
+        _write(f, {'type': 'footer', 'counts': counts})
+    os.replace(tmp_path, path)
+    logger.info(f"Снимок коллекции '{vector_db.collection_name}' сохранён в {path}: {counts}")
+    return counts
+
+
+def _read_records(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class _Importer:
+    """Запись прочитанных из снимка записей пачками"""
+
+    def __init__(self, vector_db, embedding_cache, near_duplicates, page_cache):
+        self.vector_db = vector_db
+        self.embedding_cache = embedding_cache
+        self.near_duplicates = near_duplicates
+        self.page_cache = page_cache
+        self.pending: Dict[str, List] = {'point': [], 'source_point': [], 'embedding': [], 'fingerprint': [], 'page': []}
+        self.counts = {'points': 0, 'source_points': 0, 'embeddings': 0, 'fingerprints': 0, 'pages': 0}
+
+    def _chunk_vector(self, vector, content: str):
+        """Вектор точки под конфигурацию целевой коллекции (с разреженным вектором или без)"""
+        dense = vector.get('') if isinstance(vector, dict) else vector
+        if not self.vector_db._has_sparse:
+            return dense
+        sparse = next((value for name, value in vector.items() if name), None) if isinstance(vector, dict) else None
+        if sparse is None:
+            # В исходной коллекции не было BM25-векторов: они вычисляются локально, без обращения к эмбеддингам
+            sparse = self.vector_db.sparse_encoder.encode_document(content)
+        return {'': dense, config.SPARSE_VECTOR_NAME: sparse}
+
+    def add(self, record: Dict[str, Any]) -> None:
+        kind = record['type']
+        if kind == 'point':
+            vector = self._chunk_vector(_decode_vector(record['vector']), record['payload'].get('content', ''))
+            self.pending['point'].append(PointStruct(id=record['id'], vector=vector, payload=record['payload']))
+        elif kind == 'source_point':
+            if not self.vector_db._has_source_index:
+                return
+            vector = _decode_vector(record['vector'])
+            self.pending['source_point'].append(PointStruct(
+                id=record['id'], vector=vector.get('') if isinstance(vector, dict) else vector, payload=record['payload']))
+        elif kind == 'embedding':
+            if self.embedding_cache is None:
+                return
+            self.pending['embedding'].append(
+                (record['key'], record['tag'], base64.b64decode(record['vector']), record['created_at']))
+        elif kind == 'fingerprint':
+            if self.near_duplicates is None:
+                return
+            self.pending['fingerprint'].append((record['url'], record['fingerprint']))
+        elif kind == 'page':
+            if self.page_cache is None:
+                return
+            self.pending['page'].append((record['url'], record['final_url'], record['fetched_at'],
+                                         record['headers'], base64.b64decode(record['body'])))
+        else:
+            return
+        if len(self.pending[kind]) >= _BATCH_SIZE:
+            self.flush(kind)
+
+    def flush(self, kind: str = None) -> None:
+        for name in ([kind] if kind else list(self.pending)):
+            items = self.pending[name]
+            if not items:
+                continue
+            if name == 'point':
+                self.vector_db.client.upsert(collection_name=self.vector_db.collection_name, points=items)
+                self.counts['points'] += len(items)
+                if self.counts['points'] % 10000 < len(items):
+                    logger.info(f"Загружено {self.counts['points']} точек")
+            elif name == 'source_point':
+                self.vector_db.client.upsert(collection_name=self.vector_db.sources_collection_name, points=items)
+                self.counts['source_points'] += len(items)
+            elif name == 'embedding':
+                self.embedding_cache.import_rows(items)
+                self.counts['embeddings'] += len(items)
+            elif name == 'fingerprint':
+                self.near_duplicates.add_many(items)
+                self.counts['fingerprints'] += len(items)
+            elif name == 'page':
+                self.page_cache.import_rows(items)
+                self.counts['pages'] += len(items)
+            self.pending[name] = []
+
+
+def import_snapshot(path: str, vector_db, embedding_cache=None, near_duplicates=None,
+                    page_cache=None) -> Dict[str, int]:
+    """Загружает снимок, сохранённый export_snapshot, в коллекцию vector_db (идентификаторы точек
+    сохраняются, поэтому повторная загрузка не создаёт дубликатов); возвращает число записей каждого вида.
+
+    Снимок должен быть сделан тем же провайдером и моделью эмбеддингов, что настроены сейчас."""
+    records = _read_records(path)
+    header: Optional[Dict[str, Any]] = next(records, None)
+    if not header or header.get('type') != 'header':
+        raise ValueError(f"Файл {path} не является снимком коллекции")
+    if header.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка: {header.get('version')}")
+    if header['embedding_tag'] != vector_db.embeddings.tag:
+        raise ValueError(
+            f"Снимок сделан с эмбеддингами {header['embedding_tag']}, а текущий провайдер — {vector_db.embeddings.tag}. "
+            f"Задайте те же EMBEDDING_PROVIDER и EMBEDDING_MODEL"
+        )
+
+    # Размерность берётся из снимка, чтобы создание коллекции не требовало обращения к модели
+    vector_db.vector_size = header['vector_size']
+    vector_db._ensure_collection()
+
+    importer = _Importer(vector_db, embedding_cache, near_duplicates, page_cache)
+    footer = None
+    for record in records:
+        if record['type'] == 'footer':
+            footer = record
+            break
+        importer.add(record)
+    importer.flush()
+    if footer is None:
+        logger.warning(f"Снимок {path} не завершён (нет итоговой записи), загружена только его часть")
+
+    counts = importer.counts
+    if vector_db._has_source_index and not counts['source_points'] and counts['points']:
+        # В снимке нет векторов источников (исходная коллекция без них) — строим по загруженным блокам
+        counts['source_points'] = vector_db.rebuild_source_index()
+    logger.info(f"Снимок {path} загружен в коллекцию '{vector_db.collection_name}': {counts}")
+    return counts
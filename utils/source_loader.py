@@ -0,0 +1,147 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, Iterator, Optional
+
+from utils.url_canon import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xlsm', '.xls', '.csv', '.txt', '.jsonl')
+
+_URL_COLUMNS = ('url', 'URL')
+
+
+def normalize_url(url: str) -> str:
+    """Нормализует URL так же, как он хранится в векторной БД"""
+    return canonicalize_url(url)
+
+
+def _looks_like_url(value) -> bool:
+    return isinstance(value, str) and value.strip().lower().startswith(('http://', 'https://'))
+
+
+def _column_values(rows: Iterable[tuple]) -> Iterator:
+    """Значения колонки URL из строк таблицы: колонка 'url'/'URL' или первая колонка.
+    Первая строка считается заголовком, если она не похожа на URL"""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    column = 0
+    for i, name in enumerate(header):
+        if isinstance(name, str) and name.strip() in _URL_COLUMNS:
+            column = i
+            break
+    else:
+        if header and _looks_like_url(header[0]):
+            yield header[0]
+    for row in rows:
+        if row and len(row) > column:
+            yield row[column]
+
+
+def _iter_xlsx(path: str) -> Iterator:
+    import openpyxl
+
+    # read_only: строки читаются потоково, без построения всей книги в памяти
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from _column_values(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _iter_xls(path: str) -> Iterator:
+    # Старый формат .xls openpyxl не читает; используем pandas (xlrd), если он установлен
+    import pandas as pd
+
+    df = pd.read_excel(path, header=None)
+    df = df.astype(object).where(df.notna(), None)
+    yield from _column_values(df.itertuples(index=False, name=None))
+
+
+def _iter_csv(path: str) -> Iterator:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from _column_values(csv.reader(f, dialect))
+
+
+def _iter_txt(path: str) -> Iterator:
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+def _iter_jsonl(path: str) -> Iterator:
+    with open(path, encoding='utf-8-sig') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"{path}:{line_no}: некорректная строка JSON ({e})")
+                continue
+            yield record.get('url') if isinstance(record, dict) else record
+
+
+_READERS = {
+    '.xlsx': _iter_xlsx,
+    '.xlsm': _iter_xlsx,
+    '.xls': _iter_xls,
+    '.csv': _iter_csv,
+    '.txt': _iter_txt,
+    '.jsonl': _iter_jsonl,
+}
+
+
+def iter_source_urls(path: str, dedupe: bool = True) -> Iterator[str]:
+    """Потоково читает список источников (xlsx, csv, txt, jsonl) и возвращает URL.
+
+    URL возвращаются как записаны (без пробелов по краям): по ним выполняется загрузка.
+    Повторами считаются URL с одинаковым каноническим видом; они отбрасываются по ходу чтения,
+    для этого хранится только 8-байтовый хэш канонического вида каждого URL."""
+    extension = os.path.splitext(path)[1].lower()
+    reader = _READERS.get(extension)
+    if reader is None:
+        raise ValueError(f"Неподдерживаемый формат файла источников: {extension or path} "
+                         f"(поддерживаются {', '.join(SUPPORTED_EXTENSIONS)})")
+
+    seen = set()
+    duplicates = 0
+    for value in reader(path):
+        if value is None:
+            continue
+        url = str(value).strip()
+        if not url:
+            continue
+        if dedupe:
+            digest = hashlib.blake2b(canonicalize_url(url).encode('utf-8'), digest_size=8).digest()
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+        yield url
+    if duplicates:
+        logger.info(f"Пропущено повторяющихся источников: {duplicates}")
+
+
+def load_source_urls(path: str, limit: Optional[int] = None) -> list:
+    """Загружает URL без повторов (не более limit, если задан)"""
+    urls = []
+    for url in iter_source_urls(path):
+        urls.append(url)
+        if limit is not None and len(urls) >= limit:
+            break
+    return urls
@@ -0,0 +1,45 @@
+import re
+import zlib
+from collections import Counter
+from typing import List
+
+from qdrant_client.models import SparseVector
+
+import config
+
+
+class SparseEncoder:
+    """Локальный BM25-кодировщик: разреженные векторы по хэшам термов (IDF применяет Qdrant)"""
+
+    _token_re = re.compile(r'\w+', re.UNICODE)
+
+    def __init__(self, k1: float = None, b: float = None, avg_doc_len: float = None, stem_length: int = None):
+        self.k1 = k1 if k1 is not None else config.SPARSE_BM25_K1
+        self.b = b if b is not None else config.SPARSE_BM25_B
+        self.avg_doc_len = avg_doc_len or config.SPARSE_AVG_DOC_LEN
+        self.stem_length = stem_length if stem_length is not None else config.SPARSE_STEM_LENGTH
+
+    def tokenize(self, text: str) -> List[str]:
+        """Разбивает текст на термы; при SPARSE_STEM_LENGTH > 0 усекает их до префикса (грубый стемминг)"""
+        tokens = self._token_re.findall(text.lower().replace('ё', 'е'))
+        if self.stem_length:
+            tokens = [token[:self.stem_length] for token in tokens]
+        return [token for token in tokens if len(token) > 1 or token.isdigit()]
+
+    @staticmethod
+    def _index(token: str) -> int:
+        return zlib.crc32(token.encode('utf-8'))
+
+    def encode_document(self, text: str) -> SparseVector:
+        """Вектор документа: насыщенная частота терма BM25 с нормировкой на длину"""
+        tokens = self.tokenize(text)
+        counts = Counter(self._index(token) for token in tokens)
+        norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_len)
+        indices = list(counts.keys())
+        values = [tf * (self.k1 + 1) / (tf + norm) for tf in counts.values()]
+        return SparseVector(indices=indices, values=values)
+
+    def encode_query(self, text: str) -> SparseVector:
+        """Вектор запроса: уникальные термы с единичным весом"""
+        indices = sorted({self._index(token) for token in self.tokenize(text)})
+        return SparseVector(indices=indices, values=[1.0] * len(indices))
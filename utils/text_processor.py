@@ -3,6 +3,7 @@ import re
 from typing import List, Dict
 import logging
 import config
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +46,7 @@ class TextProcessor:
                         'source_url': source_url
                     })
 
+        metrics.CHUNKS_PRODUCED.inc(len(chunks))
         logger.info(f"Текст разбит на {len(chunks)} блоков")
         return chunks
 
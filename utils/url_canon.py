@@ -0,0 +1,85 @@
+import fnmatch
+import posixpath
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import config
+
+_DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def _strip_rules():
+    return [rule.strip().lower() for rule in config.URL_CANON_STRIP_PARAMS.split(',') if rule.strip()]
+
+
+def _is_stripped_param(name: str, rules) -> bool:
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, rule) for rule in rules)
+
+
+def canonical_host(host: str) -> str:
+    """Хост в каноническом виде: нижний регистр, без 'www.' (если включено URL_CANON_STRIP_WWW)"""
+    host = host.strip().lower().rstrip('.')
+    if config.URL_CANON_STRIP_WWW and host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def canonicalize_url(url: str) -> str:
+    """Канонический вид URL, под которым источник хранится в индексе и кэше страниц.
+
+    Схема и хост приводятся к нижнему регистру (http -> https при URL_CANON_FORCE_HTTPS, без 'www.'),
+    порт по умолчанию и фрагмент отбрасываются, из запроса удаляются параметры по правилам
+    URL_CANON_STRIP_PARAMS, остальные сортируются. Регистр пути сохраняется, завершающий '/' удаляется."""
+    url = url.strip()
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS or not parts.hostname:
+        return url.rstrip('/')
+
+    host = canonical_host(parts.hostname)
+    try:
+        port = parts.port
+    except ValueError:
+        return url.rstrip('/')
+    if config.URL_CANON_FORCE_HTTPS and scheme == 'http':
+        scheme = 'https'
+        if port == 80:
+            port = None
+    netloc = host if port is None or str(port) == _DEFAULT_PORTS[scheme] else f"{host}:{port}"
+
+    path = parts.path or '/'
+    if '/.' in path or '//' in path:
+        path = posixpath.normpath(path)
+    path = path.rstrip('/')
+
+    rules = _strip_rules()
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not _is_stripped_param(name, rules))
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def legacy_url_key(url: str) -> str:
+    """Ключ, под которым источники хранились до канонизации URL: весь адрес в нижнем регистре"""
+    return url.strip().rstrip('/').lower()
+
+
+def same_site(url: str, other: str) -> bool:
+    """URL относятся к одному хосту (после канонизации)"""
+    return urlsplit(canonicalize_url(url)).netloc == urlsplit(canonicalize_url(other)).netloc
+
+
+def resolve_canonical(requested_url: str, final_url: Optional[str] = None, canonical_href: Optional[str] = None) -> str:
+    """Канонический URL загруженной страницы: rel=canonical (только на том же хосте),
+    иначе конечный URL после перенаправлений, иначе запрошенный"""
+    base = final_url or requested_url
+    if canonical_href and config.URL_CANON_USE_REL_CANONICAL:
+        candidate = urljoin(base, canonical_href.strip())
+        if same_site(candidate, base):
+            return canonicalize_url(candidate)
+    return canonicalize_url(base)
+
+
+def url_aliases(canonical: str, urls: Iterable[Optional[str]]) -> list:
+    """Другие канонические формы, под которыми запрашивалась та же страница (запрошенный URL, перенаправления)"""
+    return sorted({canonicalize_url(url) for url in urls if url} - {canonical})
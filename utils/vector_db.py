@@ -1,64 +1,226 @@
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import Collection, List, Dict, Any, NamedTuple, Optional
+import numpy as np
 from qdrant_client import QdrantClient
 from qdrant_client.models import VectorParams, Distance, PointStruct, UpdateCollection
+from qdrant_client.models import (
+    HnswConfigDiff, SearchParams, QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+    ScalarType, BinaryQuantization, BinaryQuantizationConfig, VectorParamsDiff, CollectionParamsDiff, Disabled
+)
 from datetime import datetime
-from qdrant_client.models import Filter, FieldCondition, MatchValue, Range,FilterSelector
-from langchain_gigachat import GigaChatEmbeddings
+from qdrant_client.models import Filter, FieldCondition, MatchValue, MatchAny, Range,FilterSelector
+from qdrant_client.models import PointIdsList, HasIdCondition, IsEmptyCondition, PayloadField, SetPayload, SetPayloadOperation
+from qdrant_client.models import PayloadSchemaType
+from qdrant_client.models import CreateAliasOperation, CreateAlias
+from qdrant_client.models import SparseVectorParams, Modifier, Prefetch, FusionQuery, Fusion
+from utils.sparse import SparseEncoder
+from utils.embeddings import EmbeddingProvider, get_embedding_provider
+from utils import metrics
+from utils.url_canon import canonicalize_url, legacy_url_key
 
+import re
 import uuid
+from urllib.parse import urlsplit
 import config
 
 logger = logging.getLogger(__name__)
 
+# Поля payload, которые запрашиваются при поиске (processing_date, chunk_index и векторы не передаются)
+_SEARCH_PAYLOAD_FIELDS = ['content', 'source_url', 'url_aliases']
+
+# Список разрешённых источников передаётся в фильтр первого уровня поиска, только если он не длиннее;
+# для более длинного списка первый уровень пропускается
+_MAX_FILTER_URLS = 5000
+
+
+def _host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def _source_point_id(url: str) -> str:
+    """Идентификатор точки источника во вспомогательной коллекции (детерминированный, для перезаписи)"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, url))
+
+
+def _centroid(vectors: List[List[float]]) -> List[float]:
+    """Нормированный центроид векторов (для косинусного расстояния)"""
+    centroid = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+    norm = float(np.linalg.norm(centroid))
+    return (centroid / norm if norm else centroid).tolist()
+
+
+class SearchHit(NamedTuple):
+    """Результат поиска: текст блока и его источник; тег источника добавляется при сборке промпта.
+
+    score задаёт порядок выдачи (при гибридном поиске это оценка RRF, построенная по рангам),
+    dense_score — косинусная схожесть блока с вопросом (None, если её не удалось получить)"""
+    id: Any
+    score: float
+    content: str
+    source_url: str
+    url_aliases: tuple = ()
+    dense_score: Optional[float] = None
+
+# Общий на процесс клиент Qdrant: один пул соединений (при gRPC — один мультиплексируемый канал)
+# на все экземпляры VectorDatabase и потоки
+_client_lock = threading.Lock()
+_client: Optional[QdrantClient] = None
+
+
+def _client_params() -> Dict[str, Any]:
+    return {
+        'url': config.QDRANT_URL,
+        'prefer_grpc': config.QDRANT_PREFER_GRPC,
+        'grpc_port': config.QDRANT_GRPC_PORT,
+        'timeout': config.QDRANT_TIMEOUT,
+    }
+
+
+def get_qdrant_client() -> QdrantClient:
+    """Возвращает общий клиент Qdrant (HTTP или gRPC согласно QDRANT_PREFER_GRPC); клиент потокобезопасен"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = QdrantClient(**_client_params())
+            logger.info(f"Создан клиент Qdrant ({'gRPC' if config.QDRANT_PREFER_GRPC else 'HTTP'}): {config.QDRANT_URL}")
+        return _client
+
+
 class VectorDatabase:
-    """Класс для работы с векторной БД Qdrant используя GigaChat embeddings"""
+    """Класс для работы с векторной БД Qdrant с подключаемым провайдером эмбеддингов"""
 
-    def __init__(self):
-        self.client = QdrantClient(url=config.QDRANT_URL)
+    def __init__(self, client: QdrantClient = None, embeddings: EmbeddingProvider = None):
+        self.client = client or get_qdrant_client()
         self.collection_name = config.QDRANT_COLLECTION_NAME
 
-        # Инициализируем GigaChat Embeddings с username/password авторизацией
-        self.embeddings = GigaChatEmbeddings(
-            user=config.GIGACHAT_USERNAME,
-            password=config.GIGACHAT_PASSWORD,
-            base_url=config.GIGACHAT_BASE_URL,
-            auth_url=config.GIGACHAT_AUTH_URL,
-            scope=config.GIGACHAT_SCOPE,
-            verify_ssl_certs=config.GIGACHAT_VERIFY_SSL
-        )
+        # Провайдер эмбеддингов (GigaChat, локальная модель или хэширующий векторизатор);
+        # создаётся при первом обращении, чтобы административные операции не требовали учётных данных
+        self._embeddings = embeddings
 
         # Получаем размерность векторов от первого эмбеддинга
         self.vector_size = None
+        self._collection_ready = False
+
+        # Разреженные BM25-векторы для гибридного поиска
+        self.sparse_encoder = SparseEncoder()
+        self._has_sparse = False
+
+        # Векторы источников (центроиды блоков) для двухуровневого поиска
+        self.source_index = config.SOURCE_INDEX_ENABLED
+        self._has_source_index = False
+
+        # Параметры хранения, индекса HNSW и квантования
+        self.quantization = config.QDRANT_QUANTIZATION
+        self.quantization_always_ram = config.QDRANT_QUANTIZATION_ALWAYS_RAM
+        self.rescore = config.QDRANT_RESCORE
+        self.oversampling = config.QDRANT_OVERSAMPLING
+        self.on_disk_vectors = config.QDRANT_ON_DISK_VECTORS
+        self.on_disk_payload = config.QDRANT_ON_DISK_PAYLOAD
+        self.hnsw_m = config.QDRANT_HNSW_M
+        self.hnsw_ef_construct = config.QDRANT_HNSW_EF_CONSTRUCT
+        self.search_ef = config.QDRANT_SEARCH_EF
         #self._setup_collection()
+
+    @property
+    def sources_collection_name(self) -> str:
+        """Вспомогательная коллекция с одним вектором на источник"""
+        return f"{self.collection_name}__sources"
+
+    @property
+    def embeddings(self) -> EmbeddingProvider:
+        if self._embeddings is None:
+            self._embeddings = get_embedding_provider()
+        return self._embeddings
+
     def _ensure_collection(self):
-        """Гарантирует существование коллекции"""
+        """Гарантирует существование коллекции (проверка выполняется один раз на экземпляр)"""
+        if self._collection_ready:
+            return
         if not self._collection_exists():
             self._setup_collection()
-    def _collection_exists(self) -> bool:
-        """Проверяет существование коллекции"""
+        else:
+            self._verify_embedding_tag()
+        self._detect_sparse()
+        self._detect_source_index()
+        self._collection_ready = True
+
+    def _detect_sparse(self) -> None:
+        """Определяет, есть ли в коллекции разреженные векторы (коллекции, созданные ранее, их не имеют)"""
+        sparse = self.client.get_collection(self.collection_name).config.params.sparse_vectors or {}
+        self._has_sparse = config.HYBRID_SEARCH and config.SPARSE_VECTOR_NAME in sparse
+        if config.HYBRID_SEARCH and not self._has_sparse:
+            logger.warning(f"В коллекции '{self.collection_name}' нет разреженных векторов, используется только плотный поиск")
+
+    def _detect_source_index(self) -> None:
+        """Определяет, есть ли коллекция векторов источников (коллекции, созданные ранее, её не имеют)"""
+        self._has_source_index = self.source_index and self._collection_exists(self.sources_collection_name)
+        if self.source_index and not self._has_source_index:
+            logger.warning(f"Нет коллекции векторов источников '{self.sources_collection_name}', поиск идёт по всем блокам "
+                           f"(для двухуровневого поиска выполните --rebuild-source-index)")
+
+    def _collection_exists(self, name: str = None) -> bool:
+        """Проверяет существование коллекции (по умолчанию — основной)"""
         try:
             collections = self.client.get_collections()
-            return any(col.name == self.collection_name 
+            return any(col.name == (name or self.collection_name)
                     for col in collections.collections)
         except Exception:
             return False
     def _get_vector_dimension(self) -> int:
-        """Получает размерность векторов из GigaChat embeddings"""
+        """Получает размерность векторов от провайдера эмбеддингов"""
+        if self.vector_size is None:
+            self.vector_size = self.embeddings.dimension
         if self.vector_size is None:
             try:
                 # Создаем тестовый эмбеддинг для определения размерности
                 test_embedding = self.embeddings.embed_query("тест")
                 self.vector_size = len(test_embedding)
-                logger.info(f"Определена размерность векторов GigaChat: {self.vector_size}")
+                logger.info(f"Определена размерность векторов {self.embeddings.tag}: {self.vector_size}")
             except Exception as e:
+                # Размерность не угадываем: коллекция с неверной размерностью хуже явной ошибки
                 logger.error(f"Ошибка при определении размерности векторов: {e}")
-                # Используем стандартную размерность как fallback
-                self.vector_size = 1024  # Предполагаемая размерность по умолчанию
-                logger.warning(f"Используется размерность по умолчанию: {self.vector_size}")
+                raise
 
         return self.vector_size
 
+    def _embedding_alias(self) -> str:
+        """Алиас коллекции, которым помечены провайдер, модель и размерность эмбеддингов"""
+        tag = re.sub(r'[^A-Za-z0-9_-]+', '-', self.embeddings.tag)
+        return f"{self.collection_name}__emb__{tag}__{self._get_vector_dimension()}"
+
+    def _tag_collection(self) -> None:
+        self.client.update_collection_aliases(change_aliases_operations=[
+            CreateAliasOperation(create_alias=CreateAlias(
+                collection_name=self.collection_name,
+                alias_name=self._embedding_alias()
+            ))
+        ])
+
+    def _verify_embedding_tag(self) -> None:
+        """Проверяет, что коллекция создана тем же провайдером, моделью и размерностью эмбеддингов"""
+        prefix = f"{self.collection_name}__emb__"
+        aliases = self.client.get_collection_aliases(self.collection_name).aliases
+        tags = [a.alias_name for a in aliases if a.alias_name.startswith(prefix)]
+        expected = self._embedding_alias()
+        if not tags:
+            # Коллекция создана до появления меток: проверяем размерность и помечаем
+            existing_size = self.client.get_collection(self.collection_name).config.params.vectors.size
+            if existing_size != self._get_vector_dimension():
+                raise ValueError(
+                    f"Размерность коллекции '{self.collection_name}' ({existing_size}) не совпадает с размерностью "
+                    f"провайдера {self.embeddings.tag} ({self._get_vector_dimension()}). "
+                    f"Очистите коллекцию (--clear-db) или задайте другое QDRANT_COLLECTION_NAME"
+                )
+            self._tag_collection()
+            logger.info(f"Коллекция '{self.collection_name}' помечена эмбеддингами {self.embeddings.tag}")
+        elif expected not in tags:
+            raise ValueError(
+                f"Коллекция '{self.collection_name}' создана с эмбеддингами {tags[0][len(prefix):]}, "
+                f"а текущий провайдер — {self.embeddings.tag}. "
+                f"Очистите коллекцию (--clear-db) или задайте другое QDRANT_COLLECTION_NAME"
+            )
+
     def _setup_collection(self):
         """Создает коллекцию в Qdrant если она не существует"""
         try:
@@ -72,71 +234,235 @@ class VectorDatabase:
                 # Создаем коллекцию с корректной размерностью
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=vector_dim,
-                        distance=Distance.COSINE
-                    )
+                    **self._collection_params(vector_dim)
                 )
-                logger.info(f"Создана коллекция '{self.collection_name}' с размерностью {vector_dim}")
+                self._tag_collection()
+                self._create_payload_indexes()
+                if self.source_index:
+                    self._create_sources_collection(vector_dim)
+                logger.info(f"Создана коллекция '{self.collection_name}' с размерностью {vector_dim} ({self.embeddings.tag})")
             else:
-                # Если коллекция существует, получаем информацию о размерности
-                collection_info = self.client.get_collection(self.collection_name)
-                existing_size = collection_info.config.params.vectors.size
-                current_size = self._get_vector_dimension()
+                # Если коллекция существует, проверяем провайдера и размерность эмбеддингов
+                self._verify_embedding_tag()
+                logger.info(f"Коллекция '{self.collection_name}' уже существует ({self.embeddings.tag})")
 
-                if existing_size != current_size:
-                    logger.warning(f"Размерность коллекции ({existing_size}) не совпадает с текущей ({current_size})")
-                    logger.info("Удаляем и пересоздаем коллекцию с новой размерностью")
+        except Exception as e:
+            logger.error(f"Ошибка при настройке коллекции: {e}")
+            raise
 
-                    self.client.delete_collection(self.collection_name)
-                    self.client.create_collection(
-                        collection_name=self.collection_name,
-                        vectors_config=VectorParams(
-                            size=current_size,
-                            distance=Distance.COSINE
-                        )
-                    )
-                    logger.info(f"Пересоздана коллекция с размерностью {current_size}")
-                else:
-                    logger.info(f"Коллекция '{self.collection_name}' уже существует с размерностью {existing_size}")
+    def _create_payload_indexes(self) -> None:
+        """Индексы payload для фильтров по источнику (проверка наличия URL, удаление источника) и по времени обработки"""
+        self.client.create_payload_index(self.collection_name, 'source_url', PayloadSchemaType.KEYWORD)
+        self.client.create_payload_index(self.collection_name, 'chunk_index', PayloadSchemaType.INTEGER)
+        # Другие канонические формы URL источника (перенаправления, rel=canonical)
+        self.client.create_payload_index(self.collection_name, 'url_aliases', PayloadSchemaType.KEYWORD)
+        # Срок хранения: отбор устаревших блоков по времени обработки и хосту источника
+        self.client.create_payload_index(self.collection_name, 'processing_ts', PayloadSchemaType.FLOAT)
+        self.client.create_payload_index(self.collection_name, 'source_host', PayloadSchemaType.KEYWORD)
+
+    def _create_sources_collection(self, vector_dim: int) -> None:
+        """Коллекция векторов источников: по точке на источник, поля для фильтров по URL и сроку хранения"""
+        self.client.create_collection(
+            collection_name=self.sources_collection_name,
+            vectors_config=VectorParams(size=vector_dim, distance=Distance.COSINE),
+            hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+        )
+        for field, schema in (('source_url', PayloadSchemaType.KEYWORD), ('url_aliases', PayloadSchemaType.KEYWORD),
+                              ('processing_ts', PayloadSchemaType.FLOAT), ('source_host', PayloadSchemaType.KEYWORD)):
+            self.client.create_payload_index(self.sources_collection_name, field, schema)
 
+    def _quantization_config(self):
+        """Конфигурация квантования векторов согласно QDRANT_QUANTIZATION (none/scalar/binary)"""
+        if self.quantization == 'scalar':
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8, quantile=0.99, always_ram=self.quantization_always_ram
+            ))
+        if self.quantization == 'binary':
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        if self.quantization not in ('', 'none'):
+            raise ValueError(f"Неизвестный тип квантования: {self.quantization}")
+        return None
+
+    def _collection_params(self, vector_dim: int) -> Dict[str, Any]:
+        """Параметры создания коллекции: хранение векторов/payload, HNSW и квантование"""
+        return {
+            'vectors_config': VectorParams(
+                size=vector_dim,
+                distance=Distance.COSINE,
+                on_disk=self.on_disk_vectors
+            ),
+            'hnsw_config': HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+            'sparse_vectors_config': {
+                config.SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)
+            } if config.HYBRID_SEARCH else None,
+            'quantization_config': self._quantization_config(),
+            'on_disk_payload': self.on_disk_payload,
+        }
+
+    def _search_params(self) -> Optional[SearchParams]:
+        """Параметры поиска: ef для HNSW и пересчёт оценок по исходным векторам при квантовании"""
+        quantization = None
+        if self.quantization not in ('', 'none'):
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if not self.search_ef and quantization is None:
+            return None
+        return SearchParams(hnsw_ef=self.search_ef or None, quantization=quantization)
+
+    def update_collection_settings(self) -> None:
+        """Применяет текущие настройки хранения, HNSW и квантования к существующей коллекции"""
+        self._ensure_collection()
+        try:
+            # None в update_collection означает «не менять», поэтому отключение квантования передаётся явно
+            quantization = self._quantization_config() or Disabled.DISABLED
+            updated = self.client.update_collection(
+                collection_name=self.collection_name,
+                vectors_config={'': VectorParamsDiff(on_disk=self.on_disk_vectors)},
+                hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+                quantization_config=quantization,
+                collection_params=CollectionParamsDiff(on_disk_payload=self.on_disk_payload)
+            )
+            if not updated:
+                raise RuntimeError(f"Qdrant не применил новые параметры коллекции '{self.collection_name}'")
+            self._create_payload_indexes()
+            logger.info(f"Параметры коллекции '{self.collection_name}' обновлены "
+                        f"(квантование: {self.quantization}, m={self.hnsw_m}, ef_construct={self.hnsw_ef_construct})")
         except Exception as e:
-            logger.error(f"Ошибка при настройке коллекции: {e}")
+            logger.error(f"Ошибка при обновлении параметров коллекции: {e}")
             raise
+    @staticmethod
+    def _url_filter(url: str) -> Filter:
+        """Блоки источника с данным каноническим URL, в т.ч. записанные под другим URL с этим псевдонимом"""
+        return Filter(should=[
+            FieldCondition(key="source_url", match=MatchValue(value=url)),
+            FieldCondition(key="url_aliases", match=MatchValue(value=url)),
+        ])
+
     def url_exists(self, url: str) -> bool:
         self._ensure_collection()
         """Проверяет, существует ли URL в базе данных"""
         logger.info((f"Проверка наличия URL в БД: {url}"))
         try:
-            # Нормализуем url так же, как при добавлении
-            url = url.strip().rstrip('/').lower()
-            search_result = self.client.count(
-                collection_name=self.collection_name,
-                count_filter=Filter(
-                    must=[FieldCondition(
-                        key="source_url",
-                        match=MatchValue(value=url) 
-                    )]
+            url = canonicalize_url(url)
+            with metrics.QDRANT_DURATION.time(operation='count'):
+                search_result = self.client.count(
+                    collection_name=self.collection_name,
+                    count_filter=self._url_filter(url)
                 )
-            )
             logger.info((f"Найдено:{search_result.count}"))
             return search_result.count > 0
         except Exception as e:
             logger.error(f"Ошибка при проверке URL: {e}")
             return False
 
+    def missing_urls(self, urls: List[str], batch_size: int = 256) -> List[str]:
+        """Возвращает URL, которых ещё нет в базе (в исходном виде и порядке, без повторов по каноническому виду).
+        URL считается проиндексированным, если его канонический вид совпадает с source_url или одним из url_aliases.
+
+        Вместо отдельного count на каждый URL выполняется один scroll на пачку: у каждого
+        источника ровно один блок с chunk_index = 0, поэтому пачка возвращает не больше batch_size точек."""
+        self._ensure_collection()
+        originals = {}
+        for url in urls:
+            originals.setdefault(canonicalize_url(url), url.strip())
+        keys = list(originals)
+        existing = set()
+        for i in range(0, len(keys), batch_size):
+            part = keys[i:i + batch_size]
+            offset = None
+            while True:
+                with metrics.QDRANT_DURATION.time(operation='scroll'):
+                    points, offset = self.client.scroll(
+                        collection_name=self.collection_name,
+                        scroll_filter=Filter(
+                            must=[FieldCondition(key="chunk_index", match=MatchValue(value=0))],
+                            should=[
+                                FieldCondition(key="source_url", match=MatchAny(any=part)),
+                                FieldCondition(key="url_aliases", match=MatchAny(any=part)),
+                            ]
+                        ),
+                        limit=len(part),
+                        offset=offset,
+                        with_payload=['source_url', 'url_aliases'],
+                        with_vectors=False
+                    )
+                for point in points:
+                    existing.add(point.payload.get('source_url'))
+                    existing.update(point.payload.get('url_aliases') or ())
+                if offset is None:
+                    break
+        missing = [key for key in keys if key not in existing]
+        if missing and config.URL_CANON_LEGACY_MATCH:
+            # Источник мог быть записан до канонизации URL — тогда он переводится на канонический вид
+            migrated = set(self.migrate_legacy_urls([originals[key] for key in missing]))
+            missing = [key for key in missing if key not in migrated]
+        return [originals[key] for key in missing]
+
+    def migrate_legacy_urls(self, urls: List[str], batch_size: int = 256) -> List[str]:
+        """Переводит источники, записанные до канонизации URL (под адресом в нижнем регистре), на канонический
+        вид исходных urls; старый адрес остаётся псевдонимом. Возвращает канонические URL переведённых источников.
+
+        Регистр пути в старых записях потерян, поэтому канонический вид восстанавливается только по исходному URL.
+        Если источник уже проиндексирован и под каноническим URL, старые блоки удаляются как повтор."""
+        pairs = {}
+        for url in urls:
+            canonical, legacy = canonicalize_url(url), legacy_url_key(url)
+            if legacy != canonical:
+                pairs.setdefault(legacy, canonical)
+        if not pairs or not self._collection_exists():
+            return []
+
+        found = {}
+        legacy_keys = list(pairs)
+        for i in range(0, len(legacy_keys), batch_size):
+            part = legacy_keys[i:i + batch_size]
+            offset = None
+            while True:
+                with metrics.QDRANT_DURATION.time(operation='scroll'):
+                    points, offset = self.client.scroll(
+                        collection_name=self.collection_name,
+                        scroll_filter=Filter(must=[
+                            FieldCondition(key="chunk_index", match=MatchValue(value=0)),
+                            FieldCondition(key="source_url", match=MatchAny(any=part)),
+                        ]),
+                        limit=len(part),
+                        offset=offset,
+                        with_payload=['source_url', 'url_aliases'],
+                        with_vectors=False
+                    )
+                for point in points:
+                    found[point.payload['source_url']] = point.payload.get('url_aliases') or []
+                if offset is None:
+                    break
+
+        migrated = []
+        for legacy, aliases in found.items():
+            canonical = pairs[legacy]
+            legacy_filter = Filter(must=[FieldCondition(key="source_url", match=MatchValue(value=legacy))])
+            duplicate = self.client.count(
+                collection_name=self.collection_name,
+                count_filter=Filter(must=[FieldCondition(key="source_url", match=MatchValue(value=canonical))])
+            ).count > 0
+            for collection_name in self._collections():
+                if duplicate:
+                    self.client.delete(collection_name=collection_name, points_selector=FilterSelector(filter=legacy_filter))
+                else:
+                    self.client.set_payload(
+                        collection_name=collection_name,
+                        payload={'source_url': canonical, 'url_aliases': sorted(set(aliases) | {legacy})},
+                        points=legacy_filter
+                    )
+            migrated.append(canonical)
+            logger.info(f"Источник {legacy} переведён на канонический URL {canonical}"
+                        + (" (старые блоки удалены как повтор)" if duplicate else ""))
+        return migrated
+
     def get_processing_date(self, url: str) -> Optional[str]:
         self._ensure_collection()
         """Возвращает дату обработки URL"""
         try:
             search_result = self.client.scroll(
                 collection_name=self.collection_name,
-                scroll_filter=Filter(
-                    must=[FieldCondition(
-                        key="source_url",
-                        match=MatchValue(value=url)
-                    )]
-                ),
+                scroll_filter=self._url_filter(canonicalize_url(url)),
                 limit=1
             )
             if search_result and search_result[0]:
@@ -148,38 +474,62 @@ class VectorDatabase:
             logger.error(f"Ошибка при получении даты обработки: {e}")
             return None
 
-    def add_documents(self, chunks: List[Dict[str, str]]) -> None:
-        """Добавляет документы в векторную БД"""
+    def get_url_aliases(self, url: str) -> List[str]:
+        """Псевдонимы, записанные у источника с данным каноническим URL"""
+        if not self._collection_exists():
+            return []
+        points, _ = self.client.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=Filter(must=[
+                FieldCondition(key="source_url", match=MatchValue(value=canonicalize_url(url))),
+                FieldCondition(key="chunk_index", match=MatchValue(value=0)),
+            ]),
+            limit=1,
+            with_payload=['url_aliases'],
+            with_vectors=False
+        )
+        return list(points[0].payload.get('url_aliases') or ()) if points else []
+
+    def add_url_aliases(self, url: str, aliases: List[str]) -> None:
+        """Добавляет псевдонимы к уже проиндексированному источнику (без повторной векторизации)"""
+        url = canonicalize_url(url)
+        current = set(self.get_url_aliases(url))
+        merged = sorted(current | set(aliases))
+        if merged == sorted(current):
+            return
+        for collection_name in self._collections():
+            self.client.set_payload(
+                collection_name=collection_name,
+                payload={'url_aliases': merged},
+                points=Filter(must=[FieldCondition(key="source_url", match=MatchValue(value=url))])
+            )
+        logger.info(f"Источнику {url} добавлены псевдонимы: {', '.join(sorted(set(aliases) - current))}")
+
+    def add_documents(self, chunks: List[Dict[str, str]], url_aliases: List[str] = None) -> None:
+        """Добавляет документы в векторную БД (url_aliases — другие URL той же страницы)"""
         self._ensure_collection()
         if not chunks:
             return
         try:
             texts = [chunk['content'] for chunk in chunks]
             embeddings = self.embeddings.embed_documents(texts)
+            points = self._build_points(chunks, embeddings, url_aliases)
 
-            points = []
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                payload = {
-                'content': chunk['content'],
-                'source_url': chunk['source_url'],
-                'chunk_index': i,
-                'processing_date': datetime.now().isoformat()  # Текущая дата
-                }
-                point = PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding,
-                    payload=payload
-                )
-                points.append(point)
+            # Вектор источника пишется первым: источник без блоков в поиске не мешает, а блоки без него не нашлись бы
+            if self._has_source_index:
+                with metrics.QDRANT_DURATION.time(operation='upsert'):
+                    self.client.upsert(
+                        collection_name=self.sources_collection_name,
+                        points=self._build_source_points(chunks, embeddings, url_aliases)
+                    )
 
             # Загружаем точки батчами для оптимизации
-            batch_size = 100
-            for i in range(0, len(points), batch_size):
-                batch = points[i:i + batch_size]
-                self.client.upsert(
-                    collection_name=self.collection_name,
-                    points=batch
-                )
+            for batch in self._batches(points):
+                with metrics.QDRANT_DURATION.time(operation='upsert'):
+                    self.client.upsert(
+                        collection_name=self.collection_name,
+                        points=batch
+                    )
 
             logger.info(f"Добавлено {len(points)} документов в векторную БД")
 
@@ -187,8 +537,66 @@ class VectorDatabase:
             logger.error(f"Ошибка при добавлении документов: {e}")
             raise
 
-    def search_similar(self, query: str, limit: int = None, threshold: float = None) -> List[Dict]:
-        """Поиск похожих документов по запросу"""
+    def _build_points(self, chunks: List[Dict[str, str]], embeddings: List[List[float]],
+                      url_aliases: List[str] = None) -> List[PointStruct]:
+        """Формирует точки Qdrant из блоков текста и их эмбеддингов"""
+        points = []
+        now = datetime.now()
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            payload = {
+            'content': chunk['content'],
+            'source_url': chunk['source_url'],
+            'source_host': _host_of(chunk['source_url']),
+            'url_aliases': list(url_aliases or []),
+            'chunk_index': i,
+            'processing_date': now.isoformat(),  # Текущая дата
+            'processing_ts': now.timestamp()     # Она же числом (индексируется, для фильтров по сроку хранения)
+            }
+            vector = embedding
+            if self._has_sparse:
+                vector = {'': embedding, config.SPARSE_VECTOR_NAME: self.sparse_encoder.encode_document(chunk['content'])}
+            points.append(PointStruct(
+                id=str(uuid.uuid4()),
+                vector=vector,
+                payload=payload
+            ))
+        return points
+
+    @staticmethod
+    def _source_point(url: str, vectors: List[List[float]], url_aliases: List[str], processing_ts: float) -> PointStruct:
+        """Точка коллекции источников: вектор источника — нормированный центроид эмбеддингов его блоков"""
+        return PointStruct(
+            id=_source_point_id(url),
+            vector=_centroid(vectors),
+            payload={
+                'source_url': url,
+                'source_host': _host_of(url),
+                'url_aliases': list(url_aliases or []),
+                'chunk_count': len(vectors),
+                'processing_ts': processing_ts
+            }
+        )
+
+    def _build_source_points(self, chunks: List[Dict[str, str]], embeddings: List[List[float]],
+                             url_aliases: List[str] = None) -> List[PointStruct]:
+        groups: Dict[str, List[List[float]]] = {}
+        for chunk, embedding in zip(chunks, embeddings):
+            groups.setdefault(chunk['source_url'], []).append(embedding)
+        now = datetime.now().timestamp()
+        return [self._source_point(url, vectors, url_aliases, now) for url, vectors in groups.items()]
+
+    @staticmethod
+    def _batches(points: List[PointStruct], batch_size: int = 100):
+        for i in range(0, len(points), batch_size):
+            yield points[i:i + batch_size]
+
+    def search_similar(self, query: str, limit: int = None, threshold: float = None,
+                       sources: Collection[str] = None) -> List[SearchHit]:
+        """Поиск похожих документов по запросу.
+
+        При наличии векторов источников поиск двухуровневый: сначала выбираются SOURCE_SEARCH_TOP
+        ближайших источников (из sources, если список задан), затем блоки ищутся только внутри них.
+        Для списка sources длиннее _MAX_FILTER_URLS блоки ищутся сразу по всей коллекции."""
         self._ensure_collection()
         try:
             if limit is None:
@@ -199,116 +607,320 @@ class VectorDatabase:
             # Создаем эмбеддинг для запроса
             query_embedding = self.embeddings.embed_query(query)
 
-            # Выполняем поиск
-            search_result = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=limit,
-                score_threshold=threshold
-            )
+            source_urls = None
+            top_params = self._top_sources_params(query_embedding, sources)
+            if top_params is not None:
+                with metrics.QDRANT_DURATION.time(operation='query_sources'):
+                    source_urls = self._source_urls(self.client.query_points(**top_params).points)
 
-            # Форматируем результаты
-            results = []
-            for scored_point in search_result:
-                content = f"{scored_point.payload['content']}\n<Source>{scored_point.payload['source_url']}</Source>"
-                results.append({
-                    'content': content,
-                    'source_url': scored_point.payload['source_url'],
-                    'score': scored_point.score,
-                    'id': scored_point.id,
-                    'vector': scored_point.vector
-                })
+            # Выполняем поиск (гибридный, если в коллекции есть разреженные векторы)
+            params = self._query_params(query, query_embedding, limit, threshold, source_urls)
+            fused = 'prefetch' in params
+            with metrics.QDRANT_DURATION.time(operation='query'):
+                search_result = self.client.query_points(collection_name=self.collection_name, **params).points
 
+            results = self._format_results(search_result, dense=not fused)
+            if fused:
+                results = self._with_dense_scores(results, query_embedding)
             logger.info(f"Найдено {len(results)} релевантных документов для запроса")
-            #unique_results = self.remove_duplicates_by_vectors(results, threshold)
-            unique_results=results
-            logger.info(f"Из них {len(unique_results)} уникальных")            
-            return unique_results
+            return results
             
         except Exception as e:
             logger.error(f"Ошибка при поиске документов: {e}")
             raise
-    def remove_duplicates_by_vectors(self, search_results: List[Dict], threshold: float = None) -> List[Dict]:
-        """Удаляет дубликаты из результатов поиска по сохраненным векторам"""
-        if threshold is None:
-            threshold = config.SIMILARITY_THRESHOLD
-        
-        if not search_results:
-            return search_results
-
-        unique_results = []
-        unique_vectors = []
-        
-        for result in search_results:
-            vector = result['vector']  # Вектор из результатов поиска
-            is_duplicate = False
-            
-            # Сравниваем с уже добавленными векторами
-            for unique_vector in unique_vectors:
-                similarity = self._cosine_similarity(vector, unique_vector)
-                if similarity >= threshold:
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                unique_results.append(result)
-                unique_vectors.append(vector)
-        
-        return unique_results
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Вычисляет косинусное сходство между двумя векторами"""
-        import math
 
-        # Вычисляем скалярное произведение
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
+    def _top_sources_params(self, query_embedding: List[float], sources: Collection[str] = None) -> Optional[Dict[str, Any]]:
+        """Параметры первого уровня поиска (по векторам источников); None — искать сразу по всем блокам"""
+        if not config.SOURCE_SEARCH_TOP or not self._has_source_index:
+            return None
+        if sources and len(sources) > _MAX_FILTER_URLS:
+            # Без фильтра ближайшие источники могут оказаться вне разрешённого списка, и все их блоки
+            # были бы отброшены; поиск сразу по блокам этого не допускает
+            return None
+        query_filter = None
+        if sources:
+            urls = list(sources)
+            query_filter = Filter(should=[
+                FieldCondition(key="source_url", match=MatchAny(any=urls)),
+                FieldCondition(key="url_aliases", match=MatchAny(any=urls)),
+            ])
+        return {
+            'collection_name': self.sources_collection_name,
+            'query': query_embedding,
+            'query_filter': query_filter,
+            'limit': config.SOURCE_SEARCH_TOP,
+            'search_params': self._search_params(),
+            'with_payload': ['source_url'],
+            'with_vectors': False,
+        }
+
+    @staticmethod
+    def _source_urls(scored_points) -> Optional[List[str]]:
+        # Пустая коллекция источников (например, не перестроенная после обновления) не должна скрывать блоки
+        return [point.payload['source_url'] for point in scored_points] or None
 
-        # Вычисляем нормы векторов
-        norm1 = math.sqrt(sum(a * a for a in vec1))
-        norm2 = math.sqrt(sum(a * a for a in vec2))
+    def _query_params(self, query: str, query_embedding: List[float], limit: int, threshold: float,
+                      source_urls: List[str] = None) -> Dict[str, Any]:
+        """Параметры query_points: плотный поиск или слияние (RRF) плотного и BM25-поиска;
+        source_urls ограничивает поиск блоками выбранных источников"""
+        search_params = self._search_params()
+        query_filter = Filter(must=[FieldCondition(key="source_url", match=MatchAny(any=source_urls))]) if source_urls else None
+        sparse_query = self.sparse_encoder.encode_query(query) if self._has_sparse else None
+        if sparse_query is None or not sparse_query.indices:
+            return {
+                'query': query_embedding,
+                'query_filter': query_filter,
+                'limit': limit,
+                'score_threshold': threshold,
+                'search_params': search_params,
+                'with_payload': _SEARCH_PAYLOAD_FIELDS,
+                'with_vectors': False,
+            }
+        # Порог схожести применяется к плотной ветке; итог ранжируется по Reciprocal Rank Fusion.
+        # Каждая ветка даёт не меньше limit кандидатов, иначе слияние не заполнит запрошенное окно
+        prefetch_limit = max(limit, config.HYBRID_PREFETCH_LIMIT)
+        return {
+            'prefetch': [
+                Prefetch(query=query_embedding, filter=query_filter, limit=prefetch_limit, score_threshold=threshold,
+                         params=search_params),
+                Prefetch(query=sparse_query, using=config.SPARSE_VECTOR_NAME, filter=query_filter, limit=prefetch_limit),
+            ],
+            'query': FusionQuery(fusion=Fusion.RRF),
+            'limit': limit,
+            'with_payload': _SEARCH_PAYLOAD_FIELDS,
+            'with_vectors': False,
+        }
 
-        # Избегаем деления на ноль
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
+    def _with_dense_scores(self, hits: List[SearchHit], query_embedding: List[float]) -> List[SearchHit]:
+        """Дополняет результаты слияния RRF косинусной схожестью с вопросом: оценка RRF зависит
+        только от рангов и не подходит для обрезки по разрыву оценок"""
+        if not hits:
+            return hits
+        with metrics.QDRANT_DURATION.time(operation='query_dense_scores'):
+            points = self.client.query_points(
+                collection_name=self.collection_name,
+                query=query_embedding,
+                query_filter=Filter(must=[HasIdCondition(has_id=[hit.id for hit in hits])]),
+                limit=len(hits),
+                search_params=self._search_params(),
+                with_payload=False,
+                with_vectors=False,
+            ).points
+        dense_scores = {point.id: point.score for point in points}
+        return [hit._replace(dense_score=dense_scores.get(hit.id)) for hit in hits]
 
-        return dot_product / (norm1 * norm2)
+    @staticmethod
+    def _format_results(scored_points, dense: bool = True) -> List[SearchHit]:
+        """Преобразует найденные точки в SearchHit; dense — оценки точек являются косинусной схожестью"""
+        return [SearchHit(point.id, point.score, point.payload['content'], point.payload['source_url'],
+                          tuple(point.payload.get('url_aliases') or ()), point.score if dense else None)
+                for point in scored_points]
 
     def clear_collection(self):
         """Очищает коллекцию"""
         try:
             self.client.delete_collection(self.collection_name)
-            self._setup_collection()
+            if self._collection_exists(self.sources_collection_name):
+                self.client.delete_collection(self.sources_collection_name)
+            # Коллекция будет создана заново при следующей записи или поиске
+            self._collection_ready = False
+            self._has_source_index = False
             logger.info(f"Коллекция '{self.collection_name}' очищена")
         except Exception as e:
             logger.error(f"Ошибка при очистке коллекции: {e}")
             raise
-    def delete_by_date(self, max_date: str):
-        """Удаляет документы, обработанные до указанной даты"""
-        self._ensure_collection()
+    def delete_by_url(self, url: str):
+        """Удаляет все блоки источника, записанного под указанным каноническим URL
+        (источники, у которых этот URL только псевдоним, не затрагиваются)"""
+        if not self._collection_exists():
+            return
         try:
-            self.client.delete(
-                collection_name=self.collection_name,
-                points_selector=FilterSelector(
-                    filter=Filter(
-                        must=[
-                            FieldCondition(
-                                key="processing_date",
-                                range=Range(lt=max_date))
-                        ]
+            url = canonicalize_url(url)
+            for collection_name in self._collections():
+                self.client.delete(
+                    collection_name=collection_name,
+                    points_selector=FilterSelector(
+                        filter=Filter(must=[FieldCondition(key="source_url", match=MatchValue(value=url))])
                     )
                 )
-            )
-            logger.info(f"Удалены документы, обработанные до {max_date}")
+            logger.info(f"Удалены документы источника {url}")
+        except Exception as e:
+            logger.error(f"Ошибка при удалении документов источника: {e}")
+            raise
+    def delete_by_date(self, max_date: str) -> int:
+        """Удаляет документы, обработанные до указанной даты (YYYY-MM-DD или ISO); возвращает число удалённых"""
+        if not self._collection_exists():
+            return 0
+        before = datetime.fromisoformat(max_date).timestamp()
+        try:
+            self.backfill_timestamps()
+            date_filter = Filter(must=[FieldCondition(key="processing_ts", range=Range(lt=before))])
+            deleted = self.delete_matching(date_filter)
+            self._delete_sources_matching(date_filter)
+            logger.info(f"Удалено {deleted} документов, обработанных до {max_date}")
+            return deleted
         except Exception as e:
             logger.error(f"Ошибка при удалении по дате: {e}")
             raise
+
+    def delete_expired(self, filters: List[Filter]) -> int:
+        """Удаляет блоки, подходящие хотя бы под один из фильтров срока хранения; возвращает число удалённых"""
+        if not filters or not self._collection_exists():
+            return 0
+        self.backfill_timestamps()
+        deleted = sum(self.delete_matching(points_filter) for points_filter in filters)
+        for points_filter in filters:
+            self._delete_sources_matching(points_filter)
+        return deleted
+
+    def _collections(self) -> List[str]:
+        """Основная коллекция и, если есть, коллекция векторов источников"""
+        names = [self.collection_name]
+        if self._collection_exists(self.sources_collection_name):
+            names.append(self.sources_collection_name)
+        return names
+
+    def _delete_sources_matching(self, points_filter: Filter) -> None:
+        """Удаляет векторы источников по тому же фильтру (по сроку хранения: processing_ts, source_host)"""
+        if self._collection_exists(self.sources_collection_name):
+            self.delete_matching(points_filter, collection_name=self.sources_collection_name)
+
+    def delete_matching(self, points_filter: Filter, batch_size: int = None, collection_name: str = None) -> int:
+        """Удаляет точки, подходящие под фильтр, пачками по batch_size; возвращает число удалённых"""
+        batch_size = batch_size or config.RETENTION_BATCH_SIZE
+        collection_name = collection_name or self.collection_name
+        deleted = 0
+        while True:
+            # Удалённые точки в выборку больше не попадают, поэтому каждый раз читается первая страница
+            with metrics.QDRANT_DURATION.time(operation='scroll'):
+                points, _ = self.client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=points_filter,
+                    limit=batch_size,
+                    with_payload=False,
+                    with_vectors=False
+                )
+            if not points:
+                return deleted
+            with metrics.QDRANT_DURATION.time(operation='delete'):
+                self.client.delete(
+                    collection_name=collection_name,
+                    points_selector=PointIdsList(points=[point.id for point in points])
+                )
+            deleted += len(points)
+
+    def backfill_timestamps(self, batch_size: int = None) -> int:
+        """Дописывает processing_ts и source_host точкам, записанным до их появления (только processing_date)"""
+        batch_size = batch_size or config.RETENTION_BATCH_SIZE
+        updated = 0
+        while True:
+            points, _ = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="processing_ts"))]),
+                limit=batch_size,
+                with_payload=['processing_date', 'source_url'],
+                with_vectors=False
+            )
+            if not points:
+                break
+            operations = []
+            for point in points:
+                processing_date = point.payload.get('processing_date')
+                timestamp = datetime.fromisoformat(processing_date).timestamp() if processing_date else 0.0
+                operations.append(SetPayloadOperation(set_payload=SetPayload(
+                    payload={'processing_ts': timestamp, 'source_host': _host_of(point.payload.get('source_url', ''))},
+                    points=[point.id]
+                )))
+            self.client.batch_update_points(collection_name=self.collection_name, update_operations=operations)
+            updated += len(points)
+        if updated:
+            logger.info(f"Добавлены числовые отметки времени для {updated} документов")
+        return updated
+
+    def sources_processed_before(self, timestamp: float) -> set:
+        """URL (и их псевдонимы) источников, проиндексированных раньше timestamp (по блоку с chunk_index = 0)"""
+        if not self._collection_exists():
+            return set()
+        self.backfill_timestamps()
+        urls = set()
+        offset = None
+        while True:
+            with metrics.QDRANT_DURATION.time(operation='scroll'):
+                points, offset = self.client.scroll(
+                    collection_name=self.collection_name,
+                    scroll_filter=Filter(must=[
+                        FieldCondition(key="chunk_index", match=MatchValue(value=0)),
+                        FieldCondition(key="processing_ts", range=Range(lt=timestamp)),
+                    ]),
+                    limit=1000,
+                    offset=offset,
+                    with_payload=['source_url', 'url_aliases'],
+                    with_vectors=False
+                )
+            for point in points:
+                urls.add(point.payload.get('source_url'))
+                urls.update(point.payload.get('url_aliases') or ())
+            if offset is None:
+                return urls
+
+    def rebuild_source_index(self, batch_size: int = 256) -> int:
+        """Заново строит коллекцию векторов источников по сохранённым векторам блоков (без повторной
+        векторизации); возвращает число источников"""
+        self._ensure_collection()
+        self.backfill_timestamps()
+        if self._collection_exists(self.sources_collection_name):
+            self.client.delete_collection(self.sources_collection_name)
+        self._create_sources_collection(self._get_vector_dimension())
+        self._has_source_index = True
+
+        built = 0
+        offset = None
+        while True:
+            # Пачка источников (по блоку с chunk_index = 0), затем все их блоки с векторами
+            heads, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=Filter(must=[FieldCondition(key="chunk_index", match=MatchValue(value=0))]),
+                limit=batch_size,
+                offset=offset,
+                with_payload=['source_url', 'url_aliases', 'processing_ts'],
+                with_vectors=False
+            )
+            vectors: Dict[str, List[List[float]]] = {head.payload['source_url']: [] for head in heads}
+            chunk_offset = None
+            while vectors:
+                points, chunk_offset = self.client.scroll(
+                    collection_name=self.collection_name,
+                    scroll_filter=Filter(must=[FieldCondition(key="source_url", match=MatchAny(any=list(vectors)))]),
+                    limit=1000,
+                    offset=chunk_offset,
+                    with_payload=['source_url'],
+                    with_vectors=True
+                )
+                for point in points:
+                    vector = point.vector.get('') if isinstance(point.vector, dict) else point.vector
+                    vectors[point.payload['source_url']].append(vector)
+                if chunk_offset is None:
+                    break
+            source_points = [self._source_point(head.payload['source_url'], vectors[head.payload['source_url']],
+                                                head.payload.get('url_aliases'), head.payload.get('processing_ts') or 0.0)
+                             for head in heads]
+            for batch in self._batches(source_points):
+                self.client.upsert(collection_name=self.sources_collection_name, points=batch)
+            built += len(source_points)
+            if offset is None:
+                break
+        logger.info(f"Коллекция векторов источников '{self.sources_collection_name}' построена: {built} источников")
+        return built
+
     def get_collection_info(self) -> Dict[str, Any]:
         """Возвращает информацию о коллекции"""
-        self._ensure_collection()
+        if not self._collection_exists():
+            return {'name': self.collection_name, 'vectors_count': 0}
         try:
             info = self.client.get_collection(self.collection_name)
             return {
                 'name': self.collection_name,
-                'vectors_count': info.vectors_count,
+                'vectors_count': getattr(info, 'vectors_count', None) or info.points_count,
                 'vector_size': info.config.params.vectors.size,
                 'distance': info.config.params.vectors.distance
             }
@@ -1,58 +1,146 @@
 
 import requests
+from requests.utils import get_encoding_from_headers
+from requests.compat import chardet
 from bs4 import BeautifulSoup
 import logging
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import time
 import re
+import config
+from utils.page_cache import PageCache
+from utils.fetch_scheduler import HostScheduler
+from utils.url_canon import canonicalize_url, resolve_canonical, url_aliases
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
+
+def read_limited(response: requests.Response, max_bytes: int, url: str, truncate: bool = False) -> Optional[bytes]:
+    """Читает тело потокового ответа не больше max_bytes.
+
+    Ответ больше лимита отклоняется (None), если о размере известно из Content-Length — ещё до чтения
+    тела. С truncate=True вместо этого возвращается начало ответа (для robots.txt)."""
+    if not truncate:
+        try:
+            declared = int(response.headers.get('Content-Length', ''))
+        except ValueError:
+            declared = None
+        if declared is not None and declared > max_bytes:
+            logger.warning(f"Ответ {url} ({declared} байт по Content-Length) превышает {max_bytes} байт")
+            return None
+
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            if not truncate:
+                logger.warning(f"Ответ {url} превышает {max_bytes} байт")
+                return None
+            logger.warning(f"Ответ {url} превышает {max_bytes} байт, прочитано только начало")
+            break
+    return b''.join(chunks)[:max_bytes]
+
+
+class ParsedPage(NamedTuple):
+    """Текст загруженной страницы и URL, под которым она индексируется"""
+    url: str            # Канонический URL (rel=canonical или конечный URL после перенаправлений)
+    content: str
+    aliases: List[str]  # Другие канонические формы той же страницы (запрошенный URL, перенаправления)
+
+
 class WebParser:
     """Класс для парсинга веб-страниц"""
 
-    def __init__(self):
+    def __init__(self, page_cache: PageCache = None, offline: bool = False, scheduler: HostScheduler = None):
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
         self.timeout = 30
         self.max_retries = 3
+        self.max_bytes = config.FETCH_MAX_BYTES
+        self.charset_detect_bytes = config.CHARSET_DETECT_BYTES
+        self.allowed_content_types = {t.strip().lower() for t in config.FETCH_ALLOWED_CONTENT_TYPES.split(',') if t.strip()}
+
+        # Кэш сырых страниц для повторной обработки без сети
+        if page_cache is None and config.PAGE_CACHE_ENABLED:
+            page_cache = PageCache()
+        self.page_cache = page_cache
+        self.offline = offline
+
+        # Планировщик запросов по хостам (лимиты, Retry-After, robots.txt)
+        self.scheduler = scheduler or HostScheduler(session=self.session)
 
     def parse_url(self, url: str) -> Optional[str]:
         """Парсит URL и возвращает текстовый контент"""
+        page = self.fetch(url)
+        return page.content if page else None
+
+    def fetch(self, url: str) -> Optional[ParsedPage]:
+        """Загружает страницу и возвращает её текст вместе с каноническим URL и псевдонимами"""
         try:
-            from utils.vector_db import VectorDatabase
-            vector_db = VectorDatabase()
-    
-            if vector_db.url_exists(url):
-                processing_date = vector_db.get_processing_date(url)
-                logger.info(f"Ссылка уже обработана: {url} (дата обработки: {processing_date})")
-                return None  # Пропускаем обработку
+            # Проверка наличия URL в векторной БД выполняется вызывающим кодом (агентом)
+            if self.offline:
+                return self.fetch_cached(url)
+
+            if not self.scheduler.can_fetch(url):
+                logger.warning(f"Загрузка запрещена robots.txt: {url}")
+                return None
+
             logger.info(f"Парсинг URL: {url}")
+            host = self.scheduler.host_of(url)
 
             for attempt in range(self.max_retries):
                 try:
-                    response = self.session.get(url, timeout=self.timeout)
-                    response.raise_for_status()
-
-                    # Определяем кодировку
-                    if response.encoding == 'ISO-8859-1' and 'charset' not in response.headers.get('content-type', ''):
-                        response.encoding = response.apparent_encoding
-
-                    content = self._extract_text_content(response.text)
+                    self.scheduler.acquire(url)
+                    fetch_start = time.perf_counter()
+                    with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                        metrics.FETCH_REQUESTS.inc(host=host, status=response.status_code)
+                        if response.status_code in (429, 503):
+                            # Сервер просит снизить нагрузку: откладываем все запросы к этому хосту
+                            delay = self.scheduler.retry_after(response)
+                            self.scheduler.defer(url, delay if delay is not None else 2 ** (attempt + 1))
+                            logger.warning(f"Попытка {attempt + 1}/{self.max_retries}: {url} вернул {response.status_code}")
+                            continue
+                        response.raise_for_status()
+
+                        # Отклоняем PDF, изображения и прочие не-HTML ответы до загрузки тела
+                        content_type = response.headers.get('content-type', '')
+                        if not self._is_allowed_content_type(content_type):
+                            logger.warning(f"Пропущен {url}: неподдерживаемый тип содержимого '{content_type}'")
+                            metrics.FETCH_SKIPPED.inc(reason='content_type')
+                            return None
+
+                        # Обрезанная страница проиндексировалась бы как полная, поэтому слишком большие пропускаются
+                        body = read_limited(response, self.max_bytes, url)
+                        if body is None:
+                            metrics.FETCH_SKIPPED.inc(reason='too_large')
+                            return None
+                        headers = dict(response.headers)
+                        final_url = response.url
+                    metrics.FETCH_DURATION.observe(time.perf_counter() - fetch_start, host=host)
+                    metrics.FETCH_BYTES.inc(len(body), host=host)
+
+                    if self.page_cache is not None:
+                        self.page_cache.put(url, body, headers, final_url=final_url)
+
+                    content, canonical_href = self._extract_page(self._decode_body(body, headers))
 
                     if content:
                         logger.info(f"Успешно извлечен контент из {url} ({len(content)} символов)")
-                        return content
+                        return self._page(url, final_url, canonical_href, content)
                     else:
                         logger.warning(f"Не удалось извлечь текстовый контент из {url}")
                         return None
 
                 except requests.exceptions.RequestException as e:
+                    metrics.FETCH_REQUESTS.inc(host=host, status='error')
                     logger.warning(f"Попытка {attempt + 1}/{self.max_retries} не удалась для {url}: {e}")
                     if attempt < self.max_retries - 1:
-                        time.sleep(2 ** attempt)  # Экспоненциальная задержка
+                        self.scheduler.defer(url, 2 ** attempt)  # Экспоненциальная задержка для хоста
                     continue
 
             logger.error(f"Не удалось загрузить {url} после {self.max_retries} попыток")
@@ -62,10 +150,55 @@ class WebParser:
             logger.error(f"Ошибка при парсинге {url}: {e}")
             return None
 
+    def parse_cached(self, url: str) -> Optional[str]:
+        """Извлекает текстовый контент из сохранённой копии страницы без обращения к сети"""
+        page = self.fetch_cached(url)
+        return page.content if page else None
+
+    def fetch_cached(self, url: str) -> Optional[ParsedPage]:
+        """Как fetch, но из сохранённой копии страницы без обращения к сети"""
+        if self.page_cache is None:
+            logger.warning("Кэш страниц отключен, обработка из кэша невозможна")
+            return None
+        page = self.page_cache.get(url)
+        if page is None:
+            logger.warning(f"Страница отсутствует в кэше: {url}")
+            return None
+        logger.info(f"Парсинг URL из кэша: {url} (загружено {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(page.fetched_at))})")
+        content, canonical_href = self._extract_page(self._decode_body(page.body, page.headers))
+        return self._page(url, page.final_url, canonical_href, content) if content else None
+
+    @staticmethod
+    def _page(url: str, final_url: Optional[str], canonical_href: Optional[str], content: str) -> ParsedPage:
+        canonical = resolve_canonical(url, final_url, canonical_href)
+        if canonical != canonicalize_url(url):
+            logger.info(f"Канонический URL страницы {url}: {canonical}")
+        return ParsedPage(canonical, content, url_aliases(canonical, (url, final_url)))
+
+    def _is_allowed_content_type(self, content_type: str) -> bool:
+        """Проверяет тип содержимого по списку разрешённых (пустой заголовок допускается)"""
+        mime = content_type.split(';', 1)[0].strip().lower()
+        return not mime or mime in self.allowed_content_types
+
+    def _decode_body(self, body: bytes, headers: Dict[str, str]) -> str:
+        """Декодирует тело ответа по заголовку charset либо по автоопределению кодировки"""
+        lowered = {k.lower(): v for k, v in headers.items()}
+        encoding = get_encoding_from_headers(lowered)
+        if encoding is None or (encoding == 'ISO-8859-1' and 'charset' not in lowered.get('content-type', '')):
+            # Автоопределение кодировки только по началу документа
+            encoding = chardet.detect(body[:self.charset_detect_bytes])['encoding']
+        return body.decode(encoding or 'utf-8', errors='replace')
+
     def _extract_text_content(self, html: str) -> Optional[str]:
         """Извлекает текстовый контент из HTML"""
+        return self._extract_page(html)[0]
+
+    def _extract_page(self, html: str) -> Tuple[Optional[str], Optional[str]]:
+        """Извлекает текстовый контент из HTML и адрес из <link rel="canonical">"""
         try:
             soup = BeautifulSoup(html, 'html.parser')
+            link = soup.find('link', rel='canonical', href=True)
+            canonical_href = link['href'] if link else None
 
             # Удаляем скрипты, стили и другие нетекстовые элементы
             for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'menu']):
@@ -77,11 +210,11 @@ class WebParser:
             # Очистка текста
             text = self._clean_extracted_text(text)
 
-            return text if len(text.strip()) > 100 else None  # Минимальная длина контента
+            return (text if len(text.strip()) > 100 else None), canonical_href  # Минимальная длина контента
 
         except Exception as e:
             logger.error(f"Ошибка при извлечении текста из HTML: {e}")
-            return None
+            return None, None
 
     def _clean_extracted_text(self, text: str) -> str:
         """Очистка извлеченного текста"""